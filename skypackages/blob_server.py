@@ -0,0 +1,208 @@
+from contextlib import contextmanager
+import io
+import threading
+
+from flask import Flask, Response, abort, jsonify, request
+import requests
+from werkzeug.serving import make_server
+
+from skypackages.sync import HttpTransport, MANIFEST_FILE
+from skypackages.utils import compute_file_md5, yaml_dump
+
+
+def read_range(f, start, end, chunk_size=1024 * 1024):
+    # chunked blobs are not seekable, so skip ahead by reading instead
+    try:
+        f.seek(start)
+    except (OSError, io.UnsupportedOperation):
+        remaining = start
+        while remaining:
+            skipped = len(f.read(min(chunk_size, remaining)))
+            if not skipped:
+                return
+            remaining -= skipped
+    remaining = end - start
+    while remaining:
+        data = f.read(min(chunk_size, remaining))
+        if not data:
+            return
+        remaining -= len(data)
+        yield data
+
+
+class SkybuildBlobServer:
+    '''
+    Serves a packages folder over http so that other machines on the LAN
+    can use it as a remote blob tier. Blobs are served by id with Range
+    support and the blob md5 as ETag; `/blobs` lists every blob with its
+    size and md5, and `/find/nexus/...` looks blobs up by their Nexus
+    source. Manifest, records and alias files are laid out like a sync
+    export, so `sync-import` can pull from a running server directly.
+    '''
+    def __init__(self, manager, host='0.0.0.0', port=8770):
+        self.manager = manager
+        self.host = host
+        self.port = port
+        self.app = self.create_app()
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def create_app(self):
+        app = Flask(__name__)
+        manager = self.manager
+
+        @app.route('/blobs')
+        def blobs():
+            return jsonify({
+                blob_id: {
+                    'size': manager.blobs.size(blob_id),
+                    'md5': blob_id[:32]}
+                for blob_id in manager.blobs.blob_ids()})
+
+        @app.route('/blobs/<blob_id>', methods=['GET', 'HEAD'])
+        def blob(blob_id):
+            if not manager.blobs.exists(blob_id):
+                abort(404)
+            # blob ids start with the md5 of their contents, so they make
+            # strong etags
+            etag = blob_id[:32]
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            size = manager.blobs.size(blob_id)
+            start, end, status = 0, size, 200
+            range_ = request.range
+            if range_ and request.if_range.etag in (None, etag):
+                bounds = range_.range_for_length(size)
+                if bounds is None:
+                    response = Response(status=416)
+                    response.headers['Content-Range'] = f'bytes */{size}'
+                    return response
+                start, end = bounds
+                status = 206
+
+            def generate():
+                with manager.blobs.open(blob_id) as f:
+                    yield from read_range(f, start, end)
+
+            response = Response(
+                generate() if request.method == 'GET' else b'',
+                status=status,
+                mimetype='application/octet-stream')
+            response.headers['Content-Length'] = str(end - start)
+            response.headers['Accept-Ranges'] = 'bytes'
+            response.set_etag(etag)
+            if status == 206:
+                response.headers['Content-Range'] = (
+                    f'bytes {start}-{end - 1}/{size}')
+            return response
+
+        @app.route(f'/{MANIFEST_FILE}')
+        def manifest():
+            return Response(
+                yaml_dump(manager.manifest()), mimetype='text/yaml')
+
+        @app.route('/records/<kind>/<blob_id>.yaml')
+        def record(kind, blob_id):
+            stores = {
+                'meta': manager.meta_records,
+                'imports': manager.import_records,
+                'sources': manager.sources.records}
+            if kind not in stores:
+                abort(404)
+            text = stores[kind].get(blob_id)
+            if text is None:
+                abort(404)
+            return Response(text, mimetype='text/yaml')
+
+        @app.route('/aliases/<name>')
+        def aliases(name):
+            files = {
+                path.name: path
+                for path in [
+                    manager.aliases.aliases_file,
+                    manager.aliases.selection_file]}
+            if name not in files or not files[name].exists():
+                abort(404)
+            return Response(files[name].read_text(), mimetype='text/yaml')
+
+        @app.route('/find/nexus/<game>/<int:mod_id>/<int:file_id>')
+        def find_nexus(game, mod_id, file_id):
+            return jsonify(manager.sources.find_nexus(game, mod_id, file_id))
+
+        return app
+
+    def start(self):
+        self.server = make_server(
+            self.host, self.port, self.app, threaded=True)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.thread.join()
+            self.server = None
+            self.thread = None
+
+    def serve_forever(self):
+        self.server = make_server(
+            self.host, self.port, self.app, threaded=True)
+        self.port = self.server.server_port
+        print(f'Serving blobs of {self.manager.root} at {self.url}')
+        self.server.serve_forever()
+
+    @contextmanager
+    def running(self):
+        self.start()
+        try:
+            yield self
+        finally:
+            self.stop()
+
+
+class SkybuildRemoteBlobs:
+    '''
+    Client side of `SkybuildBlobServer`, used by the package manager as a
+    read-through tier: blobs missing locally are looked for on the remote
+    before anything gets downloaded from Nexus
+    '''
+    def __init__(self, url, timeout=10):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.transport = HttpTransport(self.url)
+
+    def find_nexus(self, game, mod_id, file_id):
+        response = self.transport.session.get(
+            f'{self.url}/find/nexus/{game}/{mod_id}/{file_id}',
+            timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def exists(self, blob_id):
+        response = self.transport.session.head(
+            f'{self.url}/blobs/{blob_id}', timeout=self.timeout)
+        return response.status_code == 200
+
+    def fetch(self, blob_id, dest):
+        '''
+        Downloads a blob into `dest`, resuming a partial download left there
+        earlier, and verifies it against its md5
+        '''
+        self.transport.fetch(f'blobs/{blob_id}', dest)
+        md5 = compute_file_md5(dest, chunk_size=8 * 1024 * 1024)
+        if md5 != blob_id[:32]:
+            dest.unlink()
+            raise requests.RequestException(
+                f'blob {blob_id} from {self.url} failed verification; got md5 '
+                f'{md5}')
+        return dest
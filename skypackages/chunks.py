@@ -0,0 +1,295 @@
+import hashlib
+import io
+import os
+from pathlib import Path
+import threading
+
+from skypackages.utils import atomic_write, yaml_dump, yaml_load
+
+# content-defined chunking is done by the fastcdc package (see
+# requirements.txt); without it we fall back on a much slower pure python
+# implementation of the same idea
+try:
+    from fastcdc import fastcdc
+except ImportError:
+    fastcdc = None
+
+
+MIN_CHUNK_SIZE = 16 * 1024
+AVG_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 256 * 1024
+
+GEAR = [
+    int.from_bytes(hashlib.md5(bytes([i])).digest()[:8], 'little')
+    for i in range(256)]
+
+
+def gear_chunks(file_path, min_size=MIN_CHUNK_SIZE, avg_size=AVG_CHUNK_SIZE,
+                max_size=MAX_CHUNK_SIZE):
+    '''
+    Pure python content-defined chunking with a gear rolling hash; a chunk
+    ends where the top bits of the hash are all zero, so boundaries follow
+    the content and survive insertions and deletions elsewhere in the file
+    '''
+    mask = (avg_size - 1) << (64 - avg_size.bit_length() + 1)
+    limit = (1 << 64) - 1
+    gear = GEAR
+    with open(str(file_path), 'rb') as f:
+        # chunks are cut at an offset into the buffer, which only gets
+        # trimmed when refilling it, rather than re-slicing the remainder
+        # after every chunk
+        buffer = bytearray()
+        start = 0
+        eof = False
+        while True:
+            if not eof and len(buffer) - start < max_size:
+                del buffer[:start]
+                start = 0
+                data = f.read(max_size * 4)
+                eof = not data
+                buffer += data
+            available = len(buffer) - start
+            if not available:
+                return
+            end = start + min(available, max_size)
+            cut = end
+            hash_ = 0
+            for i in range(start + min(min_size, end - start), end):
+                hash_ = ((hash_ << 1) + gear[buffer[i]]) & limit
+                if not hash_ & mask:
+                    cut = i + 1
+                    break
+            if cut == end and end - start < max_size and not eof:
+                # not enough data buffered to find a boundary yet
+                continue
+            yield bytes(buffer[start:cut])
+            start = cut
+
+
+def iter_chunks(file_path):
+    if fastcdc is not None:
+        for chunk in fastcdc(
+                str(file_path), MIN_CHUNK_SIZE, AVG_CHUNK_SIZE,
+                MAX_CHUNK_SIZE, fat=True):
+            yield chunk.data
+    else:
+        yield from gear_chunks(file_path)
+
+
+class ChunkStore:
+    '''
+    Stores blobs as lists of content-defined chunks, deduplicated by sha256
+    across all blobs. Chunks are appended to a few large pack files, and an
+    append-only text index maps each chunk digest to its pack, offset and
+    length. Each blob has a small recipe listing its size and chunks, which
+    is all that is needed to reconstruct or stream it.
+    '''
+    PACK_SIZE_LIMIT = 1024 ** 3
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.packs = self.root / 'packs'
+        self.recipes = self.root / 'recipes'
+        self.index_file = self.root / 'index.txt'
+        self.packs.mkdir(parents=True, exist_ok=True)
+        self.recipes.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            index = {}
+            if self.index_file.exists():
+                for line in self.index_file.read_text().splitlines():
+                    digest, pack, offset, length = line.split()
+                    index[digest] = (pack, int(offset), int(length))
+            self._index = index
+        return self._index
+
+    def recipe_file(self, blob_id):
+        return self.recipes / f'{blob_id}.yaml'
+
+    def recipe(self, blob_id):
+        return yaml_load(self.recipe_file(blob_id).read_text())
+
+    def exists(self, blob_id):
+        return self.recipe_file(blob_id).exists()
+
+    def blob_ids(self):
+        return [path.name[:-len('.yaml')] for path in self.recipes.iterdir()]
+
+    def next_pack_number(self):
+        # pack names are never reused, so a pack the index does not point
+        # at yet can't be mistaken for one it does
+        packs = sorted(self.packs.glob('*.pack'))
+        return int(packs[-1].stem) + 1 if packs else 0
+
+    def current_pack(self):
+        packs = sorted(self.packs.glob('*.pack'))
+        if packs and packs[-1].stat().st_size < self.PACK_SIZE_LIMIT:
+            return packs[-1]
+        return self.packs / f'{self.next_pack_number():06d}.pack'
+
+    def add(self, blob_id, file_path):
+        digests = []
+        size = 0
+        with self.lock:
+            index = self.index
+            pack = self.current_pack()
+            with open(str(pack), 'ab') as pack_file, \
+                    open(str(self.index_file), 'a') as index_file:
+                for data in iter_chunks(file_path):
+                    digest = hashlib.sha256(data).hexdigest()
+                    digests.append(digest)
+                    size += len(data)
+                    if digest in index:
+                        continue
+                    offset = pack_file.tell()
+                    pack_file.write(data)
+                    index[digest] = (pack.name, offset, len(data))
+                    index_file.write(
+                        f'{digest} {pack.name} {offset} {len(data)}\n')
+                pack_file.flush()
+                os.fsync(pack_file.fileno())
+        atomic_write(
+            self.recipe_file(blob_id),
+            yaml_dump({'size': size, 'chunks': digests}))
+
+    def read_chunk(self, digest, pack_files=None):
+        pack, offset, length = self.index[digest]
+        if pack_files is not None and pack in pack_files:
+            pack_file = pack_files[pack]
+        else:
+            pack_file = open(str(self.packs / pack), 'rb')
+            if pack_files is not None:
+                pack_files[pack] = pack_file
+        pack_file.seek(offset)
+        data = pack_file.read(length)
+        if pack_files is None:
+            pack_file.close()
+        return data
+
+    def open(self, blob_id):
+        return io.BufferedReader(ChunkReader(self, self.recipe(blob_id)))
+
+    def materialize(self, blob_id, dest):
+        dest = Path(dest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.parent / f'{dest.name}.tmp{threading.get_ident()}'
+        with self.open(blob_id) as reader, open(str(tmp), 'wb') as f:
+            for data in iter(lambda: reader.read(1024 * 1024), b''):
+                f.write(data)
+        tmp.replace(dest)
+        return dest
+
+    def remove(self, blob_id):
+        # chunks are only reclaimed by compact(), since other blobs may
+        # still be using them
+        self.recipe_file(blob_id).unlink()
+
+    def size(self, blob_id):
+        return self.recipe(blob_id)['size']
+
+    def stats(self):
+        recipes = [self.recipe(blob_id) for blob_id in self.blob_ids()]
+        logical = sum(recipe['size'] for recipe in recipes)
+        referenced = {
+            digest for recipe in recipes for digest in recipe['chunks']}
+        stored = sum(self.index[digest][2] for digest in referenced)
+        packed = sum(path.stat().st_size for path in self.packs.glob('*.pack'))
+        return {
+            'blobs': len(recipes),
+            'chunks': len(referenced),
+            'logical_bytes': logical,
+            'stored_bytes': stored,
+            'pack_bytes': packed,
+            'saved_bytes': logical - packed
+        }
+
+    def compact(self):
+        '''
+        Rewrites the pack files keeping only chunks that some recipe still
+        references; returns the number of bytes reclaimed. New packs get
+        fresh names and the index is switched over to them atomically
+        before the old packs are deleted, so the store stays readable if
+        this is interrupted at any point.
+        '''
+        with self.lock:
+            referenced = []
+            seen = set()
+            for blob_id in self.blob_ids():
+                for digest in self.recipe(blob_id)['chunks']:
+                    if digest not in seen:
+                        seen.add(digest)
+                        referenced.append(digest)
+
+            old_packs = sorted(self.packs.glob('*.pack'))
+            before = sum(path.stat().st_size for path in old_packs)
+            new_index = {}
+            new_packs = []
+            pack_number = self.next_pack_number()
+            pack_file = None
+            pack_files = {}
+            try:
+                for digest in referenced:
+                    if pack_file is None or (
+                            pack_file.tell() >= self.PACK_SIZE_LIMIT):
+                        if pack_file:
+                            pack_file.close()
+                        pack_name = f'{pack_number:06d}.pack'
+                        pack_file = open(str(self.packs / pack_name), 'wb')
+                        new_packs.append(pack_file)
+                        pack_number += 1
+                    data = self.read_chunk(digest, pack_files)
+                    new_index[digest] = (
+                        pack_name, pack_file.tell(), len(data))
+                    pack_file.write(data)
+                for f in new_packs:
+                    f.flush()
+                    os.fsync(f.fileno())
+            finally:
+                for f in new_packs:
+                    f.close()
+                for f in pack_files.values():
+                    f.close()
+
+            atomic_write(self.index_file, ''.join(
+                f'{digest} {pack} {offset} {length}\n'
+                for digest, (pack, offset, length) in new_index.items()),
+                sync=True)
+            self._index = new_index
+            for path in old_packs:
+                path.unlink()
+
+            after = sum(
+                path.stat().st_size for path in self.packs.glob('*.pack'))
+            return before - after
+
+
+class ChunkReader(io.RawIOBase):
+    def __init__(self, store, recipe):
+        self.store = store
+        self.chunks = iter(recipe['chunks'])
+        self.pack_files = {}
+        self.pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            digest = next(self.chunks, None)
+            if digest is None:
+                return 0
+            self.pending = self.store.read_chunk(digest, self.pack_files)
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+    def close(self):
+        for f in self.pack_files.values():
+            f.close()
+        self.pack_files = {}
+        super().close()
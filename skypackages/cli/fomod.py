@@ -1,6 +1,13 @@
 import click
+from pathlib import Path
+import sys
+import pyfomod
 
+from skypackages.fomod import fomod_to_data, simulate_fomod
+from skypackages.fomod_analysis import FomodConfigurationAnalyzer
+from skypackages.fomod_plan import folder_expander
 from skypackages.ui.fomod import FomodInstallerGui
+from skypackages.utils import yaml_dump, yaml_load
 
 
 @click.group(context_settings={'help_option_names': ['-h', '--help']})
@@ -13,3 +20,25 @@ def cli():
 def gui(fomod_root):
     fomod_installer_gui = FomodInstallerGui(fomod_root)
     fomod_installer_gui.run()
+
+
+@cli.command('replay')
+@click.argument('fomod_root')
+@click.argument('choices_file')
+def replay(fomod_root, choices_file):
+    result = simulate_fomod(
+        fomod_root, yaml_load(Path(choices_file).read_text()))
+    print(yaml_dump(result))
+    if result['errors']:
+        sys.exit(1)
+
+
+@cli.command('outcomes')
+@click.argument('fomod_root')
+@click.option('--max-seconds', type=float, default=30)
+@click.option('--max-steps', type=int, default=1000000)
+def outcomes(fomod_root, max_seconds, max_steps):
+    data = fomod_to_data(pyfomod.parse(fomod_root))
+    print(yaml_dump(FomodConfigurationAnalyzer(
+        data, max_seconds=max_seconds, max_steps=max_steps,
+        expand=folder_expander(fomod_root)).analyze()))
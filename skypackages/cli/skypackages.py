@@ -1,8 +1,18 @@
 import click
 from pathlib import Path
+import tempfile
+import sys
+from pynxm import Nexus
 
+from skypackages.blob_server import SkybuildBlobServer
+from skypackages.fomod import load_fomod_data
+from skypackages.manager import SkybuildPackageManager
+from skypackages.nexus import NexusRequestScheduler
+from skypackages.nexus_mock import NexusMockServer, run_download_benchmark
 from skypackages.ui.skypackages import SkyPackagesGui
 from skypackages.ui.fomod import FomodInstallerGui
+from skypackages.utils import parse_size, yaml_dump, yaml_load
+from skypackages.views import VIEW_BACKENDS
 
 
 @click.group(context_settings={'help_option_names': ['-h', '--help']})
@@ -22,6 +32,313 @@ def gui(packages_folder, api_key, aliases_folder):
 
 @cli.command('fomod')
 @click.argument('fomod_root')
-def fomod(fomod_root):
-    fomod_installer_gui = FomodInstallerGui(fomod_root)
+@click.option('--cached', help='cached fomod data and archive listing to '
+                               'run from, as written by the fomod preview')
+def fomod(fomod_root, cached):
+    fomod_installer_gui = FomodInstallerGui(
+        fomod_root,
+        cached=load_fomod_data(Path(cached).read_text()) if cached else None)
     fomod_installer_gui.run()
+
+
+@cli.command('rebuild-view')
+@click.argument('packages_folder')
+@click.option('--mode', type=click.Choice(['auto', *VIEW_BACKENDS]),
+              default='auto')
+@click.option('--workers', type=int, default=8)
+@click.option('--dry-run', is_flag=True)
+def rebuild_view(packages_folder, mode, workers, dry_run):
+    manager = SkybuildPackageManager(
+        Path(packages_folder).resolve(), view_mode=mode)
+    print(yaml_dump(manager.rebuild_view(workers=workers, dry_run=dry_run)))
+
+
+@cli.command('gc')
+@click.argument('packages_folder')
+@click.option('--aliases-folder')
+@click.option('--pin', 'pinned', multiple=True,
+              help='recipe yaml whose packages must be kept; may be repeated')
+@click.option('--download-cache-budget',
+              help='max size of the download cache, e.g. 20G')
+@click.option('--dry-run', is_flag=True)
+@click.option('--force', is_flag=True,
+              help='collect even without any aliases, evicting every blob')
+def gc(packages_folder, aliases_folder, pinned, download_cache_budget,
+       dry_run, force):
+    manager = SkybuildPackageManager(
+        Path(packages_folder).resolve(), aliases_folder=aliases_folder)
+    print(yaml_dump(manager.collect_garbage(
+        pinned=pinned,
+        download_cache_budget=(
+            parse_size(download_cache_budget)
+            if download_cache_budget else None),
+        dry_run=dry_run,
+        force=force)))
+
+
+@cli.command('fsck')
+@click.argument('packages_folder')
+@click.option('--aliases-folder')
+@click.option('--workers', type=int, default=4)
+@click.option('--full', is_flag=True,
+              help='rehash every blob, not just changed or stale ones')
+def fsck(packages_folder, aliases_folder, workers, full):
+    manager = SkybuildPackageManager(
+        Path(packages_folder).resolve(), aliases_folder=aliases_folder)
+    result = manager.fsck(workers=workers, full=full)
+    print(yaml_dump(result))
+    if not result['ok']:
+        sys.exit(1)
+
+
+@cli.command('find-duplicates')
+@click.argument('packages_folder')
+@click.option('--aliases-folder')
+@click.option('--threshold', type=float, default=0.8,
+              help='minimum file list similarity, between 0 and 1')
+@click.option('--index-missing', is_flag=True,
+              help='list the contents of blobs without stored metadata, '
+                   'running 7z on each')
+def find_duplicates(packages_folder, aliases_folder, threshold,
+                    index_missing):
+    manager = SkybuildPackageManager(
+        Path(packages_folder).resolve(), aliases_folder=aliases_folder)
+    print(yaml_dump(manager.find_near_duplicates(
+        threshold=threshold, index_missing=index_missing)))
+
+
+@cli.command('fomod-check')
+@click.argument('packages_folder')
+@click.argument('choices_file', required=False)
+@click.option('--aliases-folder')
+@click.option('--alias', 'aliases', multiple=True,
+              help='only check this alias; may be repeated')
+@click.option('--workers', type=int, default=4)
+def fomod_check(packages_folder, choices_file, aliases_folder, aliases,
+                workers):
+    '''
+    Replays fomod choices (a yaml mapping of alias to the selections
+    rendered by the fomod wizard) against the selected fomod blobs
+    '''
+    manager = SkybuildPackageManager(
+        Path(packages_folder).resolve(), aliases_folder=aliases_folder)
+    choices_by_alias = (
+        yaml_load(Path(choices_file).read_text()) or {}
+        if choices_file else {})
+    result = manager.simulate_fomods(
+        choices_by_alias=choices_by_alias,
+        aliases=list(aliases) or None,
+        workers=workers)
+    print(yaml_dump(result))
+    if result['failed']:
+        sys.exit(1)
+
+
+@cli.command('fomod-outcomes')
+@click.argument('packages_folder')
+@click.argument('alias_or_blob_id')
+@click.option('--aliases-folder')
+@click.option('--max-seconds', type=float, default=30)
+@click.option('--max-steps', type=int, default=1000000)
+def fomod_outcomes(packages_folder, alias_or_blob_id, aliases_folder,
+                   max_seconds, max_steps):
+    '''
+    Lists the distinct sets of files a fomod can install, and the choices
+    leading to each
+    '''
+    manager = SkybuildPackageManager(
+        Path(packages_folder).resolve(), aliases_folder=aliases_folder)
+    blob_id = (
+        manager.aliases.get_selection(alias_or_blob_id) or alias_or_blob_id)
+    print(yaml_dump(manager.analyze_fomod(
+        blob_id, max_seconds=max_seconds, max_steps=max_steps)))
+
+
+@cli.command('fomod-plan')
+@click.argument('packages_folder')
+@click.argument('choices_file')
+@click.option('--aliases-folder')
+@click.option('--summary', is_flag=True,
+              help='only print the total size and file count of each plan')
+def fomod_plan(packages_folder, choices_file, aliases_folder, summary):
+    '''
+    Resolves fomod choices (a yaml mapping of alias to the selections
+    rendered by the fomod wizard) into the files each fomod would install,
+    and where they conflict, without extracting anything
+    '''
+    manager = SkybuildPackageManager(
+        Path(packages_folder).resolve(), aliases_folder=aliases_folder)
+    result = manager.fomod_install_plans(
+        yaml_load(Path(choices_file).read_text()) or {})
+    if summary:
+        result['plans'] = {
+            alias: {
+                'files': len(plan.get('files') or []),
+                'total_size': plan.get('total_size', 0),
+                'errors': plan['errors']}
+            for alias, plan in result['plans'].items()}
+    print(yaml_dump(result))
+    if any(plan['errors'] for plan in result['plans'].values()):
+        sys.exit(1)
+
+
+@cli.command('chunk-store')
+@click.argument('packages_folder')
+@click.option('--convert', is_flag=True,
+              help='switch to chunked storage and move all blobs into it')
+@click.option('--compact', is_flag=True,
+              help='drop chunks no longer used by any blob')
+def chunk_store(packages_folder, convert, compact):
+    manager = SkybuildPackageManager(Path(packages_folder).resolve())
+    if convert:
+        manager.use_chunk_storage()
+    if compact:
+        print(f'reclaimed {manager.blobs.chunk_store.compact()} bytes')
+    print(yaml_dump(manager.blobs.chunk_store.stats()))
+
+
+@cli.command('pack-records')
+@click.argument('packages_folder')
+@click.option('--compact', is_flag=True,
+              help='drop superseded and deleted records from the packs')
+def pack_records(packages_folder, compact):
+    manager = SkybuildPackageManager(Path(packages_folder).resolve())
+    print(yaml_dump({'packed': manager.pack_records()}))
+    if compact:
+        print(yaml_dump({'reclaimed_bytes': manager.compact_records()}))
+
+
+@cli.command('sync-manifest')
+@click.argument('packages_folder')
+@click.argument('manifest_file')
+@click.option('--aliases-folder')
+def sync_manifest(packages_folder, aliases_folder, manifest_file):
+    manager = SkybuildPackageManager(
+        Path(packages_folder).resolve(), aliases_folder=aliases_folder)
+    Path(manifest_file).write_text(yaml_dump(manager.manifest()))
+
+
+@cli.command('sync-export')
+@click.argument('packages_folder')
+@click.argument('export_folder')
+@click.option('--aliases-folder')
+@click.option('--against', 'target_manifest',
+              help='manifest of the receiving side (see sync-manifest); only '
+                   'what it is missing gets exported')
+@click.option('--workers', type=int, default=4)
+def sync_export(packages_folder, export_folder, aliases_folder,
+                target_manifest, workers):
+    manager = SkybuildPackageManager(
+        Path(packages_folder).resolve(), aliases_folder=aliases_folder)
+    print(yaml_dump(manager.sync_export(
+        Path(export_folder).resolve(),
+        target_manifest=(
+            yaml_load(Path(target_manifest).read_text())
+            if target_manifest else None),
+        workers=workers)))
+
+
+@cli.command('sync-import')
+@click.argument('packages_folder')
+@click.argument('location')
+@click.option('--aliases-folder')
+@click.option('--workers', type=int, default=4)
+@click.option('--dry-run', is_flag=True)
+def sync_import(packages_folder, location, aliases_folder, workers, dry_run):
+    '''
+    Imports an export folder, given as a path or as the url of an http
+    server serving it
+    '''
+    manager = SkybuildPackageManager(
+        Path(packages_folder).resolve(), aliases_folder=aliases_folder)
+    print(yaml_dump(manager.sync_import(
+        location, workers=workers, dry_run=dry_run)))
+
+
+@cli.command('serve')
+@click.argument('packages_folder')
+@click.option('--aliases-folder')
+@click.option('--host', default='0.0.0.0')
+@click.option('--port', type=int, default=8770)
+def serve(packages_folder, aliases_folder, host, port):
+    manager = SkybuildPackageManager(
+        Path(packages_folder).resolve(), aliases_folder=aliases_folder)
+    SkybuildBlobServer(manager, host=host, port=port).serve_forever()
+
+
+@cli.command('remote')
+@click.argument('packages_folder')
+@click.argument('url', required=False)
+@click.option('--clear', is_flag=True)
+def remote(packages_folder, url, clear):
+    '''
+    Shows or sets the `skypackages serve` url used as a remote blob tier
+    '''
+    manager = SkybuildPackageManager(Path(packages_folder).resolve())
+    if url or clear:
+        manager.set_config('remote', None if clear else url)
+    print(manager.config.get('remote'))
+
+
+@cli.command('nexus-budget')
+@click.argument('api_key')
+def nexus_budget(api_key):
+    scheduler = NexusRequestScheduler.for_api(Nexus(api_key))
+    scheduler.call('user_details')
+    print(yaml_dump(scheduler.stats))
+
+
+def parse_mirrors(mirrors):
+    # mirrors are given as NAME=BYTES_PER_SEC, with 0 meaning unthrottled
+    parsed = {}
+    for mirror in mirrors:
+        name, _, bandwidth = mirror.rpartition('=')
+        parsed[name] = int(bandwidth) or None
+    return parsed or None
+
+
+def mock_nexus_options(func):
+    options = [
+        click.option('--mods', type=int, default=10),
+        click.option('--files-per-mod', type=int, default=3),
+        click.option('--file-size-kb', type=int, default=1024),
+        click.option('--latency', type=float, default=0.0),
+        click.option('--mirror', 'mirrors', multiple=True,
+                     help='NAME=BYTES_PER_SEC; may be repeated'),
+        click.option('--hourly-limit', type=int, default=100),
+        click.option('--daily-limit', type=int, default=2500),
+        click.option('--hour-length', type=float, default=3600,
+                     help='seconds in an hour of the request budget')
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+@cli.command('mock-nexus')
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', type=int, default=8765)
+@mock_nexus_options
+def mock_nexus(host, port, mods, files_per_mod, file_size_kb, latency,
+               mirrors, hourly_limit, daily_limit, hour_length):
+    server = NexusMockServer(
+        host=host, port=port, mods=mods, files_per_mod=files_per_mod,
+        file_size_kb=file_size_kb, latency=latency,
+        mirrors=parse_mirrors(mirrors), hourly_limit=hourly_limit,
+        daily_limit=daily_limit, hour_length=hour_length)
+    server.serve_forever()
+
+
+@cli.command('nexus-bench')
+@click.option('--passes', type=int, default=2)
+@mock_nexus_options
+def nexus_bench(passes, mods, files_per_mod, file_size_kb, latency, mirrors,
+                hourly_limit, daily_limit, hour_length):
+    server = NexusMockServer(
+        mods=mods, files_per_mod=files_per_mod, file_size_kb=file_size_kb,
+        latency=latency, mirrors=parse_mirrors(mirrors),
+        hourly_limit=hourly_limit, daily_limit=daily_limit,
+        hour_length=hour_length)
+    with server.running(), tempfile.TemporaryDirectory() as folder:
+        results = run_download_benchmark(server, folder, passes=passes)
+    print(yaml_dump(results))
@@ -0,0 +1,567 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import json
+from pathlib import Path
+import shutil
+import traceback
+
+import pyfomod
+from pyfomod import (
+    Conditions,
+    ConditionType,
+    Files,
+    FileType,
+    Flags,
+    Group,
+    GroupType,
+    Option,
+    OptionType,
+    Order,
+    Page,
+    Root,
+    Type)
+from pyfomod.fomod import File
+from pyfomod.installer import FailedCondition, InvalidSelection
+
+
+# the files of a fomod folder that the installer needs to run the wizard
+FOMOD_CONFIG_FILES = ('info.xml', 'moduleconfig.xml')
+
+# bumped whenever the cached fomod data layout changes
+FOMOD_DATA_FORMAT = 1
+
+INFO_FIELDS = ('author', 'version', 'description', 'website')
+
+
+def conditions_to_data(conditions):
+    items = []
+    for key, value in conditions.items():
+        if key is None:
+            items.append(['game', value])
+        elif isinstance(key, Conditions):
+            items.append(['nested', conditions_to_data(key)])
+        elif isinstance(value, FileType):
+            items.append(['file', key, value.value])
+        else:
+            items.append(['flag', key, value])
+    return {'operator': conditions.type.value, 'items': items}
+
+
+def conditions_from_data(data):
+    conditions = Conditions()
+    conditions.type = ConditionType(data['operator'])
+    for item in data['items']:
+        if item[0] == 'game':
+            conditions[None] = item[1]
+        elif item[0] == 'nested':
+            conditions[conditions_from_data(item[1])] = None
+        elif item[0] == 'file':
+            conditions[item[1]] = FileType(item[2])
+        else:
+            conditions[item[1]] = item[2]
+    return conditions
+
+
+def files_to_data(files):
+    return [
+        [file_._tag, file_.src, file_.dst,
+         int(file_._attrib.get('priority', '0'))]
+        for file_ in files._file_list]
+
+
+def files_from_data(data):
+    files = Files()
+    for tag, src, dst, priority in data:
+        file_ = File(tag, {'priority': str(priority)} if priority else {})
+        file_.src = src
+        file_.dst = dst
+        files._file_list.append(file_)
+    return files
+
+
+def normalize_file_entry(tag, src, dst, priority):
+    # destinations default to the source, and files installed to a folder
+    # keep their name, as in pyfomod
+    if src.endswith(('/', '\\')):
+        src = src[:-1]
+    src = str(Path(src))
+    if dst is None:
+        dst = src
+    if tag == 'file' and (not dst or dst.endswith(('/', '\\'))):
+        dst = str(Path(dst) / Path(src).name)
+    else:
+        dst = str(Path(dst))
+    return dst, (priority, tag, src)
+
+
+def resolve_file_entries(entries, expand=None):
+    '''
+    Resolves file entries (as in `files_to_data`, listed in install order)
+    into what gets installed where, the way pyfomod does for an extracted
+    fomod: folder sources stand for every file beneath them, and a
+    destination claimed twice goes to the entry with the higher priority,
+    or the later one on a tie
+
+    @param expand: function returning the paths of the files beneath a
+        (normalized) source, relative to it ('' for a source that is a file
+        itself), or nothing if unknown; see `fomod_plan.listing_expander`.
+        Sources it does not expand are kept whole, and whole folders are
+        keyed by their source as well, so that folders installed to the
+        same destination (typically the data folder itself) add up rather
+        than replace one another.
+    @return: dict of (destination, source of a whole folder, else '') ->
+        (priority, tag, source)
+    '''
+    installed = {}
+    for entry in entries:
+        dst, (priority, tag, src) = normalize_file_entry(*entry)
+        relatives = expand(src) if expand else None
+        if relatives:
+            items = [
+                ((str(Path(dst) / relative), ''),
+                 (priority, 'file', str(Path(src) / relative)))
+                for relative in relatives]
+        else:
+            items = [((dst, src if tag == 'folder' else ''),
+                      (priority, tag, src))]
+        for key, value in items:
+            if key not in installed or priority >= installed[key][0]:
+                installed[key] = value
+    return installed
+
+
+def merge_installed(first, then):
+    '''
+    Combines resolved entries installed one after the other; for each
+    destination, the later winner only wins if its priority is at least
+    that of the earlier one, which is what resolving both lists of entries
+    in one go would give
+    '''
+    merged = dict(first)
+    for key, value in then.items():
+        if key not in merged or value[0] >= merged[key][0]:
+            merged[key] = value
+    return merged
+
+
+def option_type_to_data(option_type):
+    if isinstance(option_type, OptionType):
+        return option_type.value
+    return {
+        'default': option_type.default.value,
+        'patterns': [
+            [conditions_to_data(conditions), value.value]
+            for conditions, value in option_type.items()]}
+
+
+def option_type_from_data(data):
+    if isinstance(data, str):
+        return OptionType(data)
+    option_type = Type()
+    option_type.default = OptionType(data['default'])
+    for conditions, value in data['patterns']:
+        option_type[conditions_from_data(conditions)] = OptionType(value)
+    return option_type
+
+
+def fomod_to_data(root):
+    '''
+    Flattens a parsed fomod (a pyfomod Root) into plain lists and dicts that
+    serialize compactly to json: info, pages, groups, options (with their
+    flags, files and types), conditions and conditional file patterns
+    '''
+    return {
+        'format': FOMOD_DATA_FORMAT,
+        'name': root.name,
+        'image': root.image,
+        'info': {field: getattr(root, field) for field in INFO_FIELDS},
+        'conditions': conditions_to_data(root.conditions),
+        'files': files_to_data(root.files),
+        'order': root.pages.order.value,
+        'pages': [{
+            'name': page.name,
+            'order': page.order.value,
+            'conditions': conditions_to_data(page.conditions),
+            'groups': [{
+                'name': group.name,
+                'type': group.type.value,
+                'order': group.order.value,
+                'options': [{
+                    'name': option.name,
+                    'description': option.description,
+                    'image': option.image,
+                    'files': files_to_data(option.files),
+                    'flags': dict(option.flags),
+                    'type': option_type_to_data(option.type)
+                } for option in group]
+            } for group in page]
+        } for page in root.pages],
+        'file_patterns': [
+            [conditions_to_data(conditions), files_to_data(files)]
+            for conditions, files in root.file_patterns.items()]
+    }
+
+
+def fomod_from_data(data):
+    '''
+    Rebuilds the pyfomod Root from `fomod_to_data` output, ready to be run
+    by a pyfomod Installer without any xml parsing
+    '''
+    root = Root()
+    root.name = data['name']
+    root.image = data['image']
+    for field in INFO_FIELDS:
+        if data['info'].get(field):
+            setattr(root, field, data['info'][field])
+    root.conditions = conditions_from_data(data['conditions'])
+    root.conditions._tag = 'moduleDependencies'
+    root.files = files_from_data(data['files'])
+    root.files._tag = 'requiredInstallFiles'
+    root.pages.order = Order(data['order'])
+    for page_data in data['pages']:
+        page = Page()
+        page.name = page_data['name']
+        page.order = Order(page_data['order'])
+        page.conditions = conditions_from_data(page_data['conditions'])
+        for group_data in page_data['groups']:
+            group = Group()
+            group.name = group_data['name']
+            group.type = GroupType(group_data['type'])
+            group.order = Order(group_data['order'])
+            for option_data in group_data['options']:
+                option = Option()
+                option.name = option_data['name']
+                option.description = option_data['description']
+                option.image = option_data['image']
+                option.files = files_from_data(option_data['files'])
+                flags = Flags()
+                for flag, value in option_data['flags'].items():
+                    flags[flag] = value
+                option.flags = flags
+                option.type = option_type_from_data(option_data['type'])
+                group.append(option)
+            page.append(group)
+        root.pages.append(page)
+    for conditions, files in data['file_patterns']:
+        root.file_patterns[conditions_from_data(conditions)] = (
+            files_from_data(files))
+    return root
+
+
+def choice_inputs(choices):
+    '''
+    Accepts choices either as rendered by the fomod wizard (with the page ->
+    group -> option names mapping under `fomod: inputs:`) or as just that
+    mapping
+    '''
+    choices = choices or {}
+    if 'fomod' in choices:
+        choices = (choices['fomod'] or {}).get('inputs') or {}
+    return choices
+
+
+def installer_choices(installer):
+    '''
+    Renders the options selected so far in an installer as recipe yaml
+    selections, `{'fomod': {'inputs': {page: {group: [option, ...]}}}}`
+    '''
+    choices = {}
+    for page, selected_options in installer._previous_pages.items():
+        for group in page:
+            for option in group:
+                for selected in selected_options:
+                    if option is selected:
+                        (choices
+                            .setdefault('fomod', {})
+                            .setdefault('inputs', {})
+                            .setdefault(page.name, {})
+                            .setdefault(group.name, [])
+                            .append(option.name))
+                        break
+    return choices
+
+
+def default_selection(page):
+    '''
+    The options a user would have to go with on a page without picking
+    anything: required and recommended options, plus the first usable
+    option of groups that need at least one selected
+    '''
+    selected = []
+    for group in page:
+        picked = [
+            option for option in group
+            if option.type in (OptionType.REQUIRED, OptionType.RECOMMENDED)]
+        if group.type == GroupType.ALL:
+            picked = list(group)
+        elif not picked and group.type in (
+                GroupType.EXACTLYONE, GroupType.ATLEASTONE):
+            picked = [
+                option for option in group
+                if option.type != OptionType.NOTUSABLE][:1]
+        elif group.type in (GroupType.EXACTLYONE, GroupType.ATMOSTONE):
+            picked = picked[:1]
+        selected.extend(picked)
+    return selected
+
+
+def installer_file_entries(installer):
+    '''
+    The file entries (as in `files_to_data`) an installer has gathered so
+    far, in the order pyfomod installs them: required files, then the files
+    of selected options, then conditional files whose conditions hold
+    '''
+    entries = files_to_data(installer.root.files)
+    for options in installer._previous_pages.values():
+        for option in options:
+            entries.extend(files_to_data(option.files))
+    for conditions, files in installer.root.file_patterns.items():
+        try:
+            installer._test_conditions(conditions)
+        except FailedCondition:
+            continue
+        entries.extend(files_to_data(files))
+    return entries
+
+
+def replay_choices(installer, choices):
+    '''
+    Runs a fresh installer through its pages with recorded choices instead
+    of a user clicking through the wizard. Pages without recorded choices
+    get the default selection.
+
+    @return: dict with the resulting flags and files (source -> destination)
+        mapping, the choices as actually applied, the pages that fell back
+        on defaults, and any errors (unknown page/group/option names,
+        selections violating the group or option types, and choices for
+        pages that never got shown)
+    '''
+    inputs = choice_inputs(choices)
+    errors = []
+    defaulted = []
+    shown = set()
+
+    page = installer.next()
+    while page is not None:
+        shown.add(page.name)
+        page_inputs = inputs.get(page.name)
+        if page_inputs is None:
+            defaulted.append(page.name)
+            selected = default_selection(page)
+        else:
+            selected = []
+            groups = {group.name: group for group in page}
+            for group_name, option_names in page_inputs.items():
+                group = groups.get(group_name)
+                if group is None:
+                    errors.append(
+                        f'page {page.name!r} has no group {group_name!r}')
+                    continue
+                options = {option.name: option for option in group}
+                for option_name in option_names or []:
+                    if option_name not in options:
+                        errors.append(
+                            f'group {group_name!r} of page {page.name!r} '
+                            f'has no option {option_name!r}')
+                        continue
+                    selected.append(options[option_name])
+        try:
+            page = installer.next(selected)
+        except InvalidSelection as e:
+            errors.append(f'page {page.name!r}: {e}')
+            break
+
+    for page_name in inputs:
+        if page_name not in shown:
+            errors.append(f'page {page_name!r} was never shown')
+
+    return {
+        'flags': installer.flags(),
+        'files': installer.files(),
+        'choices': installer_choices(installer),
+        'defaulted_pages': defaulted,
+        'errors': errors
+    }
+
+
+def simulate_fomod(fomod, choices):
+    '''
+    Replays choices against a fomod; module level so that it can run in a
+    process pool
+
+    @param fomod: the folder holding the `fomod` folder, or cached fomod
+        data (see `fomod_to_data`)
+    '''
+    try:
+        if isinstance(fomod, dict):
+            if fomod.get('error'):
+                return {'errors': [f'cannot parse fomod: {fomod["error"]}']}
+            installer = pyfomod.Installer(fomod_from_data(fomod))
+        else:
+            installer = pyfomod.Installer(str(fomod))
+        return replay_choices(installer, choices)
+    except Exception as e:
+        traceback.print_exc()
+        return {'errors': [f'cannot run fomod: {e}']}
+
+
+def normalize_config_case(fomod_root):
+    # pyfomod looks for `fomod/moduleconfig.xml` by exact name, which only
+    # matters where paths are case sensitive
+    for folder in Path(fomod_root).iterdir():
+        if folder.is_dir() and folder.name.lower() == 'fomod':
+            if folder.name != 'fomod':
+                folder = folder.rename(folder.with_name('fomod'))
+            for path in folder.iterdir():
+                if (path.name.lower() in FOMOD_CONFIG_FILES and
+                        path.name != path.name.lower()):
+                    path.rename(path.with_name(path.name.lower()))
+
+
+def config_members(meta):
+    fomod_root = Path(meta['fomod_root'])
+    return [
+        path for path in meta['filelist']
+        if Path(path).parent.name.lower() == 'fomod' and
+        Path(path).parent.parent == fomod_root and
+        Path(path).name.lower() in FOMOD_CONFIG_FILES]
+
+
+def extract_fomod_config(tarball, meta, folder):
+    '''
+    Extracts only the fomod config files of a tarball into `folder`
+
+    @return: the folder to run the fomod from
+    '''
+    folder = Path(folder)
+    if folder.exists():
+        shutil.rmtree(folder)
+    folder.mkdir(parents=True)
+
+    if meta['fomod_root'].endswith('.fomod'):
+        # the config is inside a nested archive, so extract that whole
+        tarball.extract(folder, as_fomod=True, members=[meta['fomod_root']])
+        fomod_root = folder
+    else:
+        tarball.extract(folder, members=config_members(meta))
+        fomod_root = folder / meta['fomod_root']
+    normalize_config_case(fomod_root)
+    return fomod_root
+
+
+def image_members(data, meta):
+    '''
+    Maps the images referred to by a fomod to the archive members they are
+    read from (matching paths case-insensitively, the way they resolve on
+    Windows)
+    '''
+    fomod_root = meta['fomod_root']
+    if not fomod_root or fomod_root.endswith('.fomod'):
+        return {}
+    members = {
+        str(Path(path)).replace('\\', '/').lower(): path
+        for path in meta['filelist']}
+    images = [data['image']] + [
+        option['image']
+        for page in data['pages']
+        for group in page['groups']
+        for option in group['options']]
+    result = {}
+    for image in images:
+        if not image:
+            continue
+        member = str(Path(fomod_root) / image.replace('\\', '/'))
+        member = members.get(member.replace('\\', '/').lower())
+        if member:
+            result[image] = member
+    return result
+
+
+def index_fomod(tarball, meta, folder):
+    '''
+    Extracts and parses the fomod of a tarball into its cached form, with
+    the archive members of its images; parse failures are recorded rather
+    than raised, so that broken fomods are not re-extracted on every use
+    '''
+    try:
+        fomod_root = extract_fomod_config(tarball, meta, folder)
+        data = fomod_to_data(pyfomod.parse(str(fomod_root)))
+        data['image_members'] = image_members(data, meta)
+    except Exception as e:
+        traceback.print_exc()
+        data = {'format': FOMOD_DATA_FORMAT, 'error': str(e)}
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    return data
+
+
+def dump_fomod_data(data):
+    # json is valid yaml, and far quicker to load than yaml for the large
+    # structures of big fomods
+    return json.dumps(data, separators=(',', ':'))
+
+
+def load_fomod_data(text):
+    return json.loads(text)
+
+
+class SkybuildFomodSimulator:
+    '''
+    Replays recipe fomod choices headlessly against every fomod blob
+    selected by the aliases, so that a recipe's fomod selections can all be
+    validated in one run. The fomods come from the parsed fomod cache
+    (blobs missing from it are indexed on a thread pool, as that is mostly
+    waiting on 7z), and are replayed on a process pool.
+    '''
+    def __init__(self, manager, workers=4):
+        self.manager = manager
+        self.workers = workers
+
+    def fomod_blobs(self):
+        return {
+            alias: blob_id
+            for alias, blob_id in self.manager.aliases.get_selections(
+                permit_unselected=True).items()
+            if blob_id and self.manager.meta(blob_id)['fomod_root']}
+
+    def run(self, choices_by_alias=None, aliases=None):
+        '''
+        @param choices_by_alias: mapping of alias to fomod choices, in the
+            format rendered by the fomod wizard
+        @param aliases: only simulate these aliases; defaults to every alias
+            whose selected blob is a fomod
+        @return: report with the result of every simulated fomod, and the
+            aliases that failed
+        '''
+        choices_by_alias = choices_by_alias or {}
+        fomod_blobs = self.fomod_blobs()
+        if aliases is None:
+            aliases = sorted(fomod_blobs)
+
+        results = {}
+        for alias in list(choices_by_alias) + list(aliases):
+            if alias not in fomod_blobs:
+                results[alias] = {
+                    'errors': [f'alias {alias} has no selected fomod blob']}
+        to_run = sorted(
+            alias for alias in set(aliases) | set(choices_by_alias)
+            if alias in fomod_blobs)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            fomods = list(executor.map(
+                self.manager.fomod_data,
+                [fomod_blobs[alias] for alias in to_run]))
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            simulated = executor.map(
+                simulate_fomod,
+                fomods,
+                [choices_by_alias.get(alias) for alias in to_run])
+            for alias, result in zip(to_run, simulated):
+                results[alias] = {'blob_id': fomod_blobs[alias], **result}
+
+        return {
+            'fomods': len(to_run),
+            'failed': sorted(
+                alias for alias, result in results.items()
+                if result['errors']),
+            'results': results
+        }
@@ -0,0 +1,372 @@
+import itertools
+import time
+
+from skypackages.fomod import merge_installed, resolve_file_entries
+
+
+class FomodBudgetExceeded(Exception):
+    pass
+
+
+def ordered(items, order):
+    # the ordering pyfomod applies to pages, groups and options
+    if order == 'Ascending':
+        return sorted(items, key=lambda item: item['name'])
+    if order == 'Descending':
+        return sorted(items, key=lambda item: item['name'], reverse=True)
+    return list(items)
+
+
+def condition_failures(conditions, flags):
+    '''
+    Evaluates cached fomod conditions against flags the way pyfomod does:
+    None when they pass, else the number of failure messages pyfomod would
+    raise with. The count matters because pyfomod fails an `Or` when it
+    collected as many messages as it has conditions, and a failed nested
+    condition contributes all of its messages (possibly none) rather than
+    one. Game version and file state conditions pass, as they do for a
+    pyfomod installer without a game version or file type callback.
+    '''
+    items = conditions['items']
+    failed = 0
+    for item in items:
+        if item[0] == 'flag':
+            failure = None if flags.get(item[1]) == item[2] else 1
+        elif item[0] == 'nested':
+            failure = condition_failures(item[1], flags)
+        else:
+            failure = None
+        if failure is not None:
+            failed += failure
+            if conditions['operator'] == 'And':
+                return failed
+    if conditions['operator'] == 'Or' and failed == len(items):
+        return failed
+    return None
+
+
+def test_conditions(conditions, flags):
+    return condition_failures(conditions, flags) is None
+
+
+def option_type(option, flags):
+    option_type = option['type']
+    if isinstance(option_type, str):
+        return option_type
+    for conditions, value in option_type['patterns']:
+        if test_conditions(conditions, flags):
+            return value
+    return option_type['default']
+
+
+def installed_key(installed):
+    return frozenset(installed.items())
+
+
+def combine(first, then):
+    # both as hashable resolved entries, see `installed_key`
+    if not then:
+        return first
+    return installed_key(merge_installed(dict(first), dict(then)))
+
+
+def choices_of(selection):
+    '''
+    Turns a selection (tuples of page, group and option names) into choices
+    in the format rendered by the fomod wizard
+    '''
+    inputs = {}
+    for page_name, group_name, option_names in selection:
+        if option_names:
+            inputs.setdefault(page_name, {})[group_name] = list(option_names)
+    return {'fomod': {'inputs': inputs}}
+
+
+class FomodConfigurationAnalyzer:
+    '''
+    Enumerates the distinct install outcomes of a fomod, given in its cached
+    form (see `skypackages.fomod.fomod_to_data`).
+
+    Which pages show up, and which options may be picked on them, only
+    depends on the flags set so far, so the outcomes reachable from a page
+    are memoized on (page, flags) and shared by every earlier combination
+    of choices leading there. Within a group, options without files or
+    flags make no difference to the outcome and are not branched on, and
+    selections with the same files and flags are merged before moving on
+    to the next page. Outcomes are then grouped by the set of files they
+    install.
+
+    Folder sources are expanded into the files beneath them by `expand`
+    (see `skypackages.fomod.resolve_file_entries`), which takes the archive
+    listing or the extracted fomod; without it, folders are kept whole and
+    never override one another.
+    '''
+    def __init__(self, data, max_seconds=30, max_steps=1000000,
+                 max_examples=5, expand=None):
+        self.data = data
+        self.expand_source = expand
+        self.pages = ordered(data['pages'], data['order'])
+        self.max_seconds = max_seconds
+        self.max_steps = max_steps
+        self.max_examples = max_examples
+
+        self.memo = {}
+        self.steps = 0
+        self.deadline = None
+        self.shown_pages = set()
+        self.selectable = set()
+        self.dead_ends = set()
+
+    def step(self):
+        self.steps += 1
+        if self.steps > self.max_steps or (
+                self.steps % 1000 == 0 and time.monotonic() > self.deadline):
+            raise FomodBudgetExceeded()
+
+    def merge(self, outcomes, key, count, examples):
+        if key in outcomes:
+            old_count, old_examples = outcomes[key]
+            outcomes[key] = (
+                old_count + count,
+                (old_examples + examples)[:self.max_examples])
+        else:
+            outcomes[key] = (count, examples[:self.max_examples])
+
+    def group_selections(self, page, group, flags):
+        '''
+        @return: dict of (resolved files, flag assignments) -> (number of
+            option combinations, example option name tuples)
+        '''
+        # effects are collected in the options' listed order, which is
+        # the order pyfomod applies selected options in
+        options = group['options']
+        types = [option_type(option, flags) for option in options]
+        required = [
+            i for i, type_ in enumerate(types) if type_ == 'Required']
+        usable = [
+            i for i, type_ in enumerate(types) if type_ != 'NotUsable']
+        inert = [
+            i for i in usable
+            if i not in required and
+            not options[i]['files'] and not options[i]['flags']]
+        free = [i for i in usable if i not in required and i not in inert]
+
+        group_type = group['type']
+        if group_type == 'SelectAll':
+            candidates = (
+                [(tuple(range(len(options))), 1)]
+                if len(usable) == len(options) else [])
+        elif group_type in ('SelectExactlyOne', 'SelectAtMostOne'):
+            if len(required) > 1:
+                candidates = []
+            elif required:
+                candidates = [(tuple(required), 1)]
+            else:
+                candidates = [((i,), 1) for i in usable]
+                if group_type == 'SelectAtMostOne':
+                    candidates.append(((), 1))
+        else:
+            # any subset of the options that matter, each standing for all
+            # the ways of adding inert options to it
+            candidates = []
+            for size in range(len(free) + 1):
+                for subset in itertools.combinations(free, size):
+                    self.step()
+                    chosen = tuple(sorted(required + list(subset)))
+                    count = 2 ** len(inert)
+                    if not chosen and group_type == 'SelectAtLeastOne':
+                        # at least one of the inert options is needed
+                        if not inert:
+                            continue
+                        chosen = (inert[0],)
+                        count -= 1
+                    candidates.append((chosen, count))
+
+        selections = {}
+        for chosen, count in candidates:
+            self.step()
+            for i in chosen:
+                self.selectable.add(
+                    (page['name'], group['name'], options[i]['name']))
+            # inert options reachable here are selectable too
+            if group_type not in ('SelectExactlyOne', 'SelectAtMostOne'):
+                for i in inert:
+                    self.selectable.add(
+                        (page['name'], group['name'], options[i]['name']))
+            installed = installed_key(resolve_file_entries(
+                (entry for i in chosen for entry in options[i]['files']),
+                self.expand_source))
+            assignments = tuple(
+                item for i in chosen for item in options[i]['flags'].items())
+            self.merge(
+                selections, (installed, assignments), count,
+                [tuple(options[i]['name'] for i in chosen)])
+        return selections
+
+    def page_selections(self, page, flags):
+        '''
+        @return: dict of (resolved files, resulting flags) -> (number of
+            option combinations, example selections), for every valid way
+            through the page
+        '''
+        outcomes = {(frozenset(), frozenset(flags.items())): (1, [()])}
+        for group in page['groups']:
+            selections = self.group_selections(page, group, flags)
+            if not selections:
+                self.dead_ends.add((page['name'], group['name']))
+                return {}
+            combined = {}
+            for (files, page_flags), (count, examples) in outcomes.items():
+                for (group_files, assignments), (
+                        group_count, group_examples) in selections.items():
+                    self.step()
+                    new_flags = dict(page_flags)
+                    new_flags.update(assignments)
+                    self.merge(
+                        combined,
+                        (combine(files, group_files),
+                         frozenset(new_flags.items())),
+                        count * group_count,
+                        [example + ((page['name'], group['name'], names),)
+                         for example in examples for names in group_examples])
+            outcomes = combined
+        return outcomes
+
+    def expand(self, index, flags):
+        '''
+        Outcomes of showing the page at `index` of the ordered pages with
+        the given flags, and of going on from there
+        '''
+        page = self.pages[index]
+        self.shown_pages.add(page['name'])
+        outcomes = {}
+        for (files, new_flags), (count, examples) in self.page_selections(
+                page, dict(flags)).items():
+            for (rest_files, final_flags), (
+                    rest_count, rest_examples) in self.solve(
+                        index + 1, new_flags).items():
+                self.step()
+                self.merge(
+                    outcomes,
+                    (combine(files, rest_files), final_flags),
+                    count * rest_count,
+                    [example + rest
+                     for example in examples for rest in rest_examples])
+        return outcomes
+
+    def solve(self, index, flags):
+        '''
+        Outcomes from the first page shown at or after `index`, memoized on
+        the flags, as (resolved files, final flags) -> (number of option
+        combinations, example selections)
+        '''
+        key = (index, flags)
+        if key not in self.memo:
+            flag_values = dict(flags)
+            for next_index in range(index, len(self.pages)):
+                if test_conditions(
+                        self.pages[next_index]['conditions'], flag_values):
+                    self.memo[key] = self.expand(next_index, flags)
+                    break
+            else:
+                self.memo[key] = {(frozenset(), flags): (1, [()])}
+        return self.memo[key]
+
+    def analyze(self):
+        '''
+        @return: report with the distinct outcomes (the [destination,
+            source] pairs they install, how many option combinations lead
+            to them, and example choices for each), whether folder sources
+            were expanded into their files, the options that can never be
+            selected, the groups that cannot be completed, and whether the
+            enumeration finished within the budget
+        '''
+        start = time.monotonic()
+        self.deadline = start + self.max_seconds
+        complete = True
+        outcomes = {}
+        if not test_conditions(self.data['conditions'], {}):
+            installable = False
+        else:
+            installable = True
+            try:
+                if self.pages:
+                    # pyfomod always starts on the first page as listed,
+                    # visible or not
+                    first = self.data['pages'][0]
+                    outcomes = self.expand(
+                        next(i for i, page in enumerate(self.pages)
+                             if page is first),
+                        frozenset())
+                else:
+                    outcomes = {(frozenset(), frozenset()): (1, [()])}
+            except FomodBudgetExceeded:
+                complete = False
+
+        # required files go first and conditional files last
+        required = resolve_file_entries(self.data['files'], self.expand_source)
+        classes = {}
+        for (files, final_flags), (count, examples) in outcomes.items():
+            flag_values = dict(final_flags)
+            installed = merge_installed(
+                merge_installed(required, dict(files)),
+                resolve_file_entries(
+                    (entry
+                     for conditions, pattern_files in self.data[
+                         'file_patterns']
+                     if test_conditions(conditions, flag_values)
+                     for entry in pattern_files),
+                    self.expand_source))
+            key = frozenset(
+                (place, src) for place, (_, _, src) in installed.items())
+            if key not in classes:
+                # folders that were not expanded are listed whole, with a
+                # trailing slash on their source
+                classes[key] = {
+                    'files': [
+                        [dst, f'{src}/' if folder else src]
+                        for (dst, folder), (_, _, src) in sorted(
+                            installed.items())],
+                    'combinations': 0,
+                    'flags': [],
+                    'choices': []}
+            outcome = classes[key]
+            outcome['combinations'] += count
+            if dict(sorted(flag_values.items())) not in outcome['flags']:
+                outcome['flags'].append(dict(sorted(flag_values.items())))
+            outcome['choices'] = (outcome['choices'] + [
+                choices_of(example) for example in examples
+            ])[:self.max_examples]
+
+        # what was never reached only means something once everything
+        # reachable has been explored
+        unreachable = unshown = None
+        if complete:
+            unreachable = [
+                {'page': page['name'], 'group': group['name'],
+                 'option': option['name']}
+                for page in self.pages
+                for group in ordered(page['groups'], page['order'])
+                for option in ordered(group['options'], group['order'])
+                if (page['name'], group['name'], option['name'])
+                not in self.selectable]
+            unshown = [
+                page['name'] for page in self.pages
+                if page['name'] not in self.shown_pages]
+
+        return {
+            'complete': complete,
+            'installable': installable,
+            'expanded': self.expand_source is not None,
+            'steps': self.steps,
+            'seconds': round(time.monotonic() - start, 3),
+            'outcomes': sorted(
+                classes.values(),
+                key=lambda outcome: (
+                    -outcome['combinations'], sorted(outcome['files']))),
+            'unreachable_options': unreachable,
+            'unshown_pages': unshown,
+            'dead_ends': [
+                {'page': page, 'group': group}
+                for page, group in sorted(self.dead_ends)]
+        }
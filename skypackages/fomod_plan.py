@@ -0,0 +1,197 @@
+import bisect
+from pathlib import Path
+
+import pyfomod
+
+from skypackages.fomod import (
+    fomod_from_data,
+    installer_file_entries,
+    normalize_file_entry,
+    replay_choices)
+
+
+def member_key(path):
+    # archive listings and fomod configs disagree on slashes and case, and
+    # neither matters where mods get installed
+    return '/'.join(
+        part for part in path.replace('\\', '/').lower().split('/')
+        if part not in ('', '.'))
+
+
+class ArchiveListing:
+    '''
+    Case-insensitive index of the member files of an archive, built from the
+    file sizes and CRCs recorded in its blob metadata, so that fomod sources
+    (files or whole folders) can be resolved without extracting anything
+    '''
+    def __init__(self, meta):
+        self.files = {
+            member_key(path): (path, info)
+            for path, info in (meta.get('members') or {}).items()}
+        self.keys = sorted(self.files)
+
+    def lookup(self, path):
+        '''
+        @return: list of (path relative to `path`, member path, member info)
+            for the member file at `path`, or for every member file beneath
+            it if it is a folder; the relative path of a file is ''
+        '''
+        key = member_key(path)
+        if key in self.files:
+            member, info = self.files[key]
+            return [('', member, info)]
+
+        prefix = f'{key}/' if key else ''
+        depth = len(key.split('/')) if key else 0
+        found = []
+        for index in range(
+                bisect.bisect_left(self.keys, prefix), len(self.keys)):
+            child_key = self.keys[index]
+            if not child_key.startswith(prefix):
+                break
+            member, info = self.files[child_key]
+            parts = [
+                part for part in member.replace('\\', '/').split('/')
+                if part not in ('', '.')]
+            found.append(('/'.join(parts[depth:]), member, info))
+        return found
+
+
+def listing_expander(meta):
+    '''
+    Source expansion for `skypackages.fomod.resolve_file_entries` from the
+    archive listing in blob metadata; None if the sources are not listed
+    '''
+    fomod_root = meta.get('fomod_root')
+    if (not fomod_root or fomod_root.endswith('.fomod') or
+            'members' not in meta):
+        return None
+    listing = ArchiveListing(meta)
+    expanded = {}
+
+    def expand(src):
+        if src not in expanded:
+            expanded[src] = [
+                relative for relative, _, _ in listing.lookup(
+                    str(Path(fomod_root) / src))]
+        return expanded[src]
+    return expand
+
+
+def folder_expander(fomod_root):
+    '''
+    Source expansion for `skypackages.fomod.resolve_file_entries` from an
+    extracted fomod
+    '''
+    fomod_root = Path(fomod_root)
+    expanded = {}
+
+    def expand(src):
+        if src not in expanded:
+            path = fomod_root / src
+            if path.is_file():
+                expanded[src] = ['']
+            elif path.is_dir():
+                expanded[src] = sorted(
+                    str(child.relative_to(path))
+                    for child in path.rglob('*') if child.is_file())
+            else:
+                expanded[src] = []
+        return expanded[src]
+    return expand
+
+
+def plan_fomod_install(data, meta, choices):
+    '''
+    Resolves fomod choices into the files they would install, from the
+    cached fomod data and the archive listing in the blob metadata: folder
+    sources are expanded into the member files beneath them, and clashing
+    destinations are settled by priority (later entries winning ties), as
+    pyfomod does for an extracted fomod, except that destinations are
+    compared case-insensitively, as they are in the game's data folder
+
+    @return: dict with the installed files (destination, archive member,
+        size and crc), their total size, the files overridden by another
+        entry, the sources missing from the archive, and the flags, choices
+        and errors of replaying the choices
+    '''
+    fomod_root = meta['fomod_root']
+    if fomod_root.endswith('.fomod'):
+        return {'errors': [
+            f'sources are inside the nested archive {fomod_root}, which is '
+            f'not listed']}
+
+    installer = pyfomod.Installer(fomod_from_data(data))
+    replay = replay_choices(installer, choices)
+    listing = ArchiveListing(meta)
+
+    expanded = []
+    missing = []
+    for entry in installer_file_entries(installer):
+        dst, (priority, _, src) = normalize_file_entry(*entry)
+        found = listing.lookup(str(Path(fomod_root) / src))
+        if not found:
+            missing.append(src)
+        for relative, member, info in found:
+            expanded.append((
+                str(Path(dst) / relative) if relative else dst,
+                priority, member, info))
+
+    installed = {}
+    overridden = []
+    for dst, priority, member, info in expanded:
+        key = member_key(dst)
+        if key in installed:
+            if installed[key][1] > priority:
+                overridden.append({'destination': dst, 'source': member})
+                continue
+            overridden.append({
+                'destination': installed[key][0],
+                'source': installed[key][2]})
+        installed[key] = (dst, priority, member, info)
+
+    files = [
+        {'destination': dst,
+         'source': member,
+         'size': info.get('size') or 0,
+         'crc': info.get('crc')}
+        for dst, _, member, info in sorted(
+            installed.values(), key=lambda item: member_key(item[0]))]
+    return {
+        'files': files,
+        'total_size': sum(file_['size'] for file_ in files),
+        'overridden': overridden,
+        'missing': missing,
+        'flags': replay['flags'],
+        'choices': replay['choices'],
+        'errors': replay['errors']
+    }
+
+
+def install_conflicts(plans):
+    '''
+    Finds destinations installed by more than one plan
+
+    @param plans: dict of name (e.g. alias) -> install plan
+    @return: list of conflicts with the destination, the names of the plans
+        installing it in order, and whether they all install identical
+        content (same size and crc)
+    '''
+    claims = {}
+    for name, plan in plans.items():
+        for file_ in plan.get('files') or []:
+            claims.setdefault(member_key(file_['destination']), []).append(
+                (name, file_))
+
+    conflicts = []
+    for key, claimants in sorted(claims.items()):
+        if len(claimants) < 2:
+            continue
+        contents = {(file_['size'], file_['crc']) for _, file_ in claimants}
+        conflicts.append({
+            'destination': claimants[0][1]['destination'],
+            'packages': [name for name, _ in claimants],
+            'identical': (
+                len(contents) == 1 and
+                claimants[0][1]['crc'] is not None)})
+    return conflicts
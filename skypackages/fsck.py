@@ -0,0 +1,132 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import time
+
+from skypackages.utils import atomic_write, yaml_dump, yaml_load
+
+
+class SkybuildIntegrityChecker:
+    '''
+    Verifies that every blob still hashes to the md5 in its name, and that
+    meta, sources, alias and selection records only refer to blobs that
+    exist. Blobs are hashed on a thread pool with large sequential reads
+    (hashlib releases the GIL while hashing), and the size/mtime and time of
+    the last successful verification of each blob are recorded so that
+    later runs only rehash blobs that changed or have not been verified
+    for `max_age` seconds.
+    '''
+    def __init__(self, manager, workers=4, chunk_size=8 * 1024 * 1024,
+                 max_age=30 * 24 * 3600):
+        self.manager = manager
+        self.paths = manager.paths
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.max_age = max_age
+
+    def load_state(self):
+        if self.paths.fsck_state.exists():
+            return yaml_load(self.paths.fsck_state.read_text()) or {}
+        return {}
+
+    def save_state(self, state):
+        atomic_write(self.paths.fsck_state, yaml_dump(state))
+
+    def needs_check(self, record, size, mtime, now, full):
+        return (
+            full or not record or
+            record['size'] != size or
+            record['mtime'] != mtime or
+            now - record['verified'] > self.max_age)
+
+    def verify_blob(self, blob_id):
+        # blobs may be plain files or reconstructed from the chunk store, so
+        # hash whatever stream the blob store gives us
+        hash_md5 = hashlib.md5()
+        with self.manager.blobs.open(blob_id) as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                hash_md5.update(chunk)
+        return hash_md5.hexdigest()
+
+    def check_blobs(self, full=False):
+        state = self.load_state()
+        now = time.time()
+        blobs = self.manager.blobs.blob_ids()
+
+        to_check = {}
+        for blob_id in blobs:
+            size = self.manager.blobs.size(blob_id)
+            mtime = self.manager.blobs.mtime(blob_id)
+            if self.needs_check(state.get(blob_id), size, mtime, now, full):
+                to_check[blob_id] = (size, mtime)
+
+        corrupt = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            digests = executor.map(self.verify_blob, to_check)
+            for (blob_id, (size, mtime)), digest in zip(
+                    to_check.items(), digests):
+                expected = blob_id[:32]
+                if digest != expected:
+                    corrupt[blob_id] = {'expected': expected, 'actual': digest}
+                    state.pop(blob_id, None)
+                else:
+                    state[blob_id] = {
+                        'size': size,
+                        'mtime': mtime,
+                        'verified': now}
+
+        # forget blobs that no longer exist
+        for blob_id in list(state):
+            if blob_id not in blobs:
+                state.pop(blob_id)
+        self.save_state(state)
+
+        return {
+            'blobs': len(blobs),
+            'rehashed': len(to_check),
+            'skipped': len(blobs) - len(to_check),
+            'corrupt': corrupt
+        }
+
+    def check_references(self):
+        blob_ids = set(self.manager.blobs.blob_ids())
+
+        def dangling_records(store):
+            return [
+                blob_id for blob_id in store.keys() if blob_id not in blob_ids]
+
+        missing_aliases = {}
+        for alias, alias_blob_ids in self.manager.aliases.data.items():
+            missing = [
+                blob_id for blob_id in alias_blob_ids
+                if blob_id not in blob_ids]
+            if missing:
+                missing_aliases[alias] = missing
+
+        missing_selections = {
+            alias: blob_id
+            for alias, blob_id in self.manager.aliases.get_selections(
+                permit_unselected=True).items()
+            if blob_id and blob_id not in blob_ids}
+
+        return {
+            'meta': dangling_records(self.manager.meta_records),
+            'fomods': dangling_records(self.manager.fomod_records),
+            'listings': dangling_records(self.manager.listing_records),
+            'imports': dangling_records(self.manager.import_records),
+            'sources': dangling_records(self.manager.sources.records),
+            'aliases': missing_aliases,
+            'selections': missing_selections
+        }
+
+    def check(self, full=False):
+        '''
+        @param full: rehash every blob regardless of its recorded state
+        @return: dict with blob verification results and dangling references
+        '''
+        blobs = self.check_blobs(full=full)
+        references = self.check_references()
+        return {
+            'ok': not blobs['corrupt'] and not any(references.values()),
+            'blobs': blobs,
+            'dangling': references
+        }
@@ -0,0 +1,180 @@
+from pathlib import Path
+
+from skypackages.utils import yaml_dump, yaml_load
+
+
+DOWNLOAD_CACHE_INDEX_FILES = [
+    'nexus_download_index.yaml',
+    'nexus_mirror_scores.yaml'
+]
+
+
+class SkybuildGarbageCollector:
+    '''
+    Computes which blobs are still reachable from the aliases (plus any
+    pinned recipe files), and evicts everything else: unreferenced blobs
+    along with their meta and sources files, orphaned meta and sources
+    files, least recently used download cache entries beyond a size
+    budget, and the copies of chunked blobs materialized for tools, which
+    can always be made again.
+
+    Without any aliases every blob would be evicted, which is far more
+    likely to come from pointing at the wrong aliases folder than from
+    meaning it, so collecting refuses to run then unless forced.
+    '''
+    def __init__(self, manager, pinned=None, download_cache_budget=None,
+                 force=False):
+        self.manager = manager
+        self.paths = manager.paths
+        self.pinned = [Path(path) for path in pinned or []]
+        self.download_cache_budget = download_cache_budget
+        self.force = force
+
+    @staticmethod
+    def walk_strings(data):
+        if isinstance(data, str):
+            yield data
+        elif isinstance(data, dict):
+            for key, value in data.items():
+                yield from SkybuildGarbageCollector.walk_strings(key)
+                yield from SkybuildGarbageCollector.walk_strings(value)
+        elif isinstance(data, (list, tuple)):
+            for item in data:
+                yield from SkybuildGarbageCollector.walk_strings(item)
+
+    def reachable(self):
+        aliases = self.manager.aliases.data
+        if not self.force:
+            aliases_file = self.manager.aliases.aliases_file
+            if not aliases_file.exists():
+                raise Exception(
+                    f'refusing to collect garbage; {aliases_file} does not '
+                    f'exist, so every blob would be evicted (force to do so '
+                    f'anyway)')
+            if not aliases:
+                raise Exception(
+                    f'refusing to collect garbage; {aliases_file} has no '
+                    f'aliases, so every blob would be evicted (force to do '
+                    f'so anyway)')
+        reachable = {
+            blob_id for blob_ids in aliases.values() for blob_id in blob_ids}
+
+        # recipes may refer to packages either by alias or by blob id; any
+        # string in a pinned recipe that is one of those keeps it alive
+        for recipe in self.pinned:
+            for value in self.walk_strings(yaml_load(recipe.read_text())):
+                if value in aliases:
+                    reachable.update(aliases[value])
+                elif self.manager.blobs.exists(value):
+                    reachable.add(value)
+        return reachable
+
+    def download_cache_evictions(self):
+        if self.download_cache_budget is None:
+            return []
+        entries = [
+            path for path in self.paths.download_cache.iterdir()
+            if path.is_file() and path.name not in DOWNLOAD_CACHE_INDEX_FILES]
+        stats = {path: path.stat() for path in entries}
+        total = sum(stat.st_size for stat in stats.values())
+
+        # evict least recently used first; access times are unreliable on
+        # some filesystems, so fall back on whichever of atime/mtime is newer
+        evictions = []
+        for path in sorted(
+                entries,
+                key=lambda path: max(
+                    stats[path].st_atime, stats[path].st_mtime)):
+            if total <= self.download_cache_budget:
+                break
+            evictions.append(path)
+            total -= stats[path].st_size
+        return evictions
+
+    def plan(self):
+        reachable = self.reachable()
+        blob_ids = set(self.manager.blobs.blob_ids())
+        unreferenced = sorted(blob_ids - reachable)
+        evicted_ids = set(unreferenced)
+
+        # meta, fomod, listing, import and sources records are keyed by
+        # blob id
+        records = []
+        for store in [
+                self.manager.meta_records,
+                self.manager.fomod_records,
+                self.manager.listing_records,
+                self.manager.import_records,
+                self.manager.sources.records]:
+            for blob_id in store.keys():
+                if blob_id not in blob_ids or blob_id in evicted_ids:
+                    records.append((store, blob_id))
+
+        return {
+            'blobs': unreferenced,
+            'records': records,
+            'download_cache': self.download_cache_evictions()
+        }
+
+    def collect(self, dry_run=False):
+        '''
+        @param dry_run: only report what would be evicted
+        @return: dict describing what was (or would be) evicted and the
+            number of bytes reclaimed
+        '''
+        plan = self.plan()
+        reclaimable = {
+            'blobs': sum(
+                self.manager.blobs.size(blob_id) for blob_id in plan['blobs']),
+            'records': sum(
+                store.size(blob_id) for store, blob_id in plan['records']),
+            'download_cache': sum(
+                path.stat().st_size for path in plan['download_cache']),
+            'materialized': sum(
+                path.stat().st_size
+                for path in self.paths.materialized.glob('*')
+                if path.is_file())}
+
+        if not dry_run:
+            for blob_id in plan['blobs']:
+                self.manager.blobs.remove(blob_id)
+            for store, blob_id in plan['records']:
+                store.delete(blob_id)
+            for path in plan['download_cache']:
+                path.unlink()
+            self.manager.blobs.evict_materialized(0)
+
+            # chunks are shared between blobs, so they can only be reclaimed
+            # by compacting the chunk store once the blobs are gone
+            if plan['blobs'] and self.manager.blobs.has_chunk_store():
+                self.manager.blobs.chunk_store.compact()
+
+            # drop evicted sources from the reverse index, forget evicted
+            # downloads, and remove view entries of evicted blobs
+            self.manager.sources.index.update_many({
+                blob_id: []
+                for store, blob_id in plan['records']
+                if store is self.manager.sources.records})
+            self.prune_download_index()
+            self.manager.rebuild_view()
+
+        return {
+            'dry_run': dry_run,
+            'blobs': plan['blobs'],
+            'records': sorted(
+                f'{store.folder.name}/{blob_id}'
+                for store, blob_id in plan['records']),
+            'download_cache': sorted(
+                path.name for path in plan['download_cache']),
+            'reclaimable_bytes': reclaimable,
+            'total_reclaimable_bytes': sum(reclaimable.values())
+        }
+
+    def prune_download_index(self):
+        index_file = self.paths.download_cache / 'nexus_download_index.yaml'
+        if index_file.exists():
+            index = yaml_load(index_file.read_text()) or {}
+            index = {
+                key: value for key, value in index.items()
+                if (self.paths.download_cache / value['file_name']).exists()}
+            index_file.write_text(yaml_dump(index))
@@ -1,16 +1,50 @@
 from contextlib import contextmanager
 from dataclasses import dataclass
+import os
 from pathlib import Path
 import shutil
-
-from skypackages.sources import NexusPackageSource, GenericPackageSource
-from skypackages.tarballs import Tarball
+import threading
+import time
+
+import requests
+
+from skypackages.blob_server import SkybuildRemoteBlobs
+from skypackages.chunks import ChunkStore
+from skypackages.fomod import (
+    dump_fomod_data,
+    FOMOD_DATA_FORMAT,
+    index_fomod,
+    load_fomod_data,
+    SkybuildFomodSimulator)
+from skypackages.fomod_analysis import FomodConfigurationAnalyzer
+from skypackages.fomod_plan import (
+    install_conflicts,
+    listing_expander,
+    plan_fomod_install)
+from skypackages.fsck import SkybuildIntegrityChecker
+from skypackages.garbage import SkybuildGarbageCollector
+from skypackages.records import RecordStore
+from skypackages.similarity import find_near_duplicates
+from skypackages.sources import (
+    merged_sources_data,
+    SOURCE_CLASSES,
+    SourcesReverseIndex)
+from skypackages.sync import (
+    build_manifest,
+    SkybuildSyncExporter,
+    SkybuildSyncImporter)
+from skypackages.tarballs import (
+    contents_members,
+    dump_members,
+    load_members,
+    Tarball)
 from skypackages.utils import (
+    atomic_write,
     compute_file_md5,
     copy_file,
-    create_shortcut,
     yaml_dump,
     yaml_load)
+from skypackages.views import select_view_backend, ViewBuilder
 
 
 @dataclass
@@ -32,8 +66,8 @@ class SkybuildPackagesPaths:
         # tarball blobs
         self.sources = self.root / 'sources'
 
-        # folder for shortcuts to blobs created with names resembling the
-        # original names of source files; useful for manual browsing
+        # folder for links/shortcuts to blobs created with names resembling
+        # the original names of source files; useful for manual browsing
         self.view = self.root / 'view'
 
         # tmp folder; various processes may use this folder for temporary work
@@ -43,29 +77,107 @@ class SkybuildPackagesPaths:
         # into blobs
         self.download_cache = self.root / 'download_cache'
 
+        # cache of nexus api responses and mod pictures
+        self.nexus_cache = self.root / 'nexus_cache'
+
+        # per-blob state of the last integrity check
+        self.fsck_state = self.root / 'fsck.yaml'
+
+        # chunk store; blobs stored as deduplicated content-defined chunks
+        # live here instead of in the blobs folder
+        self.chunks = self.root / 'chunks'
+
+        # blobs reconstructed from the chunk store for tools that need a
+        # real file (e.g. 7z)
+        self.materialized = self.root / 'materialized'
+
+        # packages folder settings
+        self.config = self.root / 'config.yaml'
+
+        # precomputed time sort keys for the aliases list
+        self.alias_sort_index = self.root / 'alias_sort_index.yaml'
+
+        # parsed fomod configs of fomod blobs, so that fomods can be run
+        # without extracting and parsing their xml
+        self.fomods = self.root / 'fomods'
+
+        # sizes and CRCs of the member files of tarball blobs; kept apart
+        # from meta, which many more places load
+        self.listings = self.root / 'listings'
+
+        # import times and original file mtimes of tarball blobs, used to
+        # sort aliases by time
+        self.imports = self.root / 'imports'
+
     def override_aliases(self, aliases_path):
         self.aliases = Path(aliases_path)
 
     def create_all(self):
         self.blobs.mkdir(parents=True, exist_ok=True)
         self.meta.mkdir(parents=True, exist_ok=True)
+        self.fomods.mkdir(parents=True, exist_ok=True)
+        self.listings.mkdir(parents=True, exist_ok=True)
+        self.imports.mkdir(parents=True, exist_ok=True)
         self.aliases.mkdir(parents=True, exist_ok=True)
         self.sources.mkdir(parents=True, exist_ok=True)
         self.view.mkdir(parents=True, exist_ok=True)
         self.tmp.mkdir(parents=True, exist_ok=True)
         self.download_cache.mkdir(parents=True, exist_ok=True)
+        self.nexus_cache.mkdir(parents=True, exist_ok=True)
 
 
 class SkybuildPackageManager:
-    def __init__(self, root, aliases_folder=None):
+    def __init__(self, root, aliases_folder=None, view_mode='auto',
+                 storage=None, remote=None):
         self.root = Path(root)
         self.aliases_folder = aliases_folder
+        self.view_mode = view_mode
         self.paths = SkybuildPackagesPaths(self.root)
         if self.aliases_folder:
             self.paths.override_aliases(self.aliases_folder)
         self.paths.create_all()
+        self.storage = storage or self.config.get('storage', 'files')
         self.aliases = SkybuildAliases(self.paths.aliases)
+        self.alias_sort_index = SkybuildAliasSortIndex(self)
         self.sources = SkybuildSources(self.paths.sources)
+        self.blobs = SkybuildBlobStore(
+            self.paths, chunked=self.storage == 'chunks',
+            materialized_budget=self.config.get(
+                'materialized_budget',
+                SkybuildBlobStore.MATERIALIZED_BUDGET))
+        self.meta_records = RecordStore.for_folder(self.paths.meta)
+        self.fomod_records = RecordStore.for_folder(self.paths.fomods)
+        self.listing_records = RecordStore.for_folder(self.paths.listings)
+        self.import_records = RecordStore.for_folder(self.paths.imports)
+        self._view_builder = None
+        self.import_lock = threading.Lock()
+
+        # url of another machine's `skypackages serve`, consulted for blobs
+        # missing here before going to Nexus
+        remote = remote or self.config.get('remote')
+        self.remote = SkybuildRemoteBlobs(remote) if remote else None
+
+    @property
+    def config(self):
+        if self.paths.config.exists():
+            return yaml_load(self.paths.config.read_text()) or {}
+        return {}
+
+    def set_config(self, key, value):
+        config = self.config
+        config[key] = value
+        self.paths.config.write_text(yaml_dump(config))
+
+    @property
+    def view_builder(self):
+        if self._view_builder is None:
+            self._view_builder = ViewBuilder(
+                self.paths.blobs,
+                self.paths.view,
+                select_view_backend(
+                    self.paths.view, self.view_mode,
+                    blobs_folder=self.paths.blobs))
+        return self._view_builder
 
     def add_source(self, alias, source, file_path):
         source.validate(file_path)
@@ -74,64 +186,464 @@ class SkybuildPackageManager:
         file_name = Path(source.file_name)
         md5 = compute_file_md5(file_path)
         blob_id = f'{md5}{file_name.suffix}'
-        blob = self.paths.blobs / blob_id
-        if not blob.exists():
-            copy_file(file_path, blob)
-
-        view_path = (
-            self.paths.view / f'{file_name.stem}-{md5[:8]}{file_name.suffix}.lnk')
-        if not view_path.exists():
-            create_shortcut(blob, view_path)
+        with self.import_lock:
+            # imports run on several threads, possibly of the same file
+            if not self.blobs.exists(blob_id):
+                self.blobs.add(blob_id, file_path)
+                self.record_import(blob_id, file_path)
 
         # save source details
-        source.save_details(blob_id, self.paths.sources)
+        source.save_details(
+            blob_id, self.paths.sources, index=self.sources.index)
 
         # apply aliases
         self.aliases.add(alias, blob_id)
 
+        # the view is only a convenience, and can be rebuilt at any time
+        self.view_builder.add(file_name, blob_id)
+
     def update_source(self, blob_id, source):
-        source.save_details(blob_id, self.paths.sources)
+        source.save_details(
+            blob_id, self.paths.sources, index=self.sources.index)
+
+    def update_sources(self, pairs):
+        self.sources.save_batch(pairs)
+
+    def rebuild_view(self, workers=8, dry_run=False):
+        return self.view_builder.rebuild(
+            self.sources.index.data['file_name'],
+            workers=workers,
+            dry_run=dry_run)
+
+    def collect_garbage(self, pinned=None, download_cache_budget=None,
+                        dry_run=False, force=False):
+        return SkybuildGarbageCollector(
+            self,
+            pinned=pinned,
+            download_cache_budget=download_cache_budget,
+            force=force).collect(dry_run=dry_run)
+
+    def fsck(self, workers=4, full=False):
+        return SkybuildIntegrityChecker(self, workers=workers).check(full=full)
+
+    def manifest(self):
+        return build_manifest(self)
+
+    def sync_export(self, export_root, target_manifest=None, workers=4):
+        return SkybuildSyncExporter(
+            self, export_root, workers=workers).export(
+                target_manifest=target_manifest)
+
+    def sync_import(self, location, workers=4, dry_run=False):
+        return SkybuildSyncImporter(
+            self, location, workers=workers).sync(dry_run=dry_run)
+
+    def find_near_duplicates(self, threshold=0.8, index_missing=False):
+        return find_near_duplicates(
+            self, threshold=threshold, index_missing=index_missing)
+
+    def simulate_fomods(self, choices_by_alias=None, aliases=None,
+                        workers=4):
+        return SkybuildFomodSimulator(self, workers=workers).run(
+            choices_by_alias=choices_by_alias, aliases=aliases)
+
+    def analyze_fomod(self, blob_id, max_seconds=30, max_steps=1000000):
+        data = self.fomod_data(blob_id)
+        assert data, f'blob {blob_id} is not a fomod'
+        assert not data.get('error'), (
+            f'cannot parse fomod of {blob_id}: {data["error"]}')
+        meta = self.listed_meta(blob_id)
+        return FomodConfigurationAnalyzer(
+            data, max_seconds=max_seconds, max_steps=max_steps,
+            expand=listing_expander(meta)).analyze()
+
+    def fomod_install_plan(self, blob_id, choices):
+        '''
+        Files that installing a fomod blob with the given choices would
+        put where, resolved without extracting the blob
+        '''
+        data = self.fomod_data(blob_id)
+        if not data:
+            return {'errors': [f'blob {blob_id} is not a fomod']}
+        if data.get('error'):
+            return {'errors': [f'cannot parse fomod: {data["error"]}']}
+        meta = self.listed_meta(blob_id)
+        return plan_fomod_install(data, meta, choices)
+
+    def fomod_install_plans(self, choices_by_alias):
+        '''
+        Install plans of the selected fomod blobs of the given aliases,
+        along with the destinations more than one of them installs
+        '''
+        plans = {}
+        for alias, choices in choices_by_alias.items():
+            blob_id = self.aliases.get_selection(alias)
+            if blob_id is None:
+                plans[alias] = {
+                    'errors': [f'alias {alias} has no selected blob']}
+            else:
+                plans[alias] = {
+                    'blob_id': blob_id,
+                    **self.fomod_install_plan(blob_id, choices)}
+        return {'plans': plans, 'conflicts': install_conflicts(plans)}
+
+    def use_chunk_storage(self):
+        '''
+        Switches the packages folder over to chunked storage, moving every
+        blob in the blobs folder into the chunk store; returns the chunk
+        store stats. View entries only exist for blobs stored as plain
+        files, so the view is rebuilt to drop the entries of moved blobs.
+        '''
+        self.set_config('storage', 'chunks')
+        self.storage = 'chunks'
+        self.blobs.chunked = True
+        for blob_id in self.blobs.file_blob_ids():
+            self.blobs.convert_to_chunks(blob_id)
+        stats = self.blobs.chunk_store.stats()
+        stats['view'] = self.rebuild_view()
+        return stats
+
+    def fetch_remote_blob(self, blob_id, dest=None):
+        '''
+        Downloads a blob from the remote tier, either into `dest` or, by
+        default, into this packages folder; returns the downloaded file, or
+        None if there is no remote or it does not have the blob
+        '''
+        if self.remote is None:
+            return None
+        partial = self.paths.tmp / 'remote' / blob_id
+        partial.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            if not self.remote.exists(blob_id):
+                return None
+            self.remote.fetch(blob_id, partial)
+        except requests.RequestException as e:
+            print(f'remote {self.remote.url} failed for {blob_id} ({e})')
+            return None
+        if dest is None:
+            self.blobs.add(blob_id, partial)
+            partial.unlink()
+            return self.blobs.path(blob_id)
+        partial.replace(dest)
+        return dest
+
+    def download_nexus_file(self, nexus_file, progress=None):
+        '''
+        Gets a Nexus file into the download cache, from the remote tier if it
+        has already imported that file, and from Nexus otherwise
+
+        @param progress: passed on to `download_url` for Nexus downloads
+        '''
+        if self.remote is not None:
+            try:
+                blob_ids = self.remote.find_nexus(
+                    nexus_file.game, nexus_file.mod_id, nexus_file.file_id)
+            except requests.RequestException as e:
+                print(f'remote {self.remote.url} failed ({e})')
+                blob_ids = []
+            for blob_id in blob_ids:
+                downloaded = self.fetch_remote_blob(
+                    blob_id, self.paths.download_cache / nexus_file.file_name)
+                if downloaded:
+                    return downloaded
+        return nexus_file.download_into(
+            self.paths.download_cache, progress=progress)
 
     def fetch_tarball(self, blob_id):
-        return Tarball(self.paths.blobs / blob_id)
+        if not self.blobs.exists(blob_id):
+            self.fetch_remote_blob(blob_id)
+        return Tarball(
+            self.blobs.file_path(blob_id),
+            materialize=lambda: self.blobs.path(blob_id),
+            opener=lambda: self.blobs.open(blob_id))
+
+    def stored_meta(self, blob_id):
+        # whatever is recorded for the blob, which is nothing if its contents
+        # have not been listed yet
+        text = self.meta_records.get(blob_id)
+        return (yaml_load(text) or {}) if text else {}
+
+    def record_import(self, blob_id, file_path):
+        self.import_records.put(blob_id, yaml_dump({
+            'imported': time.time(),
+            'mtime': Path(file_path).stat().st_mtime}))
+
+    def blob_time(self, blob_id):
+        '''
+        Import time of a blob, used to sort by time; blobs imported before
+        import times were recorded fall back on their file mtime, which then
+        gets recorded as their import time
+        '''
+        text = self.import_records.get(blob_id)
+        if text:
+            return yaml_load(text)['imported']
+        if not self.blobs.exists(blob_id):
+            return 0
+        mtime = self.blobs.mtime(blob_id)
+        self.import_records.put(
+            blob_id, yaml_dump({'imported': mtime, 'mtime': mtime}))
+        return mtime
 
     def meta(self, blob_id, refresh=False):
-        meta_file = self.paths.meta / f'{blob_id}.yaml'
-        if meta_file.exists() and not refresh:
-            meta = yaml_load(meta_file.read_text())
+        stored = self.stored_meta(blob_id)
+        if 'filelist' in stored and not refresh:
+            meta = stored
         else:
-            blob = self.paths.blobs / blob_id
-            tarball = Tarball(blob)
+            tarball = self.fetch_tarball(blob_id)
             meta = {
                 'filelist': [str(key) for key in tarball.contents.keys()],
                 'fomod_root': (
                     str(tarball.fomod_root) if tarball.fomod_root else
                     str(tarball.fomod_file) if tarball.fomod_file else None)
             }
-            meta_file.write_text(yaml_dump(meta))
+            self.listing_records.put(
+                blob_id, dump_members(contents_members(tarball.contents)))
+            self.meta_records.put(blob_id, yaml_dump(meta))
+            # fomods get (re)indexed by `fomod_data` when first needed,
+            # keeping metadata lookups down to listing the archive
+            self.fomod_records.delete(blob_id)
         return meta
 
+    def stored_members(self, blob_id):
+        # None if the blob's listing has not been recorded yet
+        text = self.listing_records.get(blob_id)
+        return load_members(text) if text else None
+
+    def members(self, blob_id):
+        '''
+        Sizes and CRCs of the member files of a blob, keyed by member path
+        '''
+        members = self.stored_members(blob_id)
+        if members is None:
+            self.meta(blob_id, refresh=True)
+            members = self.stored_members(blob_id)
+        return members
+
+    def listed_meta(self, blob_id):
+        '''
+        Blob metadata along with the sizes and CRCs of its members (see
+        `members`), as the fomod plans and the contents tree use it
+        '''
+        meta = self.meta(blob_id)
+        return {**meta, 'members': self.members(blob_id)}
+
+    def index_fomod(self, blob_id, tarball, meta):
+        data = index_fomod(
+            tarball, meta, self.paths.tmp / 'fomod_config' / blob_id)
+        self.fomod_records.put(blob_id, dump_fomod_data(data))
+        return data
+
+    def fomod_data(self, blob_id, refresh=False):
+        '''
+        Parsed fomod of a blob in its cached form (see
+        `skypackages.fomod.fomod_to_data`), indexing it if it is not cached
+        yet; None for blobs that are not fomods
+        '''
+        meta = self.meta(blob_id)
+        if not meta['fomod_root']:
+            return None
+        text = self.fomod_records.get(blob_id)
+        data = load_fomod_data(text) if text else None
+        if refresh or not data or data.get('format') != FOMOD_DATA_FORMAT:
+            data = self.index_fomod(
+                blob_id, self.fetch_tarball(blob_id), meta)
+        return data
+
+    def pack_records(self):
+        '''
+        Switches the meta and sources folders to packed storage; returns the
+        number of loose records moved into packs per folder
+        '''
+        return {
+            'meta': self.meta_records.pack(),
+            'fomods': self.fomod_records.pack(),
+            'listings': self.listing_records.pack(),
+            'imports': self.import_records.pack(),
+            'sources': self.sources.records.pack()}
+
+    def compact_records(self):
+        return {
+            'meta': self.meta_records.compact(),
+            'fomods': self.fomod_records.compact(),
+            'listings': self.listing_records.compact(),
+            'imports': self.import_records.compact(),
+            'sources': self.sources.records.compact()}
+
     def clean_tmp(self):
         shutil.rmtree(self.paths.tmp)
         self.paths.tmp.mkdir(parents=True, exist_ok=True)
+        self.blobs.evict_materialized(0)
+
+
+class SkybuildBlobStore:
+    '''
+    Access to blob contents regardless of how they are stored: blobs are
+    either plain files in the blobs folder or recipes in the chunk store.
+    Both kinds are always readable; `chunked` only decides how newly added
+    blobs get stored.
+
+    Chunked blobs that tools need as real files are materialized into a
+    cache folder, which is kept under `materialized_budget` bytes by
+    evicting the least recently used copies.
+    '''
+    MATERIALIZED_BUDGET = 4 * 1024 ** 3
+
+    def __init__(self, paths, chunked=False,
+                 materialized_budget=MATERIALIZED_BUDGET):
+        self.paths = paths
+        self.chunked = chunked
+        self.materialized_budget = materialized_budget
+        self._chunk_store = None
+
+    @property
+    def chunk_store(self):
+        if self._chunk_store is None:
+            self._chunk_store = ChunkStore(self.paths.chunks)
+        return self._chunk_store
+
+    def has_chunk_store(self):
+        return self._chunk_store is not None or self.paths.chunks.exists()
+
+    def file_path(self, blob_id):
+        return self.paths.blobs / blob_id
+
+    def is_chunked(self, blob_id):
+        return (
+            not self.file_path(blob_id).exists() and
+            self.has_chunk_store() and self.chunk_store.exists(blob_id))
+
+    def exists(self, blob_id):
+        return self.file_path(blob_id).exists() or self.is_chunked(blob_id)
+
+    def file_blob_ids(self):
+        return [
+            path.name for path in self.paths.blobs.iterdir() if path.is_file()]
+
+    def blob_ids(self):
+        blob_ids = set(self.file_blob_ids())
+        if self.has_chunk_store():
+            blob_ids.update(self.chunk_store.blob_ids())
+        return sorted(blob_ids)
+
+    def add(self, blob_id, file_path):
+        if self.chunked:
+            self.chunk_store.add(blob_id, file_path)
+        else:
+            copy_file(file_path, self.file_path(blob_id))
+
+    def convert_to_chunks(self, blob_id):
+        blob = self.file_path(blob_id)
+        self.chunk_store.add(blob_id, blob)
+        blob.unlink()
+
+    def path(self, blob_id):
+        # a real file for the blob, reconstructing it from chunks if needed
+        if self.is_chunked(blob_id):
+            materialized = self.paths.materialized / blob_id
+            if materialized.exists():
+                # mark it as recently used; access times are unreliable
+                os.utime(str(materialized))
+            else:
+                self.chunk_store.materialize(blob_id, materialized)
+                self.evict_materialized(
+                    self.materialized_budget, keep=materialized)
+            return materialized
+        return self.file_path(blob_id)
+
+    def evict_materialized(self, budget, keep=None):
+        '''
+        Deletes least recently used materialized blobs until the rest fit
+        in `budget` bytes; returns the number of bytes reclaimed
+        '''
+        if not self.paths.materialized.exists():
+            return 0
+        entries = [
+            path for path in self.paths.materialized.iterdir()
+            if path.is_file() and path != keep]
+        stats = {path: path.stat() for path in entries}
+        total = sum(stat.st_size for stat in stats.values())
+        if keep is not None:
+            total += keep.stat().st_size
+        reclaimed = 0
+        for path in sorted(entries, key=lambda path: stats[path].st_mtime):
+            if total <= budget:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                # still open by a tool on windows; try again next time
+                continue
+            total -= stats[path].st_size
+            reclaimed += stats[path].st_size
+        return reclaimed
+
+    def open(self, blob_id):
+        if self.is_chunked(blob_id):
+            return self.chunk_store.open(blob_id)
+        return open(str(self.file_path(blob_id)), 'rb')
+
+    def size(self, blob_id):
+        if self.is_chunked(blob_id):
+            return self.chunk_store.size(blob_id)
+        return self.file_path(blob_id).stat().st_size
+
+    def mtime(self, blob_id):
+        if self.is_chunked(blob_id):
+            return self.chunk_store.recipe_file(blob_id).stat().st_mtime
+        return self.file_path(blob_id).stat().st_mtime
+
+    def remove(self, blob_id):
+        if self.file_path(blob_id).exists():
+            self.file_path(blob_id).unlink()
+        if self.has_chunk_store() and self.chunk_store.exists(blob_id):
+            self.chunk_store.remove(blob_id)
+        materialized = self.paths.materialized / blob_id
+        if materialized.exists():
+            materialized.unlink()
 
 
 class SkybuildSources:
-    SOURCE_CLASSES = {
-        class_.__name__: class_ for class_ in [
-            NexusPackageSource,
-            GenericPackageSource
-        ]
-    }
+    SOURCE_CLASSES = SOURCE_CLASSES
 
     def __init__(self, root):
         self.root = Path(root)
+        self.records = RecordStore.for_folder(self.root)
+        self.index = SourcesReverseIndex(self.root)
+
+    def find_nexus(self, game, mod_id, file_id):
+        return self.index.find_nexus(game, mod_id, file_id)
+
+    def find_file_name(self, file_name):
+        return self.index.find_file_name(file_name)
+
+    def find_url(self, url):
+        return self.index.find_url(url)
+
+    def save_batch(self, pairs):
+        '''
+        Saves many (blob_id, source) pairs at once; sources are grouped per
+        blob so that each sources record is read once, and the records and
+        the reverse index are each written once for the whole batch
+        '''
+        grouped = {}
+        for blob_id, source in pairs:
+            grouped.setdefault(blob_id, []).append(source)
+
+        with self.records.lock:
+            updated = {
+                blob_id: merged_sources_data(self.records, blob_id, sources)
+                for blob_id, sources in grouped.items()}
+            self.records.put_many([
+                (blob_id, yaml_dump(data))
+                for blob_id, data in updated.items()])
+            self.index.update_many({
+                blob_id: data['entries'] for blob_id, data in updated.items()})
 
     def fetch(self, blob_id):
         sources = []
-        file_path = self.root / f'{blob_id}.yaml'
-        if file_path.exists():
-            data = yaml_load(file_path.read_text())
+        text = self.records.get(blob_id)
+        if text:
+            data = yaml_load(text)
             if data:
                 for entry in data['entries']:
                     class_ = self.SOURCE_CLASSES[entry.pop('class')]
@@ -140,6 +652,10 @@ class SkybuildSources:
 
 
 class SkybuildAliases:
+    # sessions read, modify and write whole files, and imports running on
+    # several threads add aliases at the same time
+    lock = threading.RLock()
+
     def __init__(self, root):
         self.root = Path(root)
         self.aliases_file = self.root / 'aliases.yaml'
@@ -147,13 +663,14 @@ class SkybuildAliases:
 
     @contextmanager
     def session(self, file_, read_only=False):
-        if file_.exists():
-            data = yaml_load(file_.read_text())
-        else:
-            data = {}
-        yield data
-        if not read_only:
-            file_.write_text(yaml_dump(data))
+        with self.lock:
+            if file_.exists():
+                data = yaml_load(file_.read_text())
+            else:
+                data = {}
+            yield data
+            if not read_only:
+                atomic_write(file_, yaml_dump(data))
 
     @property
     def data(self):
@@ -228,3 +745,66 @@ class SkybuildAliases:
 
         with self.session(self.selection_file) as selection:
             selection[alias] = blob_id
+
+
+class SkybuildAliasSortIndex:
+    '''
+    Time sort keys for the aliases list (the import time of each alias's
+    selected blob, or of its newest blob if none is selected), stored in the
+    packages folder and only recomputed when the aliases or selection files
+    change; even then, keys of aliases whose blob did not change are reused
+    '''
+    def __init__(self, manager):
+        self.manager = manager
+        self.index_file = manager.paths.alias_sort_index
+        self._index = None
+
+    def signature(self):
+        aliases = self.manager.aliases
+        signature = []
+        for path in [aliases.aliases_file, aliases.selection_file]:
+            if path.exists():
+                stat = path.stat()
+                signature.append([stat.st_mtime_ns, stat.st_size])
+            else:
+                signature.append(None)
+        return signature
+
+    def load(self):
+        if self._index is None and self.index_file.exists():
+            self._index = yaml_load(self.index_file.read_text())
+        return self._index or {'signature': None, 'entries': {}}
+
+    def keys(self):
+        '''
+        @return: mapping of alias to its time sort key
+        '''
+        index = self.load()
+        signature = self.signature()
+        if index['signature'] != signature:
+            index = self.rebuild(index, signature)
+        return {
+            alias: entry[-1] for alias, entry in index['entries'].items()}
+
+    def rebuild(self, index, signature):
+        aliases = self.manager.aliases.data
+        selections = self.manager.aliases.get_selections(
+            permit_unselected=True)
+        entries = {}
+        for alias, blob_ids in aliases.items():
+            # an entry is [selected blob id, the alias's blob ids, key]; an
+            # unselected alias's key depends on all of its blobs
+            selected = selections.get(alias)
+            previous = index['entries'].get(alias)
+            if previous and previous[:-1] == [selected, blob_ids]:
+                entries[alias] = previous
+            elif selected:
+                entries[alias] = [
+                    selected, blob_ids, self.manager.blob_time(selected)]
+            else:
+                entries[alias] = [selected, blob_ids, max(
+                    (self.manager.blob_time(blob_id) for blob_id in blob_ids),
+                    default=0)]
+        self._index = {'signature': signature, 'entries': entries}
+        atomic_write(self.index_file, yaml_dump(self._index))
+        return self._index
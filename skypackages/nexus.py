@@ -1,24 +1,365 @@
 import bbcode
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 import datetime
+from enum import IntEnum
+import hashlib
+import heapq
 import html
+import itertools
 from pathlib import Path
-from pynxm import Nexus
+from pynxm import Nexus, LimitReachedError
+import re
+import requests
+import threading
+import time
 from urllib.parse import urlparse
+import weakref
 
 from skypackages.sources import NexusPackageSource
 from skypackages.utils import (
+    atomic_write,
     compute_file_md5,
     download_url,
+    DownloadTooSlowError,
     ReadOnlyDictDataAttribute,
     yaml_dump,
     yaml_load)
 
 
+class NexusPriority(IntEnum):
+    interactive = 0
+    background = 1
+
+
+class NexusRequestScheduler:
+    '''
+    Funnels every request made against a `pynxm.Nexus` instance so that we
+    stay within the daily and hourly request budgets that Nexus reports in
+    its `X-RL-*` response headers: requests go out freely while the daily
+    budget lasts, after which the hourly budget applies. Requests are served
+    in priority order (interactive before background); once on the hourly
+    budget, background requests additionally leave a reserve of it untouched
+    so the GUI stays usable while batch work is running. When the budget
+    runs out, callers block until the budget resets instead of failing.
+    '''
+    _schedulers = weakref.WeakKeyDictionary()
+    _schedulers_lock = threading.Lock()
+
+    def __init__(self, api, background_reserve=10, max_concurrent=4):
+        self.api = api
+        self.background_reserve = background_reserve
+        self.max_concurrent = max_concurrent
+
+        self.daily_limit = None
+        self.daily_remaining = None
+        self.daily_reset = None
+        self.hourly_limit = None
+        self.hourly_remaining = None
+        self.hourly_reset = None
+
+        self.requests_made = 0
+        self.requests_throttled = 0
+        self.limits_reached = 0
+        self.seconds_throttled = 0.0
+
+        self._condition = threading.Condition()
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._in_flight = 0
+
+        self.api.session.hooks['response'].append(self.record_headers)
+
+    @classmethod
+    def for_api(cls, api):
+        with cls._schedulers_lock:
+            scheduler = cls._schedulers.get(api)
+            if scheduler is None:
+                scheduler = cls(api)
+                cls._schedulers[api] = scheduler
+            return scheduler
+
+    @staticmethod
+    def parse_reset(value):
+        try:
+            return datetime.datetime.strptime(
+                value, '%Y-%m-%d %H:%M:%S %z').timestamp()
+        except (TypeError, ValueError):
+            return None
+
+    def record_headers(self, response, *args, **kwargs):
+        headers = response.headers
+        with self._condition:
+            for attr, header, convert in [
+                    ('daily_limit', 'X-RL-Daily-Limit', int),
+                    ('daily_remaining', 'X-RL-Daily-Remaining', int),
+                    ('daily_reset', 'X-RL-Daily-Reset', self.parse_reset),
+                    ('hourly_limit', 'X-RL-Hourly-Limit', int),
+                    ('hourly_remaining', 'X-RL-Hourly-Remaining', int),
+                    ('hourly_reset', 'X-RL-Hourly-Reset', self.parse_reset)]:
+                if header in headers:
+                    value = convert(headers[header])
+                    if value is not None:
+                        setattr(self, attr, value)
+            self._condition.notify_all()
+        return response
+
+    def next_hour(self):
+        now = time.time()
+        return now - now % 3600 + 3600
+
+    def budget_wait(self, priority):
+        '''
+        Returns the number of seconds a request of the given priority has to
+        wait for the budget to allow it, or 0 if it can be sent right away
+        '''
+        # nexus serves requests while the daily budget lasts, and only
+        # enforces the hourly limit once the daily budget is used up
+        now = time.time()
+        if self.daily_reset and now >= self.daily_reset:
+            # the daily budget has reset since we last heard from nexus; let
+            # the request through and pick up the fresh budget from its
+            # response
+            return 0
+        # account for requests that are already in flight, since their
+        # responses have not decremented the remaining budget yet
+        if (self.daily_remaining is not None and
+                self.daily_remaining - self._in_flight > 0):
+            return 0
+        if self.hourly_reset and now >= self.hourly_reset:
+            return 0
+        if self.hourly_remaining is not None:
+            reserve = (
+                self.background_reserve
+                if priority is NexusPriority.background else 0)
+            if self.hourly_remaining - self._in_flight <= reserve:
+                resets = [
+                    reset for reset in (self.hourly_reset, self.daily_reset)
+                    if reset] or [self.next_hour()]
+                return max(min(resets) - now, 1)
+        return 0
+
+    def acquire(self, priority):
+        with self._condition:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            throttled = False
+            started = time.time()
+            try:
+                while True:
+                    if (self._waiting[0] == ticket and
+                            self._in_flight < self.max_concurrent):
+                        wait = self.budget_wait(priority)
+                        if not wait:
+                            break
+                        throttled = True
+                    else:
+                        wait = None
+                    self._condition.wait(
+                        timeout=None if wait is None else min(wait, 60))
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+            self._in_flight += 1
+            if throttled:
+                self.requests_throttled += 1
+                self.seconds_throttled += time.time() - started
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self.requests_made += 1
+            self._condition.notify_all()
+
+    def call(self, method, *args, priority=NexusPriority.interactive,
+             **kwargs):
+        while True:
+            self.acquire(priority)
+            try:
+                return getattr(self.api, method)(*args, **kwargs)
+            except LimitReachedError:
+                # our view of the budget is out of date (e.g. another tool is
+                # sharing the same api key); mark the hourly budget exhausted
+                # and queue the request again until the budget resets; nexus
+                # only limits us once the daily budget is gone as well
+                with self._condition:
+                    self.limits_reached += 1
+                    self.daily_remaining = 0
+                    self.hourly_remaining = 0
+                    if not self.hourly_reset or self.hourly_reset < time.time():
+                        self.hourly_reset = self.next_hour()
+            finally:
+                self.release()
+
+    @property
+    def stats(self):
+        with self._condition:
+            return {
+                'daily_limit': self.daily_limit,
+                'daily_remaining': self.daily_remaining,
+                'daily_reset': self.daily_reset,
+                'hourly_limit': self.hourly_limit,
+                'hourly_remaining': self.hourly_remaining,
+                'hourly_reset': self.hourly_reset,
+                'in_flight': self._in_flight,
+                'waiting': len(self._waiting),
+                'requests_made': self.requests_made,
+                'requests_throttled': self.requests_throttled,
+                'limits_reached': self.limits_reached,
+                'seconds_throttled': round(self.seconds_throttled, 3)
+            }
+
+
+class NexusMirrorScores:
+    '''
+    Rolling per-mirror throughput scores (bytes/sec), persisted to disk so
+    that mirror selection for Nexus downloads reflects what has actually
+    been fast from this machine. Downloads run concurrently, each with its
+    own scores, so saving replays the measurements taken since loading onto
+    the scores currently on disk rather than overwriting them.
+    '''
+    DEFAULT_PREFERENCE = ['Nexus CDN']
+
+    lock = threading.Lock()
+
+    def __init__(self, scores_file, smoothing=0.3, collapse_ratio=0.25,
+                 probe_bytes=256 * 1024):
+        self.scores_file = Path(scores_file)
+        self.smoothing = smoothing
+        self.collapse_ratio = collapse_ratio
+        self.probe_bytes = probe_bytes
+        self.scores = self.load()
+        self.measured = []
+
+    def load(self):
+        if self.scores_file.exists():
+            return yaml_load(self.scores_file.read_text()) or {}
+        return {}
+
+    def save(self):
+        with self.lock:
+            scores = self.load()
+            for mirror, bytes_per_sec in self.measured:
+                self.apply(scores, mirror, bytes_per_sec)
+            atomic_write(self.scores_file, yaml_dump(scores))
+            self.scores = scores
+            self.measured = []
+
+    def apply(self, scores, mirror, bytes_per_sec):
+        previous = scores.get(mirror)
+        if previous is None:
+            scores[mirror] = float(bytes_per_sec)
+        else:
+            scores[mirror] = (
+                self.smoothing * bytes_per_sec +
+                (1 - self.smoothing) * previous)
+
+    def record(self, mirror, bytes_per_sec):
+        self.apply(self.scores, mirror, bytes_per_sec)
+        self.measured.append((mirror, bytes_per_sec))
+
+    def probe(self, mirror, url):
+        headers = {'Range': f'bytes=0-{self.probe_bytes - 1}'}
+        started = time.monotonic()
+        received = 0
+        try:
+            with requests.get(
+                    url, stream=True, headers=headers, timeout=10) as response:
+                response.raise_for_status()
+                for data in response.iter_content(64 * 1024):
+                    received += len(data)
+                    if received >= self.probe_bytes:
+                        break
+        except requests.RequestException:
+            self.record(mirror, 0)
+        else:
+            self.record(
+                mirror, received / max(time.monotonic() - started, 1e-6))
+
+    def ranked(self, links, probe_unscored=False):
+        if probe_unscored:
+            for mirror, url in links.items():
+                if mirror not in self.scores:
+                    self.probe(mirror, url)
+
+        def sort_key(mirror):
+            # scored mirrors go first in order of throughput, unscored ones
+            # fall back to the static preference order
+            if mirror in self.scores:
+                return (0, -self.scores[mirror], '')
+            if mirror in self.DEFAULT_PREFERENCE:
+                return (1, self.DEFAULT_PREFERENCE.index(mirror), '')
+            return (2, 0, mirror)
+
+        return sorted(links, key=sort_key)
+
+    def collapse_threshold(self, mirror):
+        if self.scores.get(mirror):
+            return self.scores[mirror] * self.collapse_ratio
+
+
+NEXUS_MOD_URL_PATTERN = re.compile(
+    r'nexusmods\.com/(\w+)/mods/(\d+)', re.IGNORECASE)
+
+
+def create_description_parser():
+    parser = bbcode.Parser()
+
+    def render_size(name, value, options, parent, context):
+        return f'<span style="font-size: 4;">{value}</span>'
+
+    parser.add_formatter('size', render_size)
+    return parser
+
+
+# a single preconfigured parser is shared by all mods; formatting does not
+# mutate the parser so it is safe to use from the prefetch threads
+DESCRIPTION_PARSER = create_description_parser()
+
+
+class RenderedDescriptionCache:
+    '''
+    In-memory LRU of rendered mod descriptions keyed by
+    (game, mod_id, updated_timestamp), backed by the on-disk api cache when
+    one is given so that rendered descriptions survive restarts
+    '''
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, cache=None):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        if cache:
+            rendered = cache.load_description(*key)
+            if rendered is not None:
+                self.put(key, rendered)
+                return rendered
+
+    def put(self, key, rendered, cache=None):
+        with self.lock:
+            self.entries[key] = rendered
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        if cache:
+            cache.save_description(*key, rendered)
+
+
+RENDERED_DESCRIPTIONS = RenderedDescriptionCache()
+
+
 @dataclass
 class NexusMod:
     api: Nexus
     data: dict
+    priority: NexusPriority = NexusPriority.interactive
+    cache: object = None
 
     allow_rating = ReadOnlyDictDataAttribute('allow_rating')
     author = ReadOnlyDictDataAttribute('author')
@@ -49,22 +390,36 @@ class NexusMod:
         return self.domain_name
 
     @property
-    def description_html(self):
-        parser = bbcode.Parser()
-
-        def render_size(name, value, options, parent, context):
-            return f'<span style="font-size: 4;">{value}</span>'
+    def scheduler(self):
+        return NexusRequestScheduler.for_api(self.api)
 
-        parser.add_formatter('size', render_size)
-        cleaned = self.description.replace('<br />', '')
-        return html.unescape(parser.format(cleaned))
+    @property
+    def description_html(self):
+        key = (self.game, self.mod_id, self.updated_timestamp)
+        rendered = RENDERED_DESCRIPTIONS.get(key, cache=self.cache)
+        if rendered is None:
+            cleaned = self.description.replace('<br />', '')
+            rendered = html.unescape(DESCRIPTION_PARSER.format(cleaned))
+            RENDERED_DESCRIPTIONS.put(key, rendered, cache=self.cache)
+        return rendered
 
     @property
     def url(self):
         return f'https://www.nexusmods.com/{self.domain_name}/mods/{self.mod_id}'
 
-    @classmethod
-    def from_url(cls, api, url):
+    @property
+    def linked_mods(self):
+        # other mods of the same game that are linked from the description
+        linked = []
+        for game, mod_id in NEXUS_MOD_URL_PATTERN.findall(self.description):
+            key = (game, int(mod_id))
+            if game == self.game and key[1] != self.mod_id and (
+                    key not in linked):
+                linked.append(key)
+        return linked
+
+    @staticmethod
+    def parse_url(url):
         url_parts = urlparse(url)
         assert url_parts.netloc == 'www.nexusmods.com', (
             f'entered url netloc must be www.nexusmods.com; you entered '
@@ -81,30 +436,46 @@ class NexusMod:
                     mod_id = int(url_path_parts[i + 1])
         assert game and mod_id, (
             f'could not parse a game and a mod id from url {url}')
+        return game, mod_id
 
-        return cls.from_game_and_id(api=api, game=game, mod_id=mod_id)
+    @classmethod
+    def from_url(cls, api, url, priority=NexusPriority.interactive):
+        game, mod_id = cls.parse_url(url)
+        return cls.from_game_and_id(
+            api=api, game=game, mod_id=mod_id, priority=priority)
 
     @classmethod
-    def from_game_and_id(cls, api, game, mod_id):
-        data = api.mod_details(game, mod_id)
-        return cls(api=api, data=data)
+    def from_game_and_id(cls, api, game, mod_id,
+                         priority=NexusPriority.interactive):
+        data = NexusRequestScheduler.for_api(api).call(
+            'mod_details', game, mod_id, priority=priority)
+        return cls(api=api, data=data, priority=priority)
 
     @property
     def file_list(self):
+        return self.parse_file_list(self.scheduler.call(
+            'mod_file_list', self.game, self.mod_id, priority=self.priority))
+
+    def parse_file_list(self, file_list_data):
         return [
-            NexusModFile(self.api, self.game, self.mod_id, data)
-            for data in self.api.mod_file_list(
-                self.game, self.mod_id)['files']
+            NexusModFile(
+                self.api, self.game, self.mod_id, data, priority=self.priority)
+            for data in file_list_data['files']
             if data['category_name']
         ]
 
 
+# downloads run concurrently, and each one updates the download index
+DOWNLOAD_INDEX_LOCK = threading.Lock()
+
+
 @dataclass
 class NexusModFile:
     api: Nexus
     game: str
     mod_id: int
     data: dict
+    priority: NexusPriority = NexusPriority.interactive
 
     file_id = ReadOnlyDictDataAttribute('file_id')
     name = ReadOnlyDictDataAttribute('name')
@@ -131,17 +502,36 @@ class NexusModFile:
     def package_source(self):
         return NexusPackageSource.from_mod_file(self)
 
+    @property
+    def scheduler(self):
+        return NexusRequestScheduler.for_api(self.api)
+
     def generate_download_links(self):
         return {
             info['short_name']: info['URI']
-            for info in self.api.mod_file_download_link(
-                    self.game, self.mod_id, self.file_id)}
+            for info in self.scheduler.call(
+                'mod_file_download_link',
+                self.game, self.mod_id, self.file_id,
+                priority=self.priority)}
+
+    @staticmethod
+    def update_download_index(index_file, key, entry):
+        with DOWNLOAD_INDEX_LOCK:
+            index = (
+                yaml_load(index_file.read_text()) or {}
+                if index_file.exists() else {})
+            # whatever other download used the same file name lost its file
+            index = {
+                other_key: other for other_key, other in index.items()
+                if other.get('file_name') != entry['file_name']}
+            index[key] = entry
+            atomic_write(index_file, yaml_dump(index))
 
-    def download_into(self, folder):
+    def download_into(self, folder, probe_mirrors=False, progress=None):
         folder = Path(folder)
         index_file = folder / 'nexus_download_index.yaml'
         if index_file.exists():
-            index = yaml_load(index_file.read_text())
+            index = yaml_load(index_file.read_text()) or {}
         else:
             index = {}
 
@@ -163,28 +553,230 @@ class NexusModFile:
                         'found in cache but size mismatch')
                 return folder / file_name
 
+        # a partial download of this very file (e.g. a cancelled one) is
+        # resumed; any other file in the way is stale
         target = folder / self.file_name
-        if target.exists():
+        if target.exists() and not (
+                existing and existing.get('partial') and
+                existing.get('file_name') == self.file_name):
             target.unlink()
 
         links = self.generate_download_links()
         assert links, f'no download links for {self}'
+        self.update_download_index(
+            index_file, key, {'file_name': self.file_name, 'partial': True})
 
-        default_server = 'Nexus CDN'
-        preferred_server = 'Los Angeles'
-        if preferred_server in links:
-            link = links[preferred_server]
-        elif default_server in links:
-            link = links[default_server]
-        else:
-            link = list(links.values())[0]
+        # try mirrors from fastest to slowest as measured on previous
+        # downloads; if a mirror's throughput collapses mid-download, resume
+        # the partial file from the next mirror. The last mirror is never
+        # abandoned for being slow.
+        scores = NexusMirrorScores(folder / 'nexus_mirror_scores.yaml')
+        mirrors = scores.ranked(links, probe_unscored=probe_mirrors)
+        for i, mirror in enumerate(mirrors):
+            last = i == len(mirrors) - 1
+            try:
+                bytes_per_sec = download_url(
+                    links[mirror], target, resume=True,
+                    min_bytes_per_sec=(
+                        None if last else scores.collapse_threshold(mirror)),
+                    progress=progress)
+            except DownloadTooSlowError as e:
+                print(f'{e}; failing over from {mirror}')
+                scores.record(mirror, e.bytes_per_sec)
+            except requests.RequestException as e:
+                if last:
+                    scores.save()
+                    raise
+                print(f'download from {mirror} failed ({e}); failing over')
+                scores.record(mirror, 0)
+            else:
+                if bytes_per_sec is not None:
+                    scores.record(mirror, bytes_per_sec)
+                break
+        scores.save()
 
-        assert not target.exists(), f'{target} unexpectedly exists'
-        download_url(link, target)
         assert target.exists(), f'{target} still does not exist after download'
 
         md5 = compute_file_md5(target)
-        index[key] = {'file_name': self.file_name, 'md5': md5}
-        index_file.write_text(yaml_dump(index))
+        self.update_download_index(
+            index_file, key, {'file_name': self.file_name, 'md5': md5})
 
         return target
+
+
+class NexusApiCache:
+    '''
+    On-disk cache of Nexus API responses and mod pictures, laid out as
+    `<root>/<game>/<mod_id>/<name>.yaml` for api responses and
+    `<root>/pictures/<md5 of url><suffix>` for pictures
+    '''
+    def __init__(self, root, max_age=3600):
+        self.root = Path(root)
+        self.max_age = max_age
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, game, mod_id, name):
+        return self.root / game / str(mod_id) / f'{name}.yaml'
+
+    def load(self, game, mod_id, name, max_age=None):
+        max_age = self.max_age if max_age is None else max_age
+        path = self.path(game, mod_id, name)
+        if path.exists() and time.time() - path.stat().st_mtime <= max_age:
+            return yaml_load(path.read_text())
+
+    def save(self, game, mod_id, name, data):
+        path = self.path(game, mod_id, name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(path, yaml_dump(data))
+        return data
+
+    def description_path(self, game, mod_id, updated_timestamp):
+        return (
+            self.root / game / str(mod_id) /
+            f'description-{updated_timestamp}.html')
+
+    def load_description(self, game, mod_id, updated_timestamp):
+        path = self.description_path(game, mod_id, updated_timestamp)
+        if path.exists():
+            return path.read_text(encoding='utf-8')
+
+    def save_description(self, game, mod_id, updated_timestamp, rendered):
+        path = self.description_path(game, mod_id, updated_timestamp)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # renders for older versions of the description are obsolete
+        for old in path.parent.glob('description-*.html'):
+            old.unlink()
+        atomic_write(path, rendered)
+
+    def picture_path(self, url):
+        suffix = Path(urlparse(url).path).suffix
+        return (
+            self.root / 'pictures' /
+            f'{hashlib.md5(url.encode()).hexdigest()}{suffix}')
+
+    def fetch_picture(self, url):
+        path = self.picture_path(url)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            response = requests.get(url, timeout=30)
+            response.raise_for_status()
+            atomic_write(path, response.content)
+        return path
+
+
+@dataclass
+class NexusPrefetch:
+    game: str
+    mod_id: int
+    mod: object
+    file_list: object
+    picture: object
+    changelogs: object
+
+    @property
+    def futures(self):
+        return {
+            'mod': self.mod,
+            'file_list': self.file_list,
+            'picture': self.picture,
+            'changelogs': self.changelogs
+        }
+
+
+class NexusPrefetcher:
+    '''
+    Fires off all of the requests needed to display a mod (details, file
+    list, picture and changelogs) concurrently, going through the api cache
+    so repeated visits are instant. Once a mod's details arrive, the mods
+    linked from its description are speculatively warmed into the cache at
+    background priority.
+    '''
+    def __init__(self, api, cache, max_workers=4, max_linked=5):
+        self.api = api
+        self.cache = cache
+        self.max_linked = max_linked
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.scheduler = NexusRequestScheduler.for_api(api)
+
+    def cached_call(self, name, method, game, mod_id, priority):
+        data = self.cache.load(game, mod_id, name)
+        if data is None:
+            data = self.cache.save(
+                game, mod_id, name,
+                self.scheduler.call(method, game, mod_id, priority=priority))
+        return data
+
+    def fetch_mod(self, game, mod_id, priority=NexusPriority.interactive):
+        mod = NexusMod(
+            api=self.api,
+            data=self.cached_call(
+                'details', 'mod_details', game, mod_id, priority),
+            priority=priority,
+            cache=self.cache)
+        # render the description here so the ui thread never has to
+        mod.description_html
+        return mod
+
+    def fetch_file_list(self, game, mod_id,
+                        priority=NexusPriority.interactive):
+        return self.cached_call(
+            'files', 'mod_file_list', game, mod_id, priority)
+
+    def fetch_changelogs(self, game, mod_id,
+                         priority=NexusPriority.interactive):
+        return self.cached_call(
+            'changelogs', 'mod_changelog_list', game, mod_id, priority)
+
+    def fetch_picture(self, mod):
+        if mod.picture_url:
+            return self.cache.fetch_picture(mod.picture_url)
+
+    def warm(self, game, mod_id):
+        for name, method in [
+                ('details', 'mod_details'),
+                ('files', 'mod_file_list')]:
+            self.cached_call(
+                name, method, game, mod_id, NexusPriority.background)
+
+    def warm_linked(self, mod):
+        for game, mod_id in mod.linked_mods[:self.max_linked]:
+            self.executor.submit(self.warm, game, mod_id)
+
+    def then(self, future, func):
+        # runs func on the result of future once it is done, without tying up
+        # a worker while waiting; returns a future for func's result
+        chained = Future()
+
+        def relay(inner):
+            try:
+                chained.set_result(inner.result())
+            except Exception as e:
+                chained.set_exception(e)
+
+        def on_done(outer):
+            try:
+                result = outer.result()
+            except Exception as e:
+                chained.set_exception(e)
+            else:
+                self.executor.submit(func, result).add_done_callback(relay)
+
+        future.add_done_callback(on_done)
+        return chained
+
+    def prefetch(self, game, mod_id):
+        mod = self.executor.submit(self.fetch_mod, game, mod_id)
+        file_list = self.executor.submit(self.fetch_file_list, game, mod_id)
+        changelogs = self.executor.submit(self.fetch_changelogs, game, mod_id)
+        picture = self.then(mod, self.fetch_picture)
+        self.then(mod, self.warm_linked)
+        return NexusPrefetch(
+            game=game,
+            mod_id=mod_id,
+            mod=mod,
+            file_list=file_list,
+            picture=picture,
+            changelogs=changelogs)
+
+    def prefetch_url(self, url):
+        return self.prefetch(*NexusMod.parse_url(url))
@@ -0,0 +1,376 @@
+from contextlib import contextmanager
+import datetime
+import hashlib
+import threading
+import time
+
+from flask import Flask, Response, jsonify, request
+import pynxm
+from pynxm import Nexus
+from requests.adapters import HTTPAdapter
+from werkzeug.serving import make_server
+
+
+class NexusMockRedirectAdapter(HTTPAdapter):
+    '''
+    Requests transport adapter that rewrites requests made against the real
+    Nexus API base url so that they hit a local mock server instead; this
+    lets an unmodified `pynxm.Nexus` instance talk to `NexusMockServer`
+    '''
+    def __init__(self, base_url, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.base_url = base_url
+
+    def send(self, request, *args, **kwargs):
+        request.url = self.base_url + request.url[len(pynxm.BASE_URL):]
+        return super().send(request, *args, **kwargs)
+
+
+class NexusMockServer:
+    '''
+    Local stand-in for the parts of the Nexus API that we use (mod details,
+    mod file lists, changelogs and download links), plus a set of mirrors
+    that serve synthetic, deterministic file contents. Latency per API request,
+    bandwidth per mirror and the hourly/daily request budgets (reported in
+    the same `X-RL-*` headers as the real API) are all configurable, so
+    the download and caching paths can be benchmarked offline.
+
+    Like the real API, requests are served while the daily budget lasts and
+    the hourly limit only applies once it is used up. Both budgets reset at
+    the end of their window; `hour_length` shortens the hour (and the day,
+    which is 24 of them) so that resets can be exercised in a benchmark.
+    '''
+    def __init__(self, host='127.0.0.1', port=0, game='skyrimspecialedition',
+                 mods=10, files_per_mod=3, file_size_kb=1024, latency=0.0,
+                 mirrors=None, hourly_limit=100, daily_limit=2500,
+                 hour_length=3600):
+        self.host = host
+        self.port = port
+        self.game = game
+        self.mods = mods
+        self.files_per_mod = files_per_mod
+        self.file_size_kb = file_size_kb
+        self.latency = latency
+
+        # mapping of mirror short name to bandwidth in bytes/sec (None for
+        # unthrottled)
+        self.mirrors = mirrors or {'Nexus CDN': None}
+
+        self.hourly_limit = hourly_limit
+        self.daily_limit = daily_limit
+        self.hourly_remaining = hourly_limit
+        self.daily_remaining = daily_limit
+        self.hour_length = hour_length
+        self.hour_window = self.window(hour_length)
+        self.day_window = self.window(hour_length * 24)
+        self.budget_lock = threading.Lock()
+
+        self.requests_served = 0
+        self.bytes_served = 0
+
+        self.app = self.create_app()
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+    @property
+    def base_url(self):
+        return f'{self.url}/v1/'
+
+    def mod_data(self, mod_id):
+        timestamp = 1546300800 + mod_id * 3600
+        return {
+            'allow_rating': True,
+            'author': f'author{mod_id}',
+            'available': True,
+            'category_id': 1,
+            'contains_adult_content': False,
+            'created_time': datetime.datetime.utcfromtimestamp(
+                timestamp).isoformat(),
+            'created_timestamp': timestamp,
+            'description': (
+                f'[b]Mock mod {mod_id}[/b]<br />\n' +
+                ''.join(
+                    f'[size=4]Section {i}[/size] [url=https://www.nexusmods.'
+                    f'com/{self.game}/mods/{mod_id + i}]related mod[/url]'
+                    f'<br />\n'
+                    for i in range(1, 4))),
+            'domain_name': self.game,
+            'endorsement': None,
+            'endorsement_count': mod_id * 10,
+            'game_id': 1704,
+            'mod_id': mod_id,
+            'name': f'Mock Mod {mod_id}',
+            'picture_url': None,
+            'status': 'published',
+            'summary': f'Summary of mock mod {mod_id}',
+            'updated_time': datetime.datetime.utcfromtimestamp(
+                timestamp).isoformat(),
+            'updated_timestamp': timestamp,
+            'uploaded_by': f'author{mod_id}',
+            'uploaded_users_profile_url': '',
+            'user': {'member_id': mod_id, 'name': f'author{mod_id}'},
+            'version': '1.0'
+        }
+
+    def file_data(self, mod_id, index):
+        file_id = mod_id * 1000 + index
+        timestamp = 1546300800 + file_id
+        return {
+            'file_id': file_id,
+            'name': f'Mock Mod {mod_id} File {index}',
+            'version': f'1.{index}',
+            'category_id': 1,
+            'category_name': 'MAIN' if index == 0 else 'OPTIONAL',
+            'is_primary': index == 0,
+            'size': self.file_size_kb,
+            'file_name': f'MockMod{mod_id}-{file_id}-1-{index}.7z',
+            'uploaded_timestamp': timestamp,
+            'uploaded_time': datetime.datetime.utcfromtimestamp(
+                timestamp).isoformat(),
+            'mod_version': f'1.{index}',
+            'external_virus_scan_url': '',
+            'description': f'mock file {index} of mod {mod_id}',
+            'size_kb': self.file_size_kb,
+            'changelog_html': None,
+            'content_preview_link': ''
+        }
+
+    @staticmethod
+    def file_block(file_id, block_index, block_size):
+        # deterministic pseudo-random contents, so that md5s are stable
+        # across runs without having to keep the files around
+        seed = hashlib.md5(f'{file_id}:{block_index}'.encode()).digest()
+        return (seed * (block_size // len(seed) + 1))[:block_size]
+
+    def file_bytes(self, file_id, start, end, bandwidth, chunk_size=64 * 1024):
+        position = start
+        started = time.monotonic()
+        while position < end:
+            block_index, block_offset = divmod(position, chunk_size)
+            block = self.file_block(file_id, block_index, chunk_size)
+            data = block[block_offset:block_offset + end - position]
+            position += len(data)
+            self.bytes_served += len(data)
+            if bandwidth:
+                ahead = (position - start) / bandwidth - (
+                    time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+            yield data
+
+    @staticmethod
+    def window(length):
+        return int(time.time() // length)
+
+    @staticmethod
+    def format_reset(window, length):
+        return datetime.datetime.fromtimestamp(
+            (window + 1) * length, datetime.timezone.utc).strftime(
+                '%Y-%m-%d %H:%M:%S %z')
+
+    def roll_windows(self):
+        # must be called with the budget lock held
+        hour_window = self.window(self.hour_length)
+        if hour_window != self.hour_window:
+            self.hour_window = hour_window
+            self.hourly_remaining = self.hourly_limit
+        day_window = self.window(self.hour_length * 24)
+        if day_window != self.day_window:
+            self.day_window = day_window
+            self.daily_remaining = self.daily_limit
+
+    def consume_budget(self):
+        with self.budget_lock:
+            self.roll_windows()
+            if self.daily_remaining <= 0 and self.hourly_remaining <= 0:
+                return False
+            # both budgets count down, but only running out of both gets a
+            # request refused
+            self.daily_remaining = max(self.daily_remaining - 1, 0)
+            self.hourly_remaining = max(self.hourly_remaining - 1, 0)
+            self.requests_served += 1
+            return True
+
+    def budget_headers(self):
+        with self.budget_lock:
+            self.roll_windows()
+            return {
+                'X-RL-Daily-Limit': str(self.daily_limit),
+                'X-RL-Daily-Remaining': str(self.daily_remaining),
+                'X-RL-Daily-Reset': self.format_reset(
+                    self.day_window, self.hour_length * 24),
+                'X-RL-Hourly-Limit': str(self.hourly_limit),
+                'X-RL-Hourly-Remaining': str(self.hourly_remaining),
+                'X-RL-Hourly-Reset': self.format_reset(
+                    self.hour_window, self.hour_length)
+            }
+
+    def reset_budget(self):
+        with self.budget_lock:
+            self.hourly_remaining = self.hourly_limit
+            self.daily_remaining = self.daily_limit
+
+    def create_app(self):
+        app = Flask(__name__)
+
+        def api_response(build):
+            if self.latency:
+                time.sleep(self.latency)
+            if not self.consume_budget():
+                response = jsonify({'message': 'Rate limit exceeded'})
+                response.status_code = 429
+            else:
+                result = build()
+                if result is None:
+                    response = jsonify({'message': 'Not Found'})
+                    response.status_code = 404
+                else:
+                    response = jsonify(result)
+            response.headers.extend(self.budget_headers())
+            return response
+
+        def valid_mod(game, mod_id):
+            return game == self.game and 1 <= mod_id <= self.mods
+
+        @app.route('/v1/users/validate.json')
+        def user_details():
+            return api_response(lambda: {
+                'user_id': 1, 'name': 'mock', 'is_premium': True})
+
+        @app.route('/v1/games/<game>/mods/<int:mod_id>.json')
+        def mod_details(game, mod_id):
+            return api_response(
+                lambda: self.mod_data(mod_id)
+                if valid_mod(game, mod_id) else None)
+
+        @app.route('/v1/games/<game>/mods/<int:mod_id>/files.json')
+        def mod_file_list(game, mod_id):
+            return api_response(
+                lambda: {
+                    'files': [
+                        self.file_data(mod_id, i)
+                        for i in range(self.files_per_mod)],
+                    'file_updates': []}
+                if valid_mod(game, mod_id) else None)
+
+        @app.route('/v1/games/<game>/mods/<int:mod_id>/changelogs.json')
+        def mod_changelog_list(game, mod_id):
+            return api_response(
+                lambda: {
+                    f'1.{i}': [f'change {j} in 1.{i}' for j in range(3)]
+                    for i in range(self.files_per_mod)}
+                if valid_mod(game, mod_id) else None)
+
+        @app.route(
+            '/v1/games/<game>/mods/<int:mod_id>/files/<int:file_id>/'
+            'download_link.json')
+        def mod_file_download_link(game, mod_id, file_id):
+            def build():
+                if not valid_mod(game, mod_id):
+                    return None
+                file_data = self.file_data(mod_id, file_id - mod_id * 1000)
+                return [
+                    {
+                        'name': mirror,
+                        'short_name': mirror,
+                        'URI': (
+                            f'{self.url}/files/{i}/{file_id}/'
+                            f'{file_data["file_name"]}')
+                    }
+                    for i, mirror in enumerate(self.mirrors)]
+            return api_response(build)
+
+        @app.route('/files/<int:mirror_index>/<int:file_id>/<file_name>')
+        def download(mirror_index, file_id, file_name):
+            bandwidth = list(self.mirrors.values())[mirror_index]
+            size = self.file_size_kb * 1024
+            start, end, status = 0, size, 200
+            range_header = request.headers.get('Range')
+            if range_header and range_header.startswith('bytes='):
+                first, _, last = range_header[len('bytes='):].partition('-')
+                start = int(first or 0)
+                end = min(int(last) + 1, size) if last else size
+                status = 206
+            response = Response(
+                self.file_bytes(file_id, start, end, bandwidth),
+                status=status,
+                mimetype='application/octet-stream')
+            response.headers['Content-Length'] = str(end - start)
+            response.headers['Accept-Ranges'] = 'bytes'
+            if status == 206:
+                response.headers['Content-Range'] = (
+                    f'bytes {start}-{end - 1}/{size}')
+            return response
+
+        return app
+
+    def start(self):
+        self.server = make_server(
+            self.host, self.port, self.app, threaded=True)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.thread.join()
+            self.server = None
+            self.thread = None
+
+    def serve_forever(self):
+        self.server = make_server(
+            self.host, self.port, self.app, threaded=True)
+        self.port = self.server.server_port
+        print(f'Serving mock Nexus API at {self.base_url}')
+        self.server.serve_forever()
+
+    def api(self, api_key='mock'):
+        api = Nexus(api_key)
+        api.session.mount(
+            pynxm.BASE_URL, NexusMockRedirectAdapter(self.base_url))
+        return api
+
+    @contextmanager
+    def running(self):
+        self.start()
+        try:
+            yield self
+        finally:
+            self.stop()
+
+
+def run_download_benchmark(server, folder, mod_ids=None, passes=2):
+    '''
+    Fetches details and file lists for the given mods from the mock server
+    and downloads all of their files into the given folder, repeating the
+    whole thing `passes` times so that the second and later passes exercise
+    the download cache; returns timings per pass plus scheduler stats
+    '''
+    from skypackages.nexus import NexusMod, NexusRequestScheduler
+
+    api = server.api()
+    mod_ids = mod_ids or list(range(1, server.mods + 1))
+    results = {'passes': []}
+    for _ in range(passes):
+        started = time.monotonic()
+        bytes_before = server.bytes_served
+        downloaded = 0
+        for mod_id in mod_ids:
+            mod = NexusMod.from_game_and_id(api, server.game, mod_id)
+            for mod_file in mod.file_list:
+                mod_file.download_into(folder)
+                downloaded += 1
+        results['passes'].append({
+            'seconds': round(time.monotonic() - started, 3),
+            'files': downloaded,
+            'bytes_transferred': server.bytes_served - bytes_before
+        })
+    results['scheduler'] = NexusRequestScheduler.for_api(api).stats
+    return results
@@ -0,0 +1,219 @@
+import os
+from pathlib import Path
+import threading
+
+from skypackages.utils import atomic_write
+
+
+class RecordStore:
+    '''
+    Per-blob yaml records (as in the meta and sources folders), stored
+    either as one `<key>.yaml` file each, or, once the folder has been
+    packed, appended to a few pack files under `<folder>/.pack` with an
+    append-only index of `key pack offset length` lines (the last line for
+    a key wins; a length of -1 marks a deletion). Loose files remain
+    readable in packed mode, so a folder can be packed incrementally.
+    '''
+    PACK_SIZE_LIMIT = 64 * 1024 * 1024
+
+    _stores = {}
+    _stores_lock = threading.Lock()
+
+    def __init__(self, folder):
+        self.folder = Path(folder)
+        self.pack_folder = self.folder / '.pack'
+        self.index_file = self.pack_folder / 'index.txt'
+        self.lock = threading.RLock()
+        self._index = {}
+        self._index_offset = 0
+        self._index_inode = None
+
+    @classmethod
+    def for_folder(cls, folder):
+        # stores are shared per folder so that the pack index is only read
+        # once per process
+        key = Path(folder).resolve()
+        with cls._stores_lock:
+            if key not in cls._stores:
+                cls._stores[key] = cls(folder)
+            return cls._stores[key]
+
+    @property
+    def packed(self):
+        return self.pack_folder.exists()
+
+    @property
+    def index(self):
+        # pick up lines appended since we last looked (possibly by another
+        # process), rather than re-reading the whole index
+        with self.lock:
+            if not self.index_file.exists():
+                self._index = {}
+                self._index_offset = 0
+                return self._index
+            stat = self.index_file.stat()
+            size = stat.st_size
+            if size < self._index_offset or stat.st_ino != self._index_inode:
+                # rewritten by a compaction, possibly in another process
+                self._index = {}
+                self._index_offset = 0
+                self._index_inode = stat.st_ino
+            if size > self._index_offset:
+                with open(str(self.index_file), 'rb') as f:
+                    f.seek(self._index_offset)
+                    data = f.read()
+                complete = data[:data.rfind(b'\n') + 1]
+                for line in complete.decode('utf-8').splitlines():
+                    key, pack, offset, length = line.rsplit(' ', 3)
+                    if int(length) < 0:
+                        self._index.pop(key, None)
+                    else:
+                        self._index[key] = (pack, int(offset), int(length))
+                self._index_offset += len(complete)
+            return self._index
+
+    def loose_file(self, key):
+        return self.folder / f'{key}.yaml'
+
+    def loose_keys(self):
+        return [
+            path.name[:-len('.yaml')] for path in self.folder.glob('*.yaml')]
+
+    def keys(self):
+        keys = set(self.loose_keys())
+        if self.packed:
+            keys.update(self.index)
+        return sorted(keys)
+
+    def exists(self, key):
+        return self.loose_file(key).exists() or (
+            self.packed and key in self.index)
+
+    def get(self, key):
+        loose = self.loose_file(key)
+        if loose.exists():
+            return loose.read_text()
+        if self.packed:
+            location = self.index.get(key)
+            if location:
+                pack, offset, length = location
+                with open(str(self.pack_folder / pack), 'rb') as f:
+                    f.seek(offset)
+                    return f.read(length).decode('utf-8')
+
+    def size(self, key):
+        loose = self.loose_file(key)
+        if loose.exists():
+            return loose.stat().st_size
+        return self.index[key][2]
+
+    def next_pack_number(self):
+        # pack names are never reused, so a pack the index does not point
+        # at yet can't be mistaken for one it does
+        packs = sorted(self.pack_folder.glob('*.pack'))
+        return int(packs[-1].stem) + 1 if packs else 0
+
+    def current_pack(self):
+        packs = sorted(self.pack_folder.glob('*.pack'))
+        if packs and packs[-1].stat().st_size < self.PACK_SIZE_LIMIT:
+            return packs[-1]
+        return self.pack_folder / f'{self.next_pack_number():06d}.pack'
+
+    def append(self, items):
+        with self.lock:
+            self.index
+            pack = self.current_pack()
+            lines = []
+            with open(str(pack), 'ab') as pack_file:
+                for key, text in items:
+                    if text is None:
+                        lines.append(f'{key} - 0 -1\n')
+                        continue
+                    data = text.encode('utf-8')
+                    lines.append(
+                        f'{key} {pack.name} {pack_file.tell()} {len(data)}\n')
+                    pack_file.write(data)
+                pack_file.flush()
+                os.fsync(pack_file.fileno())
+            with open(str(self.index_file), 'ab') as index_file:
+                index_file.write(''.join(lines).encode('utf-8'))
+
+    def put(self, key, text):
+        self.put_many([(key, text)])
+
+    def put_many(self, items):
+        if not self.packed:
+            for key, text in items:
+                atomic_write(self.loose_file(key), text)
+            return
+        self.append(items)
+        for key, _ in items:
+            loose = self.loose_file(key)
+            if loose.exists():
+                loose.unlink()
+
+    def delete(self, key):
+        loose = self.loose_file(key)
+        if loose.exists():
+            loose.unlink()
+        if self.packed and key in self.index:
+            self.append([(key, None)])
+
+    def pack(self):
+        '''
+        Switches the folder to packed mode, moving all loose records into
+        the pack files; returns the number of records moved
+        '''
+        self.pack_folder.mkdir(parents=True, exist_ok=True)
+        keys = self.loose_keys()
+        self.put_many([(key, self.loose_file(key).read_text()) for key in keys])
+        return len(keys)
+
+    def compact(self):
+        '''
+        Rewrites the pack files with only the latest version of each live
+        record; returns the number of bytes reclaimed. New packs get fresh
+        names and the index is switched over to them atomically before the
+        old packs are deleted, so no record is lost if this is interrupted.
+        '''
+        if not self.packed:
+            return 0
+        with self.lock:
+            old_packs = sorted(self.pack_folder.glob('*.pack'))
+            before = sum(path.stat().st_size for path in old_packs)
+            records = [(key, self.get(key)) for key in sorted(self.index)]
+
+            lines = []
+            new_packs = []
+            pack_number = self.next_pack_number()
+            pack_file = None
+            try:
+                for key, text in records:
+                    if pack_file is None or (
+                            pack_file.tell() >= self.PACK_SIZE_LIMIT):
+                        pack_name = f'{pack_number:06d}.pack'
+                        pack_file = open(
+                            str(self.pack_folder / pack_name), 'wb')
+                        new_packs.append(pack_file)
+                        pack_number += 1
+                    data = text.encode('utf-8')
+                    lines.append(
+                        f'{key} {pack_name} {pack_file.tell()} {len(data)}\n')
+                    pack_file.write(data)
+                for f in new_packs:
+                    f.flush()
+                    os.fsync(f.fileno())
+            finally:
+                for f in new_packs:
+                    f.close()
+
+            atomic_write(self.index_file, ''.join(lines), sync=True)
+            self._index = {}
+            self._index_offset = 0
+            for path in old_packs:
+                path.unlink()
+
+            after = sum(
+                path.stat().st_size
+                for path in self.pack_folder.glob('*.pack'))
+            return before - after
@@ -0,0 +1,248 @@
+import hashlib
+from pathlib import PurePath
+
+
+# number of minhash values per sketch, split into LSH bands of BAND_ROWS
+# values each; two blobs become a candidate pair if any band matches, which
+# for these settings (16 bands of 4) happens with probability
+# 1 - (1 - s^4)^16 at Jaccard similarity s: about 0.99 at 0.7, 0.64 at 0.5
+# and 0.34 at 0.4, so pairs near the default threshold of 0.8 are all but
+# certain to be found
+SKETCH_SIZE = 64
+BAND_ROWS = 4
+
+# containment only counts for blobs with at least this many features
+MIN_CONTAINMENT_FEATURES = 3
+
+# an update that adds many files contains its predecessor while having a
+# low Jaccard similarity to it, which LSH on Jaccard mostly misses; such
+# pairs are found by sharing a feature instead, leaving out features that
+# are too common to tell blobs apart (say, a readme.txt path)
+MAX_FEATURE_BLOBS = 32
+
+# top level folders of the game's data folder; an archive whose files are
+# all under one of these is not wrapped, it just only installs, say, textures
+DATA_FOLDERS = {
+    'interface', 'meshes', 'music', 'scripts', 'seq', 'shadersfx', 'skse',
+    'sound', 'strings', 'textures', 'video'}
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+PERMUTATIONS = [
+    (
+        int.from_bytes(hashlib.md5(f'a{i}'.encode()).digest()[:8], 'little')
+        % (MERSENNE_PRIME - 1) + 1,
+        int.from_bytes(hashlib.md5(f'b{i}'.encode()).digest()[:8], 'little')
+        % MERSENNE_PRIME)
+    for i in range(SKETCH_SIZE)]
+
+
+def token_hash(token):
+    return int.from_bytes(
+        hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(),
+        'little')
+
+
+def member_parts(path):
+    return PurePath(path.replace('\\', '/').lower()).parts
+
+
+def common_root(paths):
+    '''
+    The top level folder that every member path of an archive is under, if
+    there is a single one; None otherwise
+    '''
+    roots = {parts[0] for parts in paths if parts}
+    if len(roots) != 1:
+        return None
+    root = roots.pop()
+    # neither an archive of a single file nor one that only has, say,
+    # textures is wrapped
+    if root in DATA_FOLDERS or not any(len(parts) > 1 for parts in paths):
+        return None
+    return root
+
+
+def normalize_member_path(parts, root=None):
+    # archives of the same mod often differ only in a wrapping top level
+    # folder or in path case
+    if root is not None and parts[:1] == (root,) and len(parts) > 1:
+        parts = parts[1:]
+    return '/'.join(parts)
+
+
+def meta_features(meta):
+    '''
+    Turns blob metadata into the set of tokens compared between blobs: the
+    normalized path of every member (without the archive's wrapping folder,
+    if it has one), plus the CRC and size of every member file when the
+    metadata has them, so that repacks with renamed or moved files still
+    match on content
+    '''
+    features = set()
+    members = meta.get('members') or {}
+    paths = [member_parts(path) for path in meta.get('filelist') or []]
+    root = common_root(paths)
+    for parts in paths:
+        if len(parts) == 1 and parts[0] == root:
+            # the wrapping folder's own entry
+            continue
+        features.add(f'path:{normalize_member_path(parts, root)}')
+    for info in members.values():
+        if info.get('crc'):
+            features.add(f'crc:{info["crc"]}:{info.get("size")}')
+    return features
+
+
+def path_count(features):
+    return sum(1 for feature in features if feature.startswith('path:'))
+
+
+def minhash(features):
+    hashes = [token_hash(feature) for feature in features]
+    if not hashes:
+        return None
+    return tuple(
+        min((a * h + b) % MERSENNE_PRIME for h in hashes) & MAX_HASH
+        for a, b in PERMUTATIONS)
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class BlobSimilarityIndex:
+    '''
+    MinHash/LSH index over the file lists of blobs, used to find blobs that
+    are likely duplicates (e.g. the same mod repacked, so the md5 differs)
+    or newer versions of one another without comparing every pair of blobs.
+    Candidates from the LSH buckets, and for containment, blobs sharing a
+    feature that few blobs have, are confirmed with the exact similarity
+    of their features.
+    '''
+    def __init__(self, band_rows=BAND_ROWS):
+        self.band_rows = band_rows
+        self.features = {}
+        self.sketches = {}
+        self.buckets = {}
+        self.feature_blobs = {}
+
+    def add(self, blob_id, meta):
+        features = meta_features(meta)
+        sketch = minhash(features)
+        if sketch is None:
+            return
+        self.features[blob_id] = features
+        self.sketches[blob_id] = sketch
+        for band in range(0, SKETCH_SIZE, self.band_rows):
+            key = (band, sketch[band:band + self.band_rows])
+            self.buckets.setdefault(key, []).append(blob_id)
+        if len(features) >= MIN_CONTAINMENT_FEATURES:
+            for feature in features:
+                self.feature_blobs.setdefault(feature, []).append(blob_id)
+
+    def candidate_pairs(self):
+        pairs = set()
+        groups = list(self.buckets.values()) + [
+            blob_ids for blob_ids in self.feature_blobs.values()
+            if len(blob_ids) <= MAX_FEATURE_BLOBS]
+        for blob_ids in groups:
+            for i, first in enumerate(blob_ids):
+                for second in blob_ids[i + 1:]:
+                    pairs.add(tuple(sorted([first, second])))
+        return sorted(pairs)
+
+    def similar_pairs(self, threshold=0.8):
+        '''
+        @param threshold: minimum similarity for a pair to be reported; the
+            similarity is the Jaccard similarity of the two feature sets, or
+            the containment of the smaller set in the larger one if that is
+            higher, so that an update adding files still matches
+        @return: list of dicts with the two blob ids, their similarity,
+            containment and the larger of the two, sorted from most to least
+            similar
+        '''
+        results = []
+        for first, second in self.candidate_pairs():
+            a, b = self.features[first], self.features[second]
+            similarity = jaccard(a, b)
+            # a tiny blob (say, a lone readme) is contained in lots of
+            # others without being related to them
+            containment = (
+                len(a & b) / min(len(a), len(b))
+                if min(len(a), len(b)) >= MIN_CONTAINMENT_FEATURES else 0.0)
+            if max(similarity, containment) < threshold:
+                continue
+            results.append({
+                'blobs': [first, second],
+                'similarity': round(similarity, 3),
+                'containment': round(containment, 3),
+                'relation': (
+                    'duplicate' if similarity >= 0.95 else
+                    'contains' if containment >= threshold else
+                    'similar'),
+                # for containment, the blob with more content is likely the
+                # newer version
+                'larger': (
+                    first if path_count(a) >= path_count(b) else second)
+            })
+        return sorted(
+            results,
+            key=lambda result: (-result['similarity'], result['blobs']))
+
+
+def find_near_duplicates(manager, threshold=0.8, index_missing=False):
+    '''
+    Builds a similarity index over the blobs' metadata and reports likely
+    duplicate pairs, together with suggested alias merges for pairs whose
+    blobs sit under different aliases
+
+    @param index_missing: also index the file lists of blobs that have no
+        stored metadata yet, which runs 7z on each of them (materializing
+        chunked blobs first); otherwise they are only listed as unindexed
+    '''
+    index = BlobSimilarityIndex()
+    unindexed = []
+    for blob_id in manager.blobs.blob_ids():
+        meta = manager.stored_meta(blob_id)
+        if 'filelist' not in meta:
+            if not index_missing:
+                unindexed.append(blob_id)
+                continue
+            meta = manager.meta(blob_id)
+        members = manager.stored_members(blob_id)
+        if members is not None:
+            meta = {**meta, 'members': members}
+        index.add(blob_id, meta)
+
+    aliases_of = {}
+    for alias, blob_ids in manager.aliases.data.items():
+        for blob_id in blob_ids:
+            aliases_of.setdefault(blob_id, []).append(alias)
+
+    pairs = index.similar_pairs(threshold=threshold)
+    merges = {}
+    for pair in pairs:
+        first, second = pair['blobs']
+        pair['aliases'] = [
+            sorted(aliases_of.get(first, [])),
+            sorted(aliases_of.get(second, []))]
+        first_aliases = set(pair['aliases'][0])
+        second_aliases = set(pair['aliases'][1])
+        if (first_aliases and second_aliases and
+                not first_aliases & second_aliases):
+            for first_alias in first_aliases:
+                for second_alias in second_aliases:
+                    key = tuple(sorted([first_alias, second_alias]))
+                    merges.setdefault(key, []).append(pair['blobs'])
+
+    return {
+        'pairs': pairs,
+        'suggested_alias_merges': [
+            {'aliases': list(key), 'because_of': blobs}
+            for key, blobs in sorted(merges.items())],
+        'unindexed': unindexed
+    }
@@ -1,7 +1,9 @@
 from dataclasses import dataclass, asdict
+import json
 from pathlib import Path
 
-from skypackages.utils import yaml_dump, yaml_load
+from skypackages.records import RecordStore
+from skypackages.utils import atomic_write, yaml_dump, yaml_load
 
 
 @dataclass
@@ -22,10 +24,19 @@ class GenericPackageSource:
             f'{self.size}')
 
     def match(self, entry):
-        return (
-            entry['class'] == self.__class__.__name__ and
-            entry['file_name'] == self.file_name and
-            entry['size'] == self.size)
+        return self.entry_identity(entry) == self.identity
+
+    @staticmethod
+    def entry_identity(entry):
+        return (entry['class'], entry['file_name'], entry['size'])
+
+    @property
+    def identity(self):
+        return self.entry_identity(self.entry)
+
+    def merge_into(self, entry):
+        entry['url'] = self.url
+        entry['notes'] = self.notes
 
     @property
     def entry(self):
@@ -44,22 +55,11 @@ class GenericPackageSource:
             url='',
             notes='')
 
-    def save_details(self, blob_id, sources_folder):
-        sources_file = sources_folder / f'{blob_id}.yaml'
-        sources = {}
-        if sources_file.exists():
-            sources = yaml_load(sources_file.read_text())
-
-        entries = sources.setdefault('entries', [])
-        for entry in entries:
-            if self.match(entry):
-                entry['url'] = self.url
-                entry['notes'] = self.notes
-                break
-        else:
-            entries.append(self.entry)
-
-        sources_file.write_text(yaml_dump(sources))
+    def save_details(self, blob_id, sources_folder, index=None):
+        entries = merge_sources(sources_folder, blob_id, [self])
+        if index is None:
+            index = SourcesReverseIndex(sources_folder)
+        index.update(blob_id, entries)
 
 
 @dataclass
@@ -87,6 +87,19 @@ class NexusPackageSource:
     def entry(self):
         return {**{'class': self.__class__.__name__}, **asdict(self)}
 
+    @staticmethod
+    def entry_identity(entry):
+        return tuple(sorted(entry.items()))
+
+    @property
+    def identity(self):
+        return self.entry_identity(self.entry)
+
+    def merge_into(self, entry):
+        # nexus entries are identified by all of their fields, so a matching
+        # entry never needs updating
+        pass
+
     def validate(self, file_path):
         assert file_path.name == self.file_name
         size = int(file_path.stat().st_size / 1024)
@@ -94,17 +107,11 @@ class NexusPackageSource:
             f'file sizes do not match for {file_path}, got {size}, expected '
             f'{self.size}')
 
-    def save_details(self, blob_id, sources_folder):
-        sources_file = sources_folder / f'{blob_id}.yaml'
-        sources = {}
-        if sources_file.exists():
-            sources = yaml_load(sources_file.read_text())
-
-        entries = sources.setdefault('entries', [])
-        if self.entry not in entries:
-            entries.append(self.entry)
-
-        sources_file.write_text(yaml_dump(sources))
+    def save_details(self, blob_id, sources_folder, index=None):
+        entries = merge_sources(sources_folder, blob_id, [self])
+        if index is None:
+            index = SourcesReverseIndex(sources_folder)
+        index.update(blob_id, entries)
 
     @classmethod
     def from_mod_file(cls, mod_file):
@@ -118,3 +125,221 @@ class NexusPackageSource:
     @classmethod
     def from_entry(cls, entry):
         return cls(**entry)
+
+
+SOURCE_CLASSES = {
+    class_.__name__: class_ for class_ in [
+        NexusPackageSource,
+        GenericPackageSource
+    ]
+}
+
+
+def merged_sources_data(store, blob_id, sources):
+    '''
+    Merges the given sources into the stored sources record of the given
+    blob; entries are deduplicated through a dict keyed by each entry's
+    identity, so merging is linear in the number of entries
+
+    @param store: the RecordStore of the packages sources folder
+    @param blob_id: id of the blob the sources belong to
+    @param sources: list of source objects to merge in
+    @return: the resulting sources data for the blob
+    '''
+    data = {}
+    text = store.get(blob_id)
+    if text:
+        data = yaml_load(text) or {}
+
+    entries = data.setdefault('entries', [])
+    positions = {
+        SOURCE_CLASSES[entry['class']].entry_identity(entry): i
+        for i, entry in enumerate(entries)}
+    for source in sources:
+        identity = source.identity
+        if identity in positions:
+            source.merge_into(entries[positions[identity]])
+        else:
+            positions[identity] = len(entries)
+            entries.append(source.entry)
+    return data
+
+
+def merge_sources(sources_folder, blob_id, sources):
+    '''
+    Merges the given sources into the sources record of the given blob with
+    a single read and a single write
+
+    @return: the resulting list of entries for the blob
+    '''
+    store = RecordStore.for_folder(sources_folder)
+    with store.lock:
+        data = merged_sources_data(store, blob_id, sources)
+        store.put(blob_id, yaml_dump(data))
+    return data['entries']
+
+
+class SourcesReverseIndex:
+    '''
+    Persistent reverse index over the entries of every sources record,
+    so that we can find which blobs came from a given nexus file, original
+    file name or url without opening every sources file. The index is kept
+    up to date by the `save_details` methods of the source classes, and is
+    rebuilt from the sources files if it is missing. Updates hold the lock
+    of the sources record store, as sources get saved from several threads.
+
+    Updates are appended to a journal of per-blob key lists next to the
+    index snapshot, rather than rewriting the whole snapshot on every
+    import; the journal is folded into the snapshot once it outgrows it.
+    '''
+    KINDS = ['nexus', 'file_name', 'url']
+
+    # journals smaller than this are never compacted
+    JOURNAL_MIN_COMPACT = 1024 * 1024
+
+    def __init__(self, sources_folder):
+        self.sources_folder = Path(sources_folder)
+        self.index_file = self.sources_folder / '.index' / 'reverse.yaml'
+        self.journal_file = self.sources_folder / '.index' / 'reverse.journal'
+        self._data = None
+        self._snapshot = None
+        self._journal_offset = 0
+
+    @staticmethod
+    def nexus_key(game, mod_id, file_id):
+        return f'{game}/{mod_id}/{file_id}'
+
+    @classmethod
+    def entry_keys(cls, entry):
+        keys = []
+        if entry['class'] == NexusPackageSource.__name__:
+            keys.append((
+                'nexus',
+                cls.nexus_key(
+                    entry['game'], entry['mod_id'], entry['file_id'])))
+            keys.append((
+                'url',
+                f'https://www.nexusmods.com/{entry["game"]}/mods/'
+                f'{entry["mod_id"]}'))
+        elif entry.get('url'):
+            keys.append(('url', entry['url']))
+        if entry.get('file_name'):
+            keys.append(('file_name', entry['file_name']))
+        return keys
+
+    @property
+    def data(self):
+        with RecordStore.for_folder(self.sources_folder).lock:
+            if not self.index_file.exists():
+                self.rebuild()
+            stat = self.index_file.stat()
+            snapshot = (stat.st_ino, stat.st_mtime_ns)
+            journal_size = (
+                self.journal_file.stat().st_size
+                if self.journal_file.exists() else 0)
+            if (self._data is None or snapshot != self._snapshot or
+                    journal_size < self._journal_offset):
+                # rewritten by a compaction, possibly in another process
+                self._data = yaml_load(self.index_file.read_text())
+                self._snapshot = snapshot
+                self._journal_offset = 0
+            if journal_size > self._journal_offset:
+                # pick up updates journaled since we last looked
+                with open(str(self.journal_file), 'rb') as f:
+                    f.seek(self._journal_offset)
+                    text = f.read()
+                complete = text[:text.rfind(b'\n') + 1]
+                for line in complete.decode('utf-8').splitlines():
+                    blob_id, blob_keys = json.loads(line)
+                    self.apply_keys(self._data, blob_id, blob_keys)
+                self._journal_offset += len(complete)
+            return self._data
+
+    def save(self, data):
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(self.index_file, yaml_dump(data))
+        if self.journal_file.exists():
+            self.journal_file.unlink()
+        stat = self.index_file.stat()
+        self._data = data
+        self._snapshot = (stat.st_ino, stat.st_mtime_ns)
+        self._journal_offset = 0
+
+    @classmethod
+    def empty(cls):
+        return {**{kind: {} for kind in cls.KINDS}, 'blobs': {}}
+
+    @classmethod
+    def blob_keys(cls, entries):
+        blob_keys = []
+        for entry in entries:
+            for kind, key in cls.entry_keys(entry):
+                if [kind, key] not in blob_keys:
+                    blob_keys.append([kind, key])
+        return blob_keys
+
+    @classmethod
+    def apply(cls, data, blob_id, entries):
+        cls.apply_keys(data, blob_id, cls.blob_keys(entries))
+
+    @staticmethod
+    def apply_keys(data, blob_id, blob_keys):
+        # drop whatever this blob previously contributed, then re-add its
+        # current keys; the per-blob key list makes this cheap
+        for kind, key in data['blobs'].pop(blob_id, []):
+            blob_ids = data[kind].get(key, [])
+            if blob_id in blob_ids:
+                blob_ids.remove(blob_id)
+            if not blob_ids:
+                data[kind].pop(key, None)
+
+        for kind, key in blob_keys:
+            blob_ids = data[kind].setdefault(key, [])
+            if blob_id not in blob_ids:
+                blob_ids.append(blob_id)
+        if blob_keys:
+            data['blobs'][blob_id] = blob_keys
+
+    def update(self, blob_id, entries):
+        self.update_many({blob_id: entries})
+
+    def update_many(self, blob_entries):
+        with RecordStore.for_folder(self.sources_folder).lock:
+            data = self.data
+            lines = []
+            for blob_id, entries in blob_entries.items():
+                blob_keys = self.blob_keys(entries)
+                self.apply_keys(data, blob_id, blob_keys)
+                lines.append(json.dumps([blob_id, blob_keys]) + '\n')
+            text = ''.join(lines).encode('utf-8')
+            with open(str(self.journal_file), 'ab') as f:
+                f.write(text)
+            size = self.journal_file.stat().st_size
+            if size == self._journal_offset + len(text):
+                # otherwise another process appended too, and the next read
+                # replays both (replaying our own lines is harmless)
+                self._journal_offset = size
+            if size > max(
+                    self.JOURNAL_MIN_COMPACT,
+                    self.index_file.stat().st_size):
+                self.save(data)
+
+    def rebuild(self):
+        store = RecordStore.for_folder(self.sources_folder)
+        with store.lock:
+            data = self.empty()
+            for blob_id in store.keys():
+                sources = yaml_load(store.get(blob_id))
+                if sources:
+                    self.apply(data, blob_id, sources['entries'])
+            self.save(data)
+
+    def find_nexus(self, game, mod_id, file_id):
+        return list(self.data['nexus'].get(
+            self.nexus_key(game, mod_id, file_id), []))
+
+    def find_file_name(self, file_name):
+        return list(self.data['file_name'].get(file_name, []))
+
+    def find_url(self, url):
+        return list(self.data['url'].get(url, []))
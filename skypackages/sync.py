@@ -0,0 +1,266 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from pathlib import Path
+import shutil
+from urllib.parse import quote
+
+import requests
+
+from skypackages.utils import (
+    atomic_write,
+    compute_file_md5,
+    yaml_dump,
+    yaml_load)
+
+
+MANIFEST_FILE = 'manifest.yaml'
+
+
+def text_version(text):
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def build_manifest(manager):
+    '''
+    Describes the contents of a packages folder: every blob with its size,
+    and a content hash ("version") of every meta, import and sources record
+    and of the alias and selection files
+    '''
+    aliases = manager.aliases
+    return {
+        'blobs': {
+            blob_id: manager.blobs.size(blob_id)
+            for blob_id in manager.blobs.blob_ids()},
+        'records': {
+            'meta': {
+                blob_id: text_version(manager.meta_records.get(blob_id))
+                for blob_id in manager.meta_records.keys()},
+            'imports': {
+                blob_id: text_version(manager.import_records.get(blob_id))
+                for blob_id in manager.import_records.keys()},
+            'sources': {
+                blob_id: text_version(manager.sources.records.get(blob_id))
+                for blob_id in manager.sources.records.keys()}
+        },
+        'aliases': {
+            path.name: text_version(path.read_text())
+            for path in [aliases.aliases_file, aliases.selection_file]
+            if path.exists()}
+    }
+
+
+def manifest_delta(source, target):
+    '''
+    Computes what has to be transferred to bring `target` up to date with
+    `source`, given the manifests of both sides
+    '''
+    return {
+        'blobs': sorted(
+            blob_id for blob_id, size in source['blobs'].items()
+            if target['blobs'].get(blob_id) != size),
+        'records': {
+            kind: sorted(
+                blob_id for blob_id, version in versions.items()
+                if target['records'].get(kind, {}).get(blob_id) != version)
+            for kind, versions in source['records'].items()},
+        'aliases': sorted(
+            name for name, version in source['aliases'].items()
+            if target['aliases'].get(name) != version)
+    }
+
+
+def empty_manifest():
+    return {
+        'blobs': {},
+        'records': {'meta': {}, 'imports': {}, 'sources': {}},
+        'aliases': {}}
+
+
+def copy_resumable(src_file, dest, chunk_size=8 * 1024 * 1024):
+    # continue a partial copy where it left off
+    offset = dest.stat().st_size if dest.exists() else 0
+    src_file.seek(offset)
+    with open(str(dest), 'ab') as f:
+        shutil.copyfileobj(src_file, f, chunk_size)
+
+
+class DirectoryTransport:
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def read_text(self, relative):
+        return (self.root / relative).read_text(encoding='utf-8')
+
+    def fetch(self, relative, dest):
+        with open(str(self.root / relative), 'rb') as f:
+            copy_resumable(f, dest)
+
+
+class HttpTransport:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def url(self, relative):
+        return f'{self.base_url}/{quote(relative)}'
+
+    def read_text(self, relative):
+        response = self.session.get(self.url(relative), timeout=60)
+        response.raise_for_status()
+        response.encoding = 'utf-8'
+        return response.text
+
+    def fetch(self, relative, dest):
+        offset = dest.stat().st_size if dest.exists() else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        with self.session.get(
+                self.url(relative), headers=headers, stream=True,
+                timeout=60) as response:
+            if response.status_code == 416:
+                # the partial file is already complete
+                return
+            response.raise_for_status()
+            mode = 'ab' if offset and response.status_code == 206 else 'wb'
+            with open(str(dest), mode) as f:
+                for data in response.iter_content(1024 * 1024):
+                    f.write(data)
+
+
+def open_transport(location):
+    if str(location).startswith(('http://', 'https://')):
+        return HttpTransport(str(location))
+    return DirectoryTransport(location)
+
+
+class SkybuildSyncExporter:
+    '''
+    Writes an export of a packages folder (manifest, blobs, records and
+    alias files) into a directory, which can be imported elsewhere directly
+    or served over http. If the manifest of the receiving side is given,
+    only what it is missing is exported; blobs already present in the export
+    directory are not copied again, and partial copies are resumed.
+    '''
+    def __init__(self, manager, export_root, workers=4):
+        self.manager = manager
+        self.export_root = Path(export_root)
+        self.workers = workers
+
+    def export_blob(self, blob_id):
+        dest = self.export_root / 'blobs' / blob_id
+        size = self.manager.blobs.size(blob_id)
+        if dest.exists() and dest.stat().st_size == size:
+            return False
+        partial = dest.parent / f'{blob_id}.part'
+        with self.manager.blobs.open(blob_id) as f:
+            copy_resumable(f, partial)
+        partial.replace(dest)
+        return True
+
+    def export(self, target_manifest=None):
+        manifest = build_manifest(self.manager)
+        delta = manifest_delta(manifest, target_manifest or empty_manifest())
+
+        (self.export_root / 'blobs').mkdir(parents=True, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            copied = sum(executor.map(self.export_blob, delta['blobs']))
+
+        stores = {
+            'meta': self.manager.meta_records,
+            'imports': self.manager.import_records,
+            'sources': self.manager.sources.records}
+        for kind, blob_ids in delta['records'].items():
+            folder = self.export_root / 'records' / kind
+            folder.mkdir(parents=True, exist_ok=True)
+            for blob_id in blob_ids:
+                atomic_write(
+                    folder / f'{blob_id}.yaml', stores[kind].get(blob_id))
+
+        aliases = self.manager.aliases
+        (self.export_root / 'aliases').mkdir(parents=True, exist_ok=True)
+        for path in [aliases.aliases_file, aliases.selection_file]:
+            if path.name in delta['aliases']:
+                atomic_write(
+                    self.export_root / 'aliases' / path.name,
+                    path.read_text())
+
+        # the manifest goes last, so an export is only picked up once it is
+        # complete
+        atomic_write(self.export_root / MANIFEST_FILE, yaml_dump(manifest))
+        return {
+            'blobs': len(delta['blobs']),
+            'blobs_copied': copied,
+            'records': {
+                kind: len(blob_ids)
+                for kind, blob_ids in delta['records'].items()},
+            'aliases': delta['aliases']
+        }
+
+
+class SkybuildSyncImporter:
+    '''
+    Brings a packages folder up to date with an export (from a directory or
+    an http url), transferring only the blobs and records that differ from
+    what is already here. Blobs are downloaded on parallel streams into the
+    tmp folder, resumed if a previous import was interrupted, and verified
+    against their md5 before being added.
+    '''
+    def __init__(self, manager, location, workers=4):
+        self.manager = manager
+        self.transport = open_transport(location)
+        self.workers = workers
+        self.partials = manager.paths.tmp / 'sync'
+
+    def import_blob(self, blob_id):
+        partial = self.partials / blob_id
+        self.transport.fetch(f'blobs/{blob_id}', partial)
+        md5 = compute_file_md5(partial, chunk_size=8 * 1024 * 1024)
+        if md5 != blob_id[:32]:
+            partial.unlink()
+            raise Exception(
+                f'blob {blob_id} failed verification after transfer; got md5 '
+                f'{md5}')
+        self.manager.blobs.add(blob_id, partial)
+        if partial.exists():
+            partial.unlink()
+
+    def sync(self, dry_run=False):
+        source = yaml_load(self.transport.read_text(MANIFEST_FILE))
+        delta = manifest_delta(source, build_manifest(self.manager))
+        result = {
+            'dry_run': dry_run,
+            'blobs': delta['blobs'],
+            'records': delta['records'],
+            'aliases': delta['aliases']
+        }
+        if dry_run:
+            return result
+
+        self.partials.mkdir(parents=True, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(self.import_blob, delta['blobs']))
+
+        self.manager.meta_records.put_many([
+            (blob_id, self.transport.read_text(f'records/meta/{blob_id}.yaml'))
+            for blob_id in delta['records']['meta']])
+        self.manager.import_records.put_many([
+            (blob_id,
+             self.transport.read_text(f'records/imports/{blob_id}.yaml'))
+            for blob_id in delta['records'].get('imports', [])])
+
+        sources = {
+            blob_id: self.transport.read_text(
+                f'records/sources/{blob_id}.yaml')
+            for blob_id in delta['records']['sources']}
+        self.manager.sources.records.put_many(list(sources.items()))
+        self.manager.sources.index.update_many({
+            blob_id: (yaml_load(text) or {}).get('entries', [])
+            for blob_id, text in sources.items()})
+
+        aliases = self.manager.aliases
+        for path in [aliases.aliases_file, aliases.selection_file]:
+            if path.name in delta['aliases']:
+                atomic_write(
+                    path, self.transport.read_text(f'aliases/{path.name}'))
+
+        self.manager.rebuild_view()
+        return result
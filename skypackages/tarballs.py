@@ -1,4 +1,5 @@
 from cached_property import cached_property
+import json
 import os
 from pathlib import Path
 import subprocess
@@ -12,10 +13,30 @@ class Tarball7zOperationError(Exception):
 
 
 class Tarball:
-    def __init__(self, tarball_path, bin_7z=DEFAULT_7Z_EXE):
-        self.tarball = Path(tarball_path)
+    def __init__(self, tarball_path, bin_7z=DEFAULT_7Z_EXE, materialize=None,
+                 opener=None):
+        self._tarball = Path(tarball_path)
         self.bin_7z = bin_7z
-        assert self.tarball.exists(), f'tarball {self.tarball} does not exist'
+
+        # for blobs that are not stored as plain files, `materialize` returns
+        # the path of a reconstructed copy and `opener` streams the contents
+        self.materialize = materialize
+        self.opener = opener
+        assert self._tarball.exists() or materialize, (
+            f'tarball {self._tarball} does not exist')
+
+    @property
+    def tarball(self):
+        if not self._tarball.exists() and self.materialize:
+            self._tarball = Path(self.materialize())
+            assert self._tarball.exists(), (
+                f'tarball {self._tarball} does not exist')
+        return self._tarball
+
+    def open(self):
+        if self.opener:
+            return self.opener()
+        return open(str(self.tarball), 'rb')
 
     @cached_property
     def fomod_root(self):
@@ -82,13 +103,16 @@ class Tarball:
 
         return {key: value for key, value in sorted(file_infos.items())}
 
-    def extract(self, dest, as_fomod=False):
+    def extract(self, dest, as_fomod=False, members=None):
         command = [
             self.bin_7z,
             'x', str(self.tarball),  # extract this file
             f'-o{dest}',  # to this destination
             '-aoa'  # overwrite all existing files without prompt
         ]
+        if members is not None:
+            # only extract these paths (as listed in `contents`)
+            command.extend(str(member) for member in members)
 
         p = subprocess.Popen(
             command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -137,3 +161,33 @@ class Tarball:
             raise
         info['Path'] = path
         return path, info
+
+
+def contents_members(contents):
+    '''
+    Sizes and CRCs of the member files (not folders) in a `Tarball.contents`
+    listing, keyed by member path
+    '''
+    return {
+        str(key): {
+            'size': int(info.get('Size') or 0),
+            'crc': info.get('CRC') or None}
+        for key, info in contents.items()
+        if info.get('Folder') != '+'}
+
+
+def dump_members(members):
+    # columnar json; valid yaml like every other record, but a fraction of
+    # the size and load time of a yaml mapping per member
+    return json.dumps({
+        'paths': list(members),
+        'sizes': [info['size'] for info in members.values()],
+        'crcs': [info['crc'] for info in members.values()]
+    }, separators=(',', ':'))
+
+
+def load_members(text):
+    data = json.loads(text)
+    return {
+        path: {'size': size, 'crc': crc}
+        for path, size, crc in zip(data['paths'], data['sizes'], data['crcs'])}
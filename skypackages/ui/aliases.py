@@ -0,0 +1,161 @@
+import fnmatch
+import os
+import re
+
+from PyQt5.QtCore import (
+    Qt,
+    QAbstractListModel,
+    QAbstractProxyModel,
+    QModelIndex,
+    pyqtSignal)
+
+
+class AliasListModel(QAbstractListModel):
+    '''
+    List model over an in-memory snapshot of the aliases, as a sorted list
+    of (alias, blob ids) pairs; the snapshot is only replaced when the
+    aliases change, not on every filter keystroke. Renaming through the
+    view is reported with `aliasRenamed` rather than applied here.
+    '''
+    aliasRenamed = pyqtSignal(str, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.items = []
+        # normalized alias names, for the filter to match against
+        self.keys = []
+
+    def set_items(self, items):
+        self.beginResetModel()
+        self.items = list(items)
+        self.keys = [os.path.normcase(alias) for alias, _ in self.items]
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.items)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        alias, blob_ids = self.items[index.row()]
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return alias
+        if role == Qt.UserRole:
+            return {'alias': alias, 'blob_ids': blob_ids}
+        return None
+
+    def flags(self, index):
+        return super().flags(index) | Qt.ItemIsEditable
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.EditRole or not index.isValid():
+            return False
+        old_alias = self.items[index.row()][0]
+        if value != old_alias:
+            self.aliasRenamed.emit(old_alias, value)
+        return False
+
+
+class AliasFilterProxyModel(QAbstractProxyModel):
+    '''
+    Filters an AliasListModel by a glob prefix (the filter text followed by
+    `*`, case-insensitively where the platform is). Matching goes against
+    the source's precomputed keys, and when the filter text is extended the
+    previous matches are narrowed down instead of rescanning every alias;
+    the removed rows are reported as removals so the view keeps its state.
+    '''
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.text = ''
+        self.rows = []
+        self.source_to_proxy = {}
+
+    def setSourceModel(self, model):
+        super().setSourceModel(model)
+        model.modelReset.connect(self.refilter)
+        self.refilter()
+
+    @staticmethod
+    def matcher(text):
+        return re.compile(
+            fnmatch.translate(os.path.normcase(text) + '*')).match
+
+    def can_narrow(self, text):
+        # extending a glob prefix can only narrow its matches, unless the
+        # old text ended inside an unfinished character class
+        return (
+            text.startswith(self.text) and text != self.text and
+            '[' not in self.text)
+
+    def set_filter_text(self, text):
+        if text == self.text:
+            return
+        if not self.can_narrow(text):
+            self.text = text
+            self.refilter()
+            return
+
+        self.text = text
+        match = self.matcher(text)
+        keys = self.sourceModel().keys
+        keep = [bool(match(keys[row])) for row in self.rows]
+
+        # remove runs of rejected rows back to front, so the rows before
+        # each run keep their positions
+        end = len(self.rows)
+        while end > 0:
+            if keep[end - 1]:
+                end -= 1
+                continue
+            start = end
+            while start > 0 and not keep[start - 1]:
+                start -= 1
+            self.beginRemoveRows(QModelIndex(), start, end - 1)
+            del self.rows[start:end]
+            self.endRemoveRows()
+            end = start
+        self.source_to_proxy = {
+            source_row: row for row, source_row in enumerate(self.rows)}
+
+    def refilter(self):
+        self.beginResetModel()
+        source = self.sourceModel()
+        if self.text:
+            match = self.matcher(self.text)
+            self.rows = [
+                row for row, key in enumerate(source.keys) if match(key)]
+        else:
+            self.rows = list(range(len(source.keys)))
+        self.source_to_proxy = {
+            source_row: row for row, source_row in enumerate(self.rows)}
+        self.endResetModel()
+
+    def index(self, row, column=0, parent=QModelIndex()):
+        if parent.isValid() or not 0 <= row < len(self.rows) or column != 0:
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=QModelIndex()):
+        return QModelIndex()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 1
+
+    def mapToSource(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        return self.sourceModel().index(self.rows[index.row()])
+
+    def mapFromSource(self, index):
+        if not index.isValid() or index.row() not in self.source_to_proxy:
+            return QModelIndex()
+        return self.index(self.source_to_proxy[index.row()])
+
+    def row_of(self, alias):
+        for row, source_row in enumerate(self.rows):
+            if self.sourceModel().items[source_row][0] == alias:
+                return row
+        return None
@@ -0,0 +1,246 @@
+import re
+
+from PyQt5.QtCore import Qt, QAbstractItemModel, QModelIndex
+
+
+class PathTrie:
+    '''
+    Compact trie of the member paths of an archive, kept in flat per-node
+    lists rather than one object per path. Node 0 is the root. Children are
+    only sorted (folders first, then by name) when a folder is first
+    listed.
+    '''
+    def __init__(self):
+        self.names = ['']
+        self.parents = [-1]
+        self.sizes = [0]
+        self.crcs = [None]
+        self.folders = [True]
+        self.children = {0: {}}
+        self.sorted_children = {}
+        self.rows = {}
+
+    @classmethod
+    def from_meta(cls, meta):
+        trie = cls()
+        members = meta.get('members')
+        for path in meta.get('filelist') or []:
+            info = members.get(path) if members is not None else None
+            trie.add(
+                path,
+                folder=members is not None and info is None,
+                size=(info or {}).get('size') or 0,
+                crc=(info or {}).get('crc'))
+        trie.total_sizes()
+        return trie
+
+    def add(self, path, folder=False, size=0, crc=None):
+        node = 0
+        for name in re.split(r'[\\/]', path):
+            # anything with children is a folder, even when the listing did
+            # not say so
+            self.folders[node] = True
+            children = self.children.setdefault(node, {})
+            child = children.get(name)
+            if child is None:
+                child = len(self.names)
+                self.names.append(name)
+                self.parents.append(node)
+                self.sizes.append(0)
+                self.crcs.append(None)
+                self.folders.append(True)
+                children[name] = child
+            node = child
+        if not folder and node not in self.children:
+            self.folders[node] = False
+            self.sizes[node] = size
+            self.crcs[node] = crc
+
+    def total_sizes(self):
+        # nodes are created after their parents, so walking them backwards
+        # adds every size into its parent after its own total is known
+        for node in range(len(self.names) - 1, 0, -1):
+            self.sizes[self.parents[node]] += self.sizes[node]
+
+    def __len__(self):
+        return len(self.names) - 1
+
+    def child_ids(self, node):
+        if node not in self.sorted_children:
+            children = sorted(
+                self.children.get(node, {}).values(),
+                key=lambda child: (
+                    not self.folders[child], self.names[child].lower()))
+            self.sorted_children[node] = children
+            for row, child in enumerate(children):
+                self.rows[child] = row
+        return self.sorted_children[node]
+
+    def row(self, node):
+        if node not in self.rows:
+            self.child_ids(self.parents[node])
+        return self.rows[node]
+
+    def has_children(self, node):
+        return bool(self.children.get(node))
+
+    def path(self, node):
+        parts = []
+        while node > 0:
+            parts.append(self.names[node])
+            node = self.parents[node]
+        return '\\'.join(reversed(parts))
+
+    def search(self, text):
+        '''
+        Yields the nodes whose name contains `text` (case-insensitively), in
+        listing order
+        '''
+        text = text.lower()
+        for node in range(1, len(self.names)):
+            if text in self.names[node].lower():
+                yield node
+
+
+class BlobContentsModel(QAbstractItemModel):
+    '''
+    Tree model over a PathTrie with name, size and CRC columns. Folders are
+    only expanded into rows when the view first asks for them. With a search
+    text set, the model is instead a flat list of matching paths, filled in
+    batches as the view scrolls, so a search never builds rows for the whole
+    archive.
+    '''
+    COLUMNS = ['Name', 'Size', 'CRC']
+    SEARCH_BATCH = 500
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.trie = PathTrie()
+        self.fetched = set()
+        self.search_text = ''
+        self.search_results = None
+        self.search_iter = None
+
+    def set_trie(self, trie):
+        self.beginResetModel()
+        self.trie = trie
+        self.fetched = set()
+        self.reset_search()
+        self.endResetModel()
+
+    def reset_search(self):
+        if self.search_text:
+            self.search_results = []
+            self.search_iter = self.trie.search(self.search_text)
+        else:
+            self.search_results = None
+            self.search_iter = None
+
+    def set_search(self, text):
+        if text == self.search_text:
+            return
+        self.beginResetModel()
+        self.search_text = text
+        self.reset_search()
+        self.endResetModel()
+
+    @property
+    def searching(self):
+        return self.search_results is not None
+
+    def node(self, index):
+        return index.internalId() if index.isValid() else 0
+
+    def index(self, row, column, parent=QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        if self.searching:
+            return self.createIndex(row, column, self.search_results[row])
+        node = self.trie.child_ids(self.node(parent))[row]
+        return self.createIndex(row, column, node)
+
+    def parent(self, index):
+        if not index.isValid() or self.searching:
+            return QModelIndex()
+        parent = self.trie.parents[index.internalId()]
+        if parent <= 0:
+            return QModelIndex()
+        return self.createIndex(self.trie.row(parent), 0, parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        if self.searching:
+            return 0 if parent.isValid() else len(self.search_results)
+        node = self.node(parent)
+        if node not in self.fetched and node != 0:
+            return 0
+        return len(self.trie.child_ids(node))
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.COLUMNS)
+
+    def hasChildren(self, parent=QModelIndex()):
+        if self.searching:
+            return not parent.isValid()
+        return self.trie.has_children(self.node(parent))
+
+    def canFetchMore(self, parent):
+        if self.searching:
+            return not parent.isValid() and self.search_iter is not None
+        node = self.node(parent)
+        return node not in self.fetched and self.trie.has_children(node)
+
+    def fetchMore(self, parent):
+        if self.searching:
+            if self.search_iter is None:
+                return
+            batch = []
+            for node in self.search_iter:
+                batch.append(node)
+                if len(batch) >= self.SEARCH_BATCH:
+                    break
+            else:
+                self.search_iter = None
+            if batch:
+                start = len(self.search_results)
+                self.beginInsertRows(
+                    QModelIndex(), start, start + len(batch) - 1)
+                self.search_results.extend(batch)
+                self.endInsertRows()
+            return
+        node = self.node(parent)
+        if node in self.fetched:
+            return
+        children = self.trie.child_ids(node)
+        if node == 0 or not children:
+            self.fetched.add(node)
+            return
+        self.beginInsertRows(parent, 0, len(children) - 1)
+        self.fetched.add(node)
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        node = index.internalId()
+        column = index.column()
+        if role == Qt.DisplayRole:
+            if column == 0:
+                return (
+                    self.trie.path(node) if self.searching else
+                    self.trie.names[node])
+            if column == 1:
+                return f'{self.trie.sizes[node]:,}'
+            if column == 2:
+                return self.trie.crcs[node] or ''
+        if role == Qt.ToolTipRole and column == 0:
+            return self.trie.path(node)
+        if role == Qt.TextAlignmentRole and column == 1:
+            return Qt.AlignRight | Qt.AlignVCenter
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.COLUMNS[section]
+        return None
@@ -1,5 +1,5 @@
 from PyQt5 import QtWidgets, uic
-from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal
 from PyQt5.QtGui import QPalette, QColor, QPixmap
 from PyQt5.QtWidgets import (
     QWidget,
@@ -8,6 +8,7 @@ from PyQt5.QtWidgets import (
     QCheckBox,
     QRadioButton,
     QVBoxLayout,
+    QStackedLayout,
     QSpacerItem,
     QSizePolicy,
     QLabel
@@ -17,7 +18,11 @@ from pathlib import Path
 
 import pyfomod
 from pyfomod import GroupType
+from pyfomod.installer import FailedCondition, FileInfo
 
+from skypackages.fomod import fomod_from_data, installer_choices
+from skypackages.fomod_plan import ArchiveListing
+from skypackages.ui.thumbnails import ThumbnailCache
 from skypackages.utils import yaml_dump
 
 UI_FILE = Path(__file__).parent / 'fomod.ui'
@@ -62,19 +67,53 @@ class FomodOptionPhoto(QLabel):
     def __init__(self, parent=None):
         super().__init__(parent)
         self._photo = None
+        self._path = None
+        self._photo_path = None
+        self._cache = None
+
+    def cache(self):
+        if self._cache is None:
+            self.setCache(ThumbnailCache(parent=self))
+        return self._cache
+
+    def setCache(self, cache):
+        # images are decoded and downscaled in the background by the cache;
+        # the label shows them once they are ready
+        self._cache = cache
+        cache.thumbnailReady.connect(self.thumbnailReady)
 
     def photo(self):
         return self._photo
 
     def setPhoto(self, path):
-        self._photo = QPixmap(path)
+        self._path = str(path)
+        self.refreshPhoto()
+
+    def refreshPhoto(self):
+        if self._path is None:
+            return
+        photo = self.cache().get(self._path, self.width(), self.height())
+        if photo is None:
+            # still decoding; keep scaling the photo shown so far if it is
+            # of the same image, but don't leave another option's photo up
+            if self._photo_path != self._path:
+                self._photo = None
+                self.setPixmap(QPixmap())
+                return
+            photo = self._photo
+        self._photo = photo
+        self._photo_path = self._path
         self.setPixmap(self._photo.scaled(
-            self.width(), self.height(), Qt.KeepAspectRatio))
+            self.width(), self.height(), Qt.KeepAspectRatio,
+            Qt.SmoothTransformation))
+
+    def thumbnailReady(self, path):
+        if path == self._path:
+            self.refreshPhoto()
 
     def resizeEvent(self, event):
-        if self.pixmap():
-            self.setPixmap(self._photo.scaled(
-                self.width(), self.height(), Qt.KeepAspectRatio))
+        if self._path is not None:
+            self.refreshPhoto()
 
 
 class FomodOptionsPanel(QGroupBox):
@@ -97,6 +136,7 @@ class FomodOptionsGroup(QGroupBox):
         self._group = None
         self._options = []
         self._option_items = []
+        self._valid = None
 
     def group(self):
         return self._group
@@ -150,8 +190,12 @@ class FomodOptionsGroup(QGroupBox):
         self.mouseEnteredOption.emit(option)
 
     def stateChanged(self):
-        self.setStyleSheet(
-            '' if self.validate() else 'background-color: red; ')
+        # restyling repolishes every option of the group, so only do it
+        # when the group's validity flips
+        valid = self.validate()
+        if valid != self._valid:
+            self._valid = valid
+            self.setStyleSheet('' if valid else 'background-color: red; ')
 
     def validate(self):
         if self._group.type == GroupType.ALL and not all(
@@ -175,9 +219,25 @@ class FomodOptionsGroup(QGroupBox):
 
 
 class FomodInstallerGui(QtWidgets.QMainWindow):
-    def __init__(self, fomod_root):
+    def __init__(self, fomod_root, cached=None):
+        '''
+        @param fomod_root: folder with the fomod folder, and whatever of the
+            archive has been extracted next to it
+        @param cached: optionally, the blob's cached fomod data along with
+            its `fomod_root` and `members` metadata; the wizard then runs
+            from the cached data, and lists the files of folder entries from
+            the archive listing, so only the config and images need to have
+            been extracted
+        '''
         self.root = Path(fomod_root)
-        self.installer = pyfomod.Installer(self.root)
+        self.listing = None
+        if cached:
+            self.installer = pyfomod.Installer(
+                fomod_from_data(cached['data']), path=self.root)
+            self.listing = ArchiveListing(cached)
+            self.archive_root = Path(cached['fomod_root'])
+        else:
+            self.installer = pyfomod.Installer(self.root)
 
         self.app = QApplication([])
         self.app.setStyle('Fusion')
@@ -205,6 +265,13 @@ class FomodInstallerGui(QtWidgets.QMainWindow):
         ''')
         super().__init__()
         uic.loadUi(UI_FILE, self)
+        self.thumbnails = ThumbnailCache(parent=self)
+        # page -> (page widget, group boxes), built when a page is first
+        # shown and kept for going back and forth
+        self.page_widgets = {}
+        # fomod files -> processed file infos, see `process_files`
+        self.file_infos = {}
+        self.pane_texts = {}
 
         # load the gui
         self.show()
@@ -241,6 +308,17 @@ class FomodInstallerGui(QtWidgets.QMainWindow):
     def setup_signal_handlers(self):
         self.FomodNextButton.clicked.connect(self.next_page)
         self.FomodBackButton.clicked.connect(self.previous_page)
+        self.FomodPhotoLabel.setCache(self.thumbnails)
+
+        self.pages_layout = QStackedLayout()
+        self.FomodOptionsGroup.setLayout(self.pages_layout)
+
+        # refresh the files and choices panes once navigation settles,
+        # rather than on every click
+        self.panes_timer = QTimer(self)
+        self.panes_timer.setSingleShot(True)
+        self.panes_timer.setInterval(100)
+        self.panes_timer.timeout.connect(self.render_panes)
 
     def initial_render(self):
         self.FomodNameLabel.setText(self.installer.root.name)
@@ -257,8 +335,7 @@ class FomodInstallerGui(QtWidgets.QMainWindow):
             page, selected = previous_data
             self.render_page(page, selected=selected)
 
-        self.render_files()
-        self.render_choices()
+        self.panes_timer.start()
 
     def next_page(self):
         selected = []
@@ -274,34 +351,134 @@ class FomodInstallerGui(QtWidgets.QMainWindow):
         else:
             print('done!')
 
-        self.render_files()
-        self.render_choices()
+        self.panes_timer.start()
 
     def render_page(self, page, selected=None):
-        selected = selected or []
-
-        old_layout = self.FomodOptionsGroup.layout()
-        if old_layout:
-            QWidget().setLayout(old_layout)
+        '''
+        Shows the widget of a page, building it the first time around. A
+        page shown again keeps the options ticked when it was last left,
+        unless going back, where the installer's record of them wins.
+        '''
+        cached = self.page_widgets.get(page._object)
+        if cached is None:
+            cached = self.page_widgets[page._object] = self.build_page(page)
+            selected = selected or []
+        page_widget, groupboxes = cached
+        if selected is not None:
+            for groupbox in groupboxes:
+                groupbox.selectFrom(selected)
 
         self.FomodOptionsGroup.setTitle(page.name)
-        self.FomodOptionsGroup.setData([])
-        groups_layout = QVBoxLayout()
-        for i, group in enumerate(page):
-            groupbox = FomodOptionsGroup(self.FomodOptionsGroup)
+        self.FomodOptionsGroup.setData([
+            option_item
+            for groupbox in groupboxes
+            for option_item in groupbox.optionItems()])
+        self.pages_layout.setCurrentWidget(page_widget)
+        if groupboxes and groupboxes[0].firstOptionItem():
+            self.render_option_hover(groupboxes[0].firstOptionItem())
+
+        self.prefetch_images(page)
+
+    def build_page(self, page):
+        page_widget = QWidget(self.FomodOptionsGroup)
+        groups_layout = QVBoxLayout(page_widget)
+        groups_layout.setContentsMargins(0, 0, 0, 0)
+        groupboxes = []
+        for group in page:
+            groupbox = FomodOptionsGroup(page_widget)
             groupbox.setGroup(group)
-            if i == 0 and groupbox.firstOptionItem():
-                self.render_option_hover(groupbox.firstOptionItem())
-            groupbox.selectFrom(selected)
             groupbox.mouseEnteredOption.connect(self.render_option_hover)
-
             groups_layout.addWidget(groupbox)
-            self.FomodOptionsGroup.data().extend(groupbox.optionItems())
+            groupboxes.append(groupbox)
 
         v_spacer = QSpacerItem(
             10, 10, QSizePolicy.Minimum, QSizePolicy.Expanding)
         groups_layout.addItem(v_spacer)
-        self.FomodOptionsGroup.setLayout(groups_layout)
+        self.pages_layout.addWidget(page_widget)
+        return page_widget, groupboxes
+
+    def prefetch_images(self, page):
+        # decode the images of this page's options, and of the page that
+        # comes next in order (conditions permitting), before they are
+        # hovered over
+        options = [option for group in page for option in group]
+        pages = self.installer._order_list(
+            self.installer.root.pages, self.installer.root.pages.order)
+        index = pages.index(page._object)
+        if index + 1 < len(pages):
+            options.extend(
+                option for group in pages[index + 1] for option in group)
+        self.thumbnails.prefetch(
+            [str(self.root / option.image)
+             for option in options if option.image],
+            self.FomodPhotoLabel.width(),
+            self.FomodPhotoLabel.height())
+
+    def process_files(self, files):
+        # walking the source folders is the slow part of listing installed
+        # files, and what a fomod's files entries expand to never changes
+        if files not in self.file_infos:
+            if self.listing is None:
+                self.file_infos[files] = FileInfo.process_files(
+                    files, self.installer.path)
+            else:
+                self.file_infos[files] = self.listed_file_infos(files)
+        return self.file_infos[files]
+
+    def listed_file_infos(self, files):
+        # folder sources are not extracted, so expand them from the archive
+        # listing instead of walking them
+        infos = []
+        for info in FileInfo.process_files(files, None):
+            found = self.listing.lookup(str(self.archive_root / info.source))
+            relatives = [relative for relative, _, _ in found if relative]
+            if not relatives:
+                infos.append(info)
+            for relative in relatives:
+                infos.append(FileInfo(
+                    str(Path(info.source) / relative),
+                    str(Path(info.destination) / relative),
+                    info.priority))
+        return infos
+
+    def installed_files(self):
+        '''
+        Same as the installer's `files()`, but with the files of the fomod
+        and of each option processed only once
+        '''
+        infos = list(self.process_files(self.installer.root.files))
+        for options in self.installer._previous_pages.values():
+            for option in options:
+                infos.extend(self.process_files(option.files))
+        for conditions, files in self.installer.root.file_patterns.items():
+            try:
+                self.installer._test_conditions(conditions)
+            except FailedCondition:
+                continue
+            infos.extend(self.process_files(files))
+
+        file_dict = {}
+        priority_dict = {}
+        for info in infos:
+            if info.destination in priority_dict:
+                if priority_dict[info.destination] > info.priority:
+                    continue
+                del file_dict[info.destination]
+            file_dict[info.destination] = info.source
+            priority_dict[info.destination] = info.priority
+        return {src: dest for dest, src in file_dict.items()}
+
+    def set_pane_text(self, pane, text):
+        # replacing the text lays the whole document out again
+        if self.pane_texts.get(pane.objectName()) == text:
+            return False
+        self.pane_texts[pane.objectName()] = text
+        pane.setText(text)
+        return True
+
+    def render_panes(self):
+        self.render_files()
+        self.render_choices()
 
     def render_files(self):
         lines = []
@@ -310,29 +487,17 @@ class FomodInstallerGui(QtWidgets.QMainWindow):
             lines.append(f'{repr(key)}: {repr(value)}')
         lines.append('')
         lines.append('files:')
-        for src, dest in self.installer.files().items():
+        for src, dest in self.installed_files().items():
             lines.append(f'{src}')
             lines.append(f'    -> {dest}')
 
-        self.SelectedFilesText.setText(os.linesep.join(lines))
-        scroll_bar = self.SelectedFilesText.verticalScrollBar()
-        scroll_bar.setValue(scroll_bar.maximum())
+        if self.set_pane_text(self.SelectedFilesText, os.linesep.join(lines)):
+            scroll_bar = self.SelectedFilesText.verticalScrollBar()
+            scroll_bar.setValue(scroll_bar.maximum())
 
     def render_choices(self):
-        choices = {}
-        for page, selected_options in self.installer._previous_pages.items():
-            for group in page:
-                for option in group:
-                    for selected in selected_options:
-                        if option is selected:
-                            (choices
-                                .setdefault('fomod', {})
-                                .setdefault('inputs', {})
-                                .setdefault(page.name, {})
-                                .setdefault(group.name, [])
-                                .append(option.name))
-                            break
-        self.ChoicesText.setText(yaml_dump(choices))
+        self.set_pane_text(
+            self.ChoicesText, yaml_dump(installer_choices(self.installer)))
 
     def render_option_hover(self, option_item):
         option = option_item.data()
@@ -1,8 +1,10 @@
+from collections import OrderedDict
+from concurrent.futures import wait
 from enum import Enum
-import fnmatch
+import html
 import os
 from PyQt5 import QtWidgets, uic
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QObject, QTimer, pyqtSignal
 from PyQt5.QtGui import QPalette, QColor, QCursor, QKeySequence, QIcon, QPixmap
 from PyQt5.QtWidgets import (
     QApplication,
@@ -15,12 +17,17 @@ from PyQt5.QtWidgets import (
     QMessageBox,
     QShortcut)
 from pathlib import Path
+import shutil
 import subprocess
 import sys
 
+from skypackages.fomod import config_members, dump_fomod_data
 from skypackages.manager import SkybuildPackageManager
-from skypackages.nexus import NexusMod
+from skypackages.nexus import NexusApiCache, NexusPrefetcher
 from skypackages.sources import NexusPackageSource, GenericPackageSource
+from skypackages.ui.aliases import AliasFilterProxyModel, AliasListModel
+from skypackages.ui.contents import BlobContentsModel, PathTrie
+from skypackages.ui.tasks import TaskCancelled, TaskManager, TaskPanel
 
 from pynxm import Nexus
 
@@ -41,6 +48,12 @@ class AliasSortMode(Enum):
     by_time_desc = 3
 
 
+class NexusPrefetchSignals(QObject):
+    # emitted from prefetch worker threads; Qt queues the delivery onto the
+    # main thread since this object lives there
+    partLoaded = pyqtSignal(object, str, object)
+
+
 class SkyPackagesGui(QtWidgets.QMainWindow):
     def __init__(self, packages_folder, nexus_api_key, aliases_folder=None):
         self.packages_folder = Path(packages_folder)
@@ -50,11 +63,22 @@ class SkyPackagesGui(QtWidgets.QMainWindow):
         self.nexus_api = None
         self.refresh_nexus_api()
 
+        # contents tries of recently shown blobs, built in the background
+        self.blob_tries = OrderedDict()
+        self.max_blob_tries = 16
+
         self.manager = None
         self.refresh_manager()
 
+        self.nexus_prefetcher = None
+        self.refresh_nexus_prefetcher()
+
         self.alias_sort_mode = AliasSortMode.by_name_asc
         self.current_nexus_mod = None
+        self.current_nexus_prefetch = None
+        self.current_nexus_picture = None
+        self.current_nexus_changelogs = None
+        self.current_nexus_task = None
         self.current_selected_alias = None
         self.current_selected_blob = None
         self.current_selected_source = None
@@ -86,6 +110,13 @@ class SkyPackagesGui(QtWidgets.QMainWindow):
         super().__init__()
         uic.loadUi(UI_FILE, self)
 
+        # downloads, hashing, 7z and nexus requests run as tasks on a worker
+        # pool, shown in a dock panel, so the window stays responsive
+        self.task_manager = TaskManager(parent=self)
+        self.task_panel = TaskPanel(self.task_manager, self)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.task_panel)
+        self.app.aboutToQuit.connect(self.task_manager.shutdown)
+
         # load the gui
         self.show()
         self.ensure_gui_elements()
@@ -140,6 +171,32 @@ class SkyPackagesGui(QtWidgets.QMainWindow):
     def setup_signal_handlers(self):
         self.NexusUrl.returnPressed.connect(self.load_nexus_mod_from_url)
 
+        self.aliases_model = AliasListModel(self)
+        self.aliases_proxy = AliasFilterProxyModel(self)
+        self.aliases_proxy.setSourceModel(self.aliases_model)
+        self.AliasesList.setModel(self.aliases_proxy)
+        self.aliases_model.aliasRenamed.connect(self.alias_renamed)
+
+        # filter once typing pauses, rather than on every keystroke
+        self.aliases_filter_timer = QTimer(self)
+        self.aliases_filter_timer.setSingleShot(True)
+        self.aliases_filter_timer.setInterval(150)
+        self.aliases_filter_timer.timeout.connect(self.apply_aliases_filter)
+
+        self.blob_contents_model = BlobContentsModel(self)
+        self.TarballDetailsTree.setModel(self.blob_contents_model)
+        self.blob_contents_filter_timer = QTimer(self)
+        self.blob_contents_filter_timer.setSingleShot(True)
+        self.blob_contents_filter_timer.setInterval(200)
+        self.blob_contents_filter_timer.timeout.connect(
+            self.apply_blob_contents_filter)
+        self.TarballDetailsFilter.textEdited.connect(
+            lambda text: self.blob_contents_filter_timer.start())
+
+        self.nexus_prefetch_signals = NexusPrefetchSignals()
+        self.nexus_prefetch_signals.partLoaded.connect(
+            self.nexus_mod_part_loaded)
+
         self.AliasesList.setContextMenuPolicy(Qt.CustomContextMenu)
         self.AliasesList.customContextMenuRequested.connect(
             self.aliases_list_context_menu)
@@ -158,13 +215,10 @@ class SkyPackagesGui(QtWidgets.QMainWindow):
         self.AliasesSortMode.activated.connect(
             self.aliases_sort_mode_changed)
 
-        self.AliasesList.itemSelectionChanged.connect(
+        self.AliasesList.selectionModel().currentChanged.connect(
             self.alias_selection_changed)
 
-        self.AliasesList.itemChanged.connect(
-            self.alias_content_changed)
-
-        self.AliasesList.itemDoubleClicked.connect(
+        self.AliasesList.doubleClicked.connect(
             self.alias_activated)
 
         self.BlobsList.itemSelectionChanged.connect(
@@ -190,13 +244,17 @@ class SkyPackagesGui(QtWidgets.QMainWindow):
                 self.save_generic_notes)
 
     def aliases_filter_changed(self, text):
-        self.render_aliases()
+        self.aliases_filter_timer.start()
+
+    def apply_aliases_filter(self):
+        self.aliases_proxy.set_filter_text(self.AliasesFilter.text())
+        self.restore_alias_selection()
 
     def aliases_sort_mode_changed(self, index):
         self.alias_sort_mode = AliasSortMode(index)
         self.render_aliases()
 
-    def alias_activated(self, item):
+    def alias_activated(self, index):
         current_selected_source_item = self.SourcesList.currentItem()
         if current_selected_source_item:
             self.source_activated(current_selected_source_item)
@@ -212,24 +270,36 @@ class SkyPackagesGui(QtWidgets.QMainWindow):
             self.render_generic_file_metadata()
             self.render_generic_file_notes()
 
-    def alias_selection_changed(self):
-        self.current_selected_alias = self.AliasesList.currentItem().text()
+    def current_alias_data(self):
+        index = self.AliasesList.currentIndex()
+        if index.isValid():
+            return index.data(Qt.UserRole)
+        return None
+
+    def current_alias(self):
+        data = self.current_alias_data()
+        return data['alias'] if data else None
+
+    def alias_selection_changed(self, current, previous):
+        if current.isValid():
+            self.current_selected_alias = current.data(Qt.DisplayRole)
         self.render_blobs()
 
-    def alias_content_changed(self, alias_item):
-        new_alias = alias_item.text()
-        old_alias = alias_item.data(Qt.UserRole)['alias']
-        if old_alias == new_alias:
-            return
+    def alias_renamed(self, old_alias, new_alias):
         try:
             self.manager.aliases.rename(old_alias, new_alias)
         except Exception as e:
-            alias_item.setText(old_alias)
             print(f'Cannot rename alias: got exception with message: {e}')
         else:
             self.current_selected_alias = new_alias
             self.render_aliases()
 
+    def select_alias(self, alias):
+        row = self.aliases_proxy.row_of(alias)
+        if row is not None:
+            self.AliasesList.setCurrentIndex(self.aliases_proxy.index(row))
+        return row is not None
+
     def blob_selection_changed(self):
         self.current_selected_blob = self.BlobsList.currentItem().text()
         self.render_blob_contents()
@@ -242,19 +312,19 @@ class SkyPackagesGui(QtWidgets.QMainWindow):
         self.render_aliases()
 
     def render_aliases(self):
-        self.AliasesList.clear()
         aliases = self.manager.aliases.data
-        pattern = self.AliasesFilter.text() + '*'
 
         def sort_by_name(item):
             alias, _ = item
             return alias
 
+        if self.alias_sort_mode in (
+                AliasSortMode.by_time_asc, AliasSortMode.by_time_desc):
+            time_keys = self.manager.alias_sort_index.keys()
+
         def sort_by_time(item):
             alias, _ = item
-            return (
-                self.manager.paths.blobs /
-                self.manager.aliases.get_selection(alias)).stat().st_mtime
+            return time_keys.get(alias, 0)
 
         sort_key, sort_reverse = {
             AliasSortMode.by_name_asc: (sort_by_name, False),
@@ -263,31 +333,26 @@ class SkyPackagesGui(QtWidgets.QMainWindow):
             AliasSortMode.by_time_desc: (sort_by_time, True)
         }[self.alias_sort_mode]
 
-        for alias, blob_ids in sorted(
-                aliases.items(),
-                key=sort_key,
-                reverse=sort_reverse):
-            if pattern and not fnmatch.fnmatch(alias, pattern):
-                continue
-            list_item = QListWidgetItem()
-            list_item.setText(alias)
-            list_item.setData(
-                Qt.UserRole, {'alias': alias, 'blob_ids': blob_ids})
-            list_item.setFlags(list_item.flags() | Qt.ItemIsEditable)
-            self.AliasesList.addItem(list_item)
-            if self.current_selected_alias == alias:
-                self.AliasesList.setCurrentItem(list_item)
-        if aliases and not self.AliasesList.currentItem():
-            self.AliasesList.setCurrentRow(0)
-        if not self.AliasesList.currentItem():
+        self.aliases_model.set_items(sorted(
+            aliases.items(), key=sort_key, reverse=sort_reverse))
+        self.restore_alias_selection()
+
+    def restore_alias_selection(self):
+        if self.current_selected_alias and self.select_alias(
+                self.current_selected_alias):
+            return
+        if self.aliases_proxy.rowCount():
+            self.AliasesList.setCurrentIndex(self.aliases_proxy.index(0))
+        else:
             self.current_selected_alias = None
+            self.render_blobs()
 
     def render_blobs(self):
         self.BlobsList.clear()
-        alias_item = self.AliasesList.currentItem()
-        if alias_item:
-            selected = self.manager.aliases.get_selection(alias_item.text())
-            blob_ids = alias_item.data(Qt.UserRole)['blob_ids']
+        alias_data = self.current_alias_data()
+        if alias_data:
+            selected = self.manager.aliases.get_selection(alias_data['alias'])
+            blob_ids = alias_data['blob_ids']
             for blob_id in blob_ids:
                 list_item = QListWidgetItem()
                 list_item.setText(blob_id)
@@ -371,7 +436,27 @@ class SkyPackagesGui(QtWidgets.QMainWindow):
             f'{self.current_nexus_mod.name}'
             f'</a>')
         self.NexusSummary.setText(self.current_nexus_mod.summary)
-        self.NexusDescription.setText(self.current_nexus_mod.description_html)
+        self.render_nexus_description()
+
+    def render_nexus_description(self):
+        parts = []
+        if self.current_nexus_picture:
+            parts.append(
+                f'<img src="{self.current_nexus_picture.as_uri()}" '
+                f'width="400"><br/>')
+        parts.append(self.current_nexus_mod.description_html)
+        if self.current_nexus_changelogs:
+            # changelogs are plain text from the api, unlike the bbcode
+            # description
+            parts.append('<h3>Changelogs</h3>')
+            for version, changes in reversed(
+                    list(self.current_nexus_changelogs.items())):
+                parts.append(f'<b>{html.escape(str(version))}</b><ul>')
+                parts.extend(
+                    f'<li>{html.escape(str(change))}</li>'
+                    for change in changes)
+                parts.append('</ul>')
+        self.NexusDescription.setText(''.join(parts))
 
     def render_nexus_files(self, file_list):
         # sort the filelist
@@ -410,10 +495,18 @@ class SkyPackagesGui(QtWidgets.QMainWindow):
             selected_source = selected_source_item.data(Qt.UserRole)
 
         for i, file_ in enumerate(file_list):
+            # mark files that have already been imported into the packages
+            # folder
+            imported = self.manager.sources.find_nexus(
+                file_.game, file_.mod_id, file_.file_id)
             for j, header in enumerate(headers):
                 item = QTableWidgetItem()
                 item.setText(f'{getattr(file_, header)}')
                 item.setData(Qt.UserRole, file_)
+                if imported:
+                    item.setBackground(QColor(0, 100, 0))
+                    item.setToolTip(
+                        'already imported as ' + ', '.join(imported))
                 self.NexusAvailableFiles.setItem(i, j, item)
             if (selected_source and
                     isinstance(selected_source, NexusPackageSource) and
@@ -423,12 +516,12 @@ class SkyPackagesGui(QtWidgets.QMainWindow):
         self.NexusAvailableFiles.resizeColumnsToContents()
 
     def aliases_list_context_menu(self, event):
-        clicked_item = self.AliasesList.itemAt(event)
-        if clicked_item:
+        clicked_index = self.AliasesList.indexAt(event)
+        if clicked_index.isValid():
             menu = QMenu(self.AliasesList)
             action_rename = menu.addAction('Rename')
             action_rename.triggered.connect(
-                lambda: self.AliasesList.editItem(clicked_item))
+                lambda: self.AliasesList.edit(clicked_index))
             menu.popup(QCursor.pos())
 
     def blobs_list_context_menu(self, event):
@@ -469,13 +562,39 @@ class SkyPackagesGui(QtWidgets.QMainWindow):
         blob_item = self.BlobsList.currentItem()
         if blob_item:
             blob_id = blob_item.text()
-            file_list = self.manager.meta(blob_id)['filelist']
-            self.TarballDetailsText.setText(os.linesep.join(file_list))
+            if blob_id in self.blob_tries:
+                self.blob_tries.move_to_end(blob_id)
+                self.show_blob_contents(self.blob_tries[blob_id])
+                return
+
+            # loading the listing of a big archive and building its trie
+            # takes seconds, so it happens in a task
+            self.show_blob_contents(PathTrie())
+            self.task_manager.submit(
+                f'list contents of {blob_id}',
+                lambda task: PathTrie.from_meta(
+                    self.manager.listed_meta(blob_id)),
+                on_done=lambda trie: self.blob_contents_loaded(
+                    blob_id, trie))
+
+    def blob_contents_loaded(self, blob_id, trie):
+        self.blob_tries[blob_id] = trie
+        while len(self.blob_tries) > self.max_blob_tries:
+            self.blob_tries.popitem(last=False)
+        blob_item = self.BlobsList.currentItem()
+        if blob_item and blob_item.text() == blob_id:
+            self.show_blob_contents(trie)
+
+    def show_blob_contents(self, trie):
+        self.blob_contents_model.set_trie(trie)
+        self.TarballDetailsTree.resizeColumnToContents(0)
+
+    def apply_blob_contents_filter(self):
+        self.blob_contents_model.set_search(self.TarballDetailsFilter.text())
 
     def unassociate_blob(self, blob_item):
-        alias_item = self.AliasesList.currentItem()
-        if alias_item:
-            alias = alias_item.text()
+        alias = self.current_alias()
+        if alias:
             blob_id = blob_item.text()
             confirmed = QMessageBox.question(
                 self,
@@ -491,9 +610,8 @@ class SkyPackagesGui(QtWidgets.QMainWindow):
                 self.render_aliases()
 
     def select_blob(self, blob_item):
-        alias_item = self.AliasesList.currentItem()
-        if alias_item:
-            alias = alias_item.text()
+        alias = self.current_alias()
+        if alias:
             blob_id = blob_item.text()
         self.manager.aliases.set_selection(alias, blob_id)
         self.render_blobs()
@@ -504,23 +622,61 @@ class SkyPackagesGui(QtWidgets.QMainWindow):
 
     def rebuild_blob_metadata(self, blob_item):
         blob_id = blob_item.text()
-        self.manager.meta(blob_id, refresh=True)
+        self.task_manager.submit(
+            f'rebuild metadata of {blob_id}',
+            lambda task: self.manager.meta(blob_id, refresh=True),
+            on_done=lambda meta: self.blob_metadata_rebuilt(blob_id))
+
+    def blob_metadata_rebuilt(self, blob_id):
+        self.blob_tries.pop(blob_id, None)
         self.render_blobs()
 
     def preview_fomod(self, blob_item):
         blob_id = blob_item.text()
-        fomod_root = self.manager.meta(blob_id)['fomod_root']
-        assert fomod_root, f'no fomod_root for {blob_id}'
 
-        if fomod_root.endswith('.fomod'):
-            fomod_root = ''
-
-        self.manager.clean_tmp()
-        self.manager.fetch_tarball(blob_id).extract(
-            self.manager.paths.tmp, as_fomod=True)
-        fomod_root = self.manager.paths.tmp / fomod_root
-        subprocess.Popen([
-            f'{sys.argv[0]}', 'fomod', f'{fomod_root}'])
+        def extract(task):
+            meta = self.manager.meta(blob_id)
+            fomod_root = meta['fomod_root']
+            assert fomod_root, f'no fomod_root for {blob_id}'
+
+            # with the fomod cached, the wizard runs from the cached data and
+            # lists files from the archive listing, so it only needs the
+            # images it shows, not the whole archive
+            members = None
+            cached = None
+            data = self.manager.fomod_data(blob_id)
+            if fomod_root.endswith('.fomod'):
+                fomod_root = ''
+            elif not data.get('error'):
+                meta = self.manager.listed_meta(blob_id)
+                members = config_members(meta) + sorted(
+                    set(data['image_members'].values()))
+                cached = {
+                    'data': data,
+                    'fomod_root': meta['fomod_root'],
+                    'members': meta['members']}
+
+            # each preview extracts into its own folder, so that several
+            # can be prepared at once
+            preview_folder = self.manager.paths.tmp / 'fomod_preview' / blob_id
+            if preview_folder.exists():
+                shutil.rmtree(preview_folder)
+            preview_folder.mkdir(parents=True)
+            task.report(0, message='extracting')
+            self.manager.fetch_tarball(blob_id).extract(
+                preview_folder, as_fomod=True, members=members)
+            command = [
+                f'{sys.argv[0]}', 'fomod', f'{preview_folder / fomod_root}']
+            if cached:
+                cached_file = preview_folder / 'fomod_cached.json'
+                cached_file.write_text(dump_fomod_data(cached))
+                command.extend(['--cached', f'{cached_file}'])
+            return command
+
+        self.task_manager.submit(
+            f'preview fomod of {blob_id}',
+            extract,
+            on_done=subprocess.Popen)
 
     def nexus_file_context_menu(self, event):
         clicked_item = self.NexusAvailableFiles.itemAt(event)
@@ -552,10 +708,20 @@ class SkyPackagesGui(QtWidgets.QMainWindow):
             menu.popup(QCursor.pos())
 
     def download_nexus_file(self, nexus_file, post_action=None):
-        downloaded = nexus_file.download_into(self.manager.paths.download_cache)
-        print(f'downloaded: {downloaded}')
-        package_source = nexus_file.package_source
-        self.load_file(downloaded, package_source, post_action=post_action)
+        def download(task):
+            downloaded = self.manager.download_nexus_file(
+                nexus_file,
+                progress=lambda done, total: task.report(
+                    done, total, f'{done // 1024} / {total // 1024} KiB'))
+            print(f'downloaded: {downloaded}')
+            return downloaded
+
+        self.task_manager.submit(
+            f'download {nexus_file.file_name}',
+            download,
+            on_done=lambda downloaded: self.load_file(
+                downloaded, nexus_file.package_source,
+                post_action=post_action))
 
     def load_file(self, file_, package_source, post_action=None):
         if post_action is FileLoadPostActions.add_as_new:
@@ -567,10 +733,15 @@ class SkyPackagesGui(QtWidgets.QMainWindow):
                     'New Package Name',
                     QLineEdit.Normal,
                     '')
-            self.manager.add_source(alias, package_source, file_)
-            self.render_aliases()
-            for item in self.AliasesList.findItems(alias, Qt.MatchExactly):
-                self.AliasesList.setCurrentItem(item)
+            self.task_manager.submit(
+                f'import {Path(file_).name} as {alias}',
+                lambda task: self.manager.add_source(
+                    alias, package_source, file_),
+                on_done=lambda result: self.package_added(alias))
+
+    def package_added(self, alias):
+        self.current_selected_alias = alias
+        self.render_aliases()
 
     def load_generic_file(self, generic_file, post_action=None):
         print(f'loaded {generic_file}')
@@ -651,17 +822,81 @@ class SkyPackagesGui(QtWidgets.QMainWindow):
         return True
 
     def load_nexus_mod_from_url(self):
-        self.current_nexus_mod = NexusMod.from_url(
-            self.nexus_api, self.current_nexus_url)
-        self.render_nexus_mod()
-        self.render_nexus_files(self.current_nexus_mod.file_list)
+        # fire off every request for the mod at once and render each part
+        # as it arrives; results of a previously loaded url are ignored
+        url = self.current_nexus_url
+        prefetch = self.nexus_prefetcher.prefetch_url(url)
+        self.current_nexus_prefetch = prefetch
+        self.current_nexus_mod = None
+        self.current_nexus_picture = None
+        self.current_nexus_changelogs = None
+        for part, future in prefetch.futures.items():
+            future.add_done_callback(
+                lambda future, part=part:
+                    self.nexus_prefetch_signals.partLoaded.emit(
+                        prefetch, part, future))
+
+        # the requests run on the prefetcher's own threads; the task only
+        # tracks them for the task panel, and cancelling it (or loading
+        # another url) cancels whatever has not started yet
+        def track(task):
+            futures = list(prefetch.futures.values())
+            pending = set(futures)
+            try:
+                while pending:
+                    _, pending = wait(pending, timeout=0.2)
+                    task.report(len(futures) - len(pending), len(futures))
+            except TaskCancelled:
+                for future in pending:
+                    future.cancel()
+                raise
+
+        if self.current_nexus_task:
+            self.task_manager.cancel(self.current_nexus_task)
+        self.current_nexus_task = self.task_manager.submit(
+            f'load {url}', track)
+
+    def nexus_mod_part_loaded(self, prefetch, part, future):
+        if prefetch is not self.current_nexus_prefetch:
+            return
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f'failed to load {part} of nexus mod: {e}')
+            return
+
+        if part == 'mod':
+            self.current_nexus_mod = result
+            self.render_nexus_mod()
+            if prefetch.file_list.done():
+                self.nexus_mod_part_loaded(
+                    prefetch, 'file_list', prefetch.file_list)
+        elif part == 'file_list':
+            # file objects hang off the mod; if it has not arrived yet, the
+            # file list gets rendered once it does
+            if self.current_nexus_mod:
+                self.render_nexus_files(
+                    self.current_nexus_mod.parse_file_list(result))
+        elif part == 'picture':
+            self.current_nexus_picture = result
+            if self.current_nexus_mod:
+                self.render_nexus_description()
+        elif part == 'changelogs':
+            self.current_nexus_changelogs = result
+            if self.current_nexus_mod:
+                self.render_nexus_description()
 
     def refresh_nexus_api(self):
         self.nexus_api = Nexus(self.nexus_api_key)
 
+    def refresh_nexus_prefetcher(self):
+        self.nexus_prefetcher = NexusPrefetcher(
+            self.nexus_api, NexusApiCache(self.manager.paths.nexus_cache))
+
     def refresh_manager(self):
         self.manager = SkybuildPackageManager(
             self.packages_folder, aliases_folder=self.aliases_folder)
+        self.blob_tries.clear()
 
     def run(self):
         print('Running App')
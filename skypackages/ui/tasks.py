@@ -0,0 +1,263 @@
+from enum import Enum
+import itertools
+import threading
+import time
+import traceback
+
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt5.QtWidgets import (
+    QDockWidget,
+    QHBoxLayout,
+    QHeaderView,
+    QProgressBar,
+    QPushButton,
+    QTableWidget,
+    QTableWidgetItem,
+    QVBoxLayout,
+    QWidget)
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class TaskStatus(Enum):
+    queued = 'queued'
+    running = 'running'
+    finished = 'finished'
+    failed = 'failed'
+    cancelled = 'cancelled'
+
+
+class TaskSignals(QObject):
+    # emitted from pool threads; since this object lives on the main thread,
+    # Qt queues the delivery there, so connected slots may touch widgets
+    changed = pyqtSignal(object)
+    finished = pyqtSignal(object, object)
+    failed = pyqtSignal(object, object)
+
+
+class Task(QRunnable):
+    '''
+    A unit of blocking work run on the task pool. The work function gets the
+    task as its first argument, and may report progress through
+    `task.report(done, total, message)`; cancellation is cooperative, in
+    that `report` and `check_cancelled` raise TaskCancelled once the task
+    has been cancelled.
+    '''
+    REPORT_INTERVAL = 0.1
+
+    _ids = itertools.count(1)
+
+    def __init__(self, name, func, *args, **kwargs):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.id = next(self._ids)
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = TaskSignals()
+        self.status = TaskStatus.queued
+        self.done = 0
+        self.total = 0
+        self.message = ''
+        self.cancel_event = threading.Event()
+        self.last_report = 0
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    @property
+    def active(self):
+        return self.status in (TaskStatus.queued, TaskStatus.running)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise TaskCancelled(self.name)
+
+    def report(self, done, total=None, message=None):
+        self.check_cancelled()
+        self.done = done
+        if total is not None:
+            self.total = total
+        if message is not None:
+            self.message = message
+        # progress callbacks can fire for every downloaded block; only
+        # forward them to the gui a few times a second
+        now = time.monotonic()
+        if now - self.last_report >= self.REPORT_INTERVAL or (
+                self.total and done >= self.total):
+            self.last_report = now
+            self.signals.changed.emit(self)
+
+    def set_status(self, status, message=None):
+        self.status = status
+        if message is not None:
+            self.message = message
+        self.signals.changed.emit(self)
+
+    def run(self):
+        if self.cancelled:
+            self.set_status(TaskStatus.cancelled)
+            return
+        self.set_status(TaskStatus.running)
+        try:
+            result = self.func(self, *self.args, **self.kwargs)
+        except TaskCancelled:
+            self.set_status(TaskStatus.cancelled)
+        except Exception as e:
+            traceback.print_exc()
+            self.set_status(TaskStatus.failed, str(e))
+            self.signals.failed.emit(self, e)
+        else:
+            self.set_status(TaskStatus.finished)
+            self.signals.finished.emit(self, result)
+
+
+class TaskManager(QObject):
+    '''
+    Runs tasks on a QThreadPool, several at once, and keeps track of them
+    for the task panel
+    '''
+    taskAdded = pyqtSignal(object)
+    taskChanged = pyqtSignal(object)
+
+    def __init__(self, max_workers=4, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_workers)
+        self.tasks = []
+
+    def submit(self, name, func, *args, on_done=None, on_error=None,
+               **kwargs):
+        '''
+        Queues `func(task, *args, **kwargs)` on the pool
+
+        @param on_done: called on the main thread with the result
+        @param on_error: called on the main thread with the exception
+        @return: the Task
+        '''
+        task = Task(name, func, *args, **kwargs)
+        task.signals.changed.connect(self.taskChanged)
+        if on_done:
+            task.signals.finished.connect(
+                lambda task, result: on_done(result))
+        if on_error:
+            task.signals.failed.connect(lambda task, error: on_error(error))
+        self.tasks.append(task)
+        self.taskAdded.emit(task)
+        self.pool.start(task)
+        return task
+
+    def cancel(self, task):
+        task.cancel()
+        # a task still waiting in the queue never gets to run
+        if task.status is TaskStatus.queued and self.pool.tryTake(task):
+            task.set_status(TaskStatus.cancelled)
+
+    def cancel_all(self):
+        for task in self.tasks:
+            if task.active:
+                self.cancel(task)
+
+    def clear_inactive(self):
+        self.tasks = [task for task in self.tasks if task.active]
+
+    def shutdown(self, wait_msecs=5000):
+        self.cancel_all()
+        self.pool.waitForDone(wait_msecs)
+
+
+class TaskPanel(QDockWidget):
+    '''
+    Dock widget listing tasks with their status and progress, with a button
+    per task to cancel it
+    '''
+    COLUMNS = ['Task', 'Status', 'Progress', '']
+
+    def __init__(self, task_manager, parent=None):
+        super().__init__('Tasks', parent)
+        self.task_manager = task_manager
+        self.rows = {}
+
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.verticalHeader().hide()
+        self.table.horizontalHeader().setSectionResizeMode(
+            0, QHeaderView.Stretch)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+
+        clear_button = QPushButton('Clear Finished')
+        clear_button.clicked.connect(self.clear_inactive)
+        buttons = QHBoxLayout()
+        buttons.addStretch()
+        buttons.addWidget(clear_button)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.table)
+        layout.addLayout(buttons)
+        widget = QWidget()
+        widget.setLayout(layout)
+        self.setWidget(widget)
+
+        task_manager.taskAdded.connect(self.task_added)
+        task_manager.taskChanged.connect(self.task_changed)
+
+    def task_added(self, task):
+        row = self.table.rowCount()
+        self.table.insertRow(row)
+        name_item = QTableWidgetItem(task.name)
+        name_item.setData(Qt.UserRole, task.id)
+        self.table.setItem(row, 0, name_item)
+        self.table.setItem(row, 1, QTableWidgetItem(task.status.value))
+        progress = QProgressBar()
+        progress.setRange(0, 0)
+        self.table.setCellWidget(row, 2, progress)
+        cancel_button = QPushButton('Cancel')
+        cancel_button.clicked.connect(
+            lambda: self.task_manager.cancel(task))
+        self.table.setCellWidget(row, 3, cancel_button)
+        self.rows[task.id] = task
+        self.task_changed(task)
+
+    def row_of(self, task):
+        for row in range(self.table.rowCount()):
+            if self.table.item(row, 0).data(Qt.UserRole) == task.id:
+                return row
+        return None
+
+    def task_changed(self, task):
+        row = self.row_of(task)
+        if row is None:
+            return
+
+        status = task.status.value
+        if task.message:
+            status = f'{status}: {task.message}'
+        self.table.item(row, 1).setText(status)
+        self.table.item(row, 1).setToolTip(status)
+
+        progress = self.table.cellWidget(row, 2)
+        if task.total:
+            # progress bars take ints; scale large byte counts down
+            scale = max(1, task.total // 1000000)
+            progress.setRange(0, task.total // scale)
+            progress.setValue(min(task.done, task.total) // scale)
+        elif not task.active:
+            progress.setRange(0, 1)
+            progress.setValue(1)
+        self.table.cellWidget(row, 3).setEnabled(task.active)
+
+    def clear_inactive(self):
+        for row in reversed(range(self.table.rowCount())):
+            task = self.rows[self.table.item(row, 0).data(Qt.UserRole)]
+            if not task.active:
+                self.table.removeRow(row)
+                del self.rows[task.id]
+        self.task_manager.clear_inactive()
@@ -0,0 +1,102 @@
+from collections import OrderedDict
+import os
+
+from PyQt5.QtCore import Qt, QObject, QRunnable, QSize, QThreadPool, pyqtSignal
+from PyQt5.QtGui import QImage, QImageReader, QPixmap
+
+
+class ThumbnailSignals(QObject):
+    loaded = pyqtSignal(object, object)
+
+
+class ThumbnailJob(QRunnable):
+    '''
+    Decodes an image scaled down to fit a bounding size, on a pool thread.
+    QImageReader can scale while decoding (for jpegs, decoding straight
+    into the smaller size), so the full size image is never held in memory.
+    '''
+    def __init__(self, key, signals):
+        super().__init__()
+        self.key = key
+        self.signals = signals
+
+    def run(self):
+        path, _, _, width, height = self.key
+        reader = QImageReader(path)
+        reader.setAutoTransform(True)
+        size = reader.size()
+        if size.isValid():
+            reader.setScaledSize(size.scaled(
+                QSize(width, height), Qt.KeepAspectRatio))
+        image = reader.read()
+        if image.isNull():
+            print(f'cannot read image {path}: {reader.errorString()}')
+            image = QImage()
+        self.signals.loaded.emit(self.key, image)
+
+
+class ThumbnailCache(QObject):
+    '''
+    Small LRU cache of downscaled images keyed by (path, mtime, size, target
+    size), filled by decoding on a thread pool. Target sizes are rounded up
+    to a multiple of SIZE_STEP so that resizing a widget a little does not
+    trigger a new decode.
+    '''
+    thumbnailReady = pyqtSignal(str)
+
+    SIZE_STEP = 128
+
+    def __init__(self, max_entries=64, max_workers=2, parent=None):
+        super().__init__(parent)
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.pending = set()
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_workers)
+        self.signals = ThumbnailSignals(self)
+        self.signals.loaded.connect(self.loaded)
+
+    def key(self, path, width, height):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        step = self.SIZE_STEP
+        return (
+            str(path), stat.st_mtime_ns, stat.st_size,
+            max(1, -(-width // step)) * step,
+            max(1, -(-height // step)) * step)
+
+    def get(self, path, width, height):
+        '''
+        @return: the cached thumbnail as a QPixmap, or None, in which case
+            it gets decoded in the background and `thumbnailReady` is
+            emitted with the path once it is available
+        '''
+        key = self.key(path, width, height)
+        if key is None:
+            return None
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.load(key)
+        return None
+
+    def prefetch(self, paths, width, height):
+        for path in paths:
+            key = self.key(path, width, height)
+            if key is not None and key not in self.entries:
+                self.load(key)
+
+    def load(self, key):
+        if key not in self.pending:
+            self.pending.add(key)
+            self.pool.start(ThumbnailJob(key, self.signals))
+
+    def loaded(self, key, image):
+        # pixmaps may only be created on the gui thread
+        self.pending.discard(key)
+        self.entries[key] = QPixmap.fromImage(image)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.thumbnailReady.emit(key[0])
@@ -1,12 +1,20 @@
+import collections
 import hashlib
 import os
 from pathlib import Path
 import requests
 import shutil
+import threading
+import time
 from tqdm import tqdm
-from win32com.client import Dispatch
 import yaml
 
+# windows shortcuts are an optional feature that needs pywin32
+try:
+    from win32com.client import Dispatch
+except ImportError:
+    Dispatch = None
+
 
 class IndentedSafeDumper(yaml.SafeDumper):
     def increase_indent(self, flow=False, indentless=False):
@@ -24,24 +32,47 @@ def yaml_load(text):
     return yaml.safe_load(text)
 
 
-def compute_file_md5(file_path, verbose=False):
+def compute_file_md5(file_path, verbose=False, chunk_size=4096):
     '''
     Utility function that computes the md5 checksum of a file at the given
     file path
 
     @param file_path: path to the file to get md5 checksum for
     @param verbose: print an informative line to stdout before computing md5
+    @param chunk_size: number of bytes to read at a time
     @return: the computed md5 hexdigest
     '''
     if verbose:
         print(f'computing md5 for {file_path}')
     hash_md5 = hashlib.md5()
     with open(str(file_path), 'rb') as f:
-        for chunk in iter(lambda: f.read(4096), b''):
+        for chunk in iter(lambda: f.read(chunk_size), b''):
             hash_md5.update(chunk)
     return hash_md5.hexdigest()
 
 
+def atomic_write(path, data, sync=False):
+    '''
+    Writes text or bytes to the given path via a temporary sibling file that
+    is then renamed over the path, so readers never observe a partial file
+
+    @param sync: flush the data to disk before renaming, so that the path
+        holds either the old or the new data even after a crash
+    '''
+    path = Path(path)
+    tmp = path.parent / f'{path.name}.tmp{os.getpid()}-{threading.get_ident()}'
+    if isinstance(data, bytes):
+        f = open(str(tmp), 'wb')
+    else:
+        f = open(str(tmp), 'w', encoding='utf-8')
+    with f:
+        f.write(data)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    tmp.replace(path)
+
+
 def copy_file(src, dest):
     src = Path(src)
     dest = Path(dest)
@@ -52,7 +83,13 @@ def copy_file(src, dest):
         shutil.copyfile(src, dest)
 
 
+def shortcuts_available():
+    return Dispatch is not None
+
+
 def create_shortcut(target, shortcut):
+    assert shortcuts_available(), (
+        'creating shortcuts requires pywin32 on windows')
     target = Path(target)
     assert target.exists(), f'target {target} does not exist'
     target = target.resolve()
@@ -67,6 +104,18 @@ def create_shortcut(target, shortcut):
     shortcut.save()
 
 
+def parse_size(text):
+    '''
+    Parses a human readable size such as `512M` or `20G` (binary units)
+    into a number of bytes
+    '''
+    text = str(text).strip().upper().rstrip('B')
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
 class ReadOnlyDictDataAttribute:
     def __init__(self, attr, postprocess=None):
         self.attr = attr
@@ -77,16 +126,81 @@ class ReadOnlyDictDataAttribute:
         return self.postprocess(value) if self.postprocess else value
 
 
-def download_url(url, output_path):
-    response = requests.get(url, stream=True)
+class DownloadTooSlowError(Exception):
+    def __init__(self, url, bytes_per_sec):
+        super().__init__(
+            f'throughput from {url} collapsed to {bytes_per_sec:.0f} B/s')
+        self.url = url
+        self.bytes_per_sec = bytes_per_sec
+
+
+def download_url(url, output_path, resume=False, min_bytes_per_sec=None,
+                 window_seconds=10, sample_seconds=0.1, timeout=60,
+                 progress=None):
+    '''
+    Utility function that downloads the given url into the given output path
+
+    @param url: url to download
+    @param output_path: path to write the downloaded data to
+    @param resume: if the output path already has partial data, request only
+        the remainder from the server and append to it
+    @param min_bytes_per_sec: if given, raise DownloadTooSlowError once the
+        throughput over the last `window_seconds` drops below this
+    @param window_seconds: length of the throughput measuring window
+    @param sample_seconds: minimum interval between the samples kept for
+        measuring the throughput
+    @param timeout: seconds to wait for the server to connect or send data
+    @param progress: if given, called with the bytes downloaded so far and
+        the total size after every block; an exception raised from it aborts
+        the download, leaving the partial file for a later resume
+    @return: the average throughput of this download in bytes per second,
+        or None if resuming found the partial data already complete
+    '''
+    output_path = Path(output_path)
+    offset = output_path.stat().st_size if resume and output_path.exists() else 0
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+    response = requests.get(
+        url, stream=True, headers=headers, timeout=timeout)
+    if offset and response.status_code == 416:
+        # nothing left past the offset; the partial file is already complete
+        response.close()
+        return None
+    response.raise_for_status()
+    if offset and response.status_code != 206:
+        # server ignored the range request; start over from the beginning
+        offset = 0
+
     total_size = int(response.headers.get('content-length', 0))
     block_size = 1024  # 1 kilobyte
+    started = time.monotonic()
+    samples = collections.deque([(started, 0)])
     with tqdm(total=total_size, unit='iB', unit_scale=True) as t:
-        with open(output_path, 'wb') as f:
+        with open(output_path, 'ab' if offset else 'wb') as f:
             for data in response.iter_content(block_size):
                 t.update(len(data))
                 f.write(data)
+                if progress is not None:
+                    progress(offset + t.n, offset + total_size)
+                if min_bytes_per_sec is None:
+                    continue
+                now = time.monotonic()
+                # one sample per interval at most; the rate below is
+                # measured against the current byte count either way
+                if now - samples[-1][0] >= sample_seconds:
+                    samples.append((now, t.n))
+                # keep the newest sample that is at least a window old, so
+                # the rate covers the full window even with bursty arrivals
+                while (len(samples) > 1 and
+                        now - samples[1][0] >= window_seconds):
+                    samples.popleft()
+                if now - started >= window_seconds:
+                    elapsed = now - samples[0][0]
+                    rate = (t.n - samples[0][1]) / elapsed if elapsed else 0
+                    if rate < min_bytes_per_sec:
+                        response.close()
+                        raise DownloadTooSlowError(url, rate)
     if total_size != 0:
         assert t.n == total_size, (
             f'response is nonzero yet progress bar result is not total_size; '
             f'something is wrong: {t.n} {total_size}')
+    return t.n / max(time.monotonic() - started, 1e-6)
@@ -0,0 +1,218 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+from pathlib import Path
+import uuid
+
+from skypackages.utils import create_shortcut, shortcuts_available
+
+
+def view_name(file_name, blob_id):
+    # view entries are named after the original file name, with the start
+    # of the blob's md5 appended to keep different versions apart
+    file_name = Path(file_name)
+    return f'{file_name.stem}-{blob_id[:8]}{file_name.suffix}'
+
+
+class SymlinkViewBackend:
+    name = 'symlink'
+    suffix = ''
+
+    @staticmethod
+    def available(folder, blobs_folder=None):
+        probe = Path(folder) / f'.probe-{uuid.uuid4().hex}'
+        try:
+            os.symlink(str(Path(folder).resolve()), str(probe))
+        except (OSError, NotImplementedError):
+            return False
+        probe.unlink()
+        return True
+
+    def create(self, blob, view_path):
+        os.symlink(str(Path(blob).resolve()), str(view_path))
+
+    def is_current(self, blob, view_path):
+        return (
+            view_path.is_symlink() and
+            Path(os.readlink(str(view_path))) == Path(blob).resolve())
+
+
+class HardlinkViewBackend:
+    name = 'hardlink'
+    suffix = ''
+
+    @staticmethod
+    def available(folder, blobs_folder=None):
+        # hardlinks cannot cross volumes
+        folder = Path(folder)
+        if (blobs_folder is not None and
+                os.stat(str(blobs_folder)).st_dev !=
+                os.stat(str(folder)).st_dev):
+            return False
+        source = folder / f'.probe-{uuid.uuid4().hex}'
+        probe = folder / f'{source.name}-link'
+        try:
+            source.touch()
+            os.link(str(source), str(probe))
+        except (OSError, NotImplementedError):
+            return False
+        else:
+            probe.unlink()
+            return True
+        finally:
+            if source.exists():
+                source.unlink()
+
+    def create(self, blob, view_path):
+        os.link(str(blob), str(view_path))
+
+    def is_current(self, blob, view_path):
+        return (
+            not view_path.is_symlink() and view_path.exists() and
+            os.path.samefile(str(view_path), str(blob)))
+
+
+class ShortcutViewBackend:
+    '''
+    Windows-only backend creating .lnk shortcuts through WScript.Shell; only
+    available when pywin32 is installed
+    '''
+    name = 'shortcut'
+    suffix = '.lnk'
+
+    @staticmethod
+    def available(folder, blobs_folder=None):
+        return shortcuts_available()
+
+    def create(self, blob, view_path):
+        create_shortcut(blob, view_path)
+
+    def is_current(self, blob, view_path):
+        # shortcuts cannot be cheaply inspected; since view names embed the
+        # blob md5, an existing shortcut is assumed to point at its blob
+        return view_path.exists()
+
+
+VIEW_BACKENDS = {
+    backend.name: backend for backend in [
+        ShortcutViewBackend,
+        SymlinkViewBackend,
+        HardlinkViewBackend
+    ]
+}
+
+
+def select_view_backend(folder, mode='auto', blobs_folder=None):
+    '''
+    Picks the backend used to create view entries; in `auto` mode, windows
+    shortcuts are preferred when available (matching existing view
+    folders), then symlinks, then hardlinks
+    '''
+    if mode != 'auto':
+        backend = VIEW_BACKENDS[mode]
+        assert backend.available(folder, blobs_folder), (
+            f'view backend {mode} is not available here')
+        return backend()
+    for backend in VIEW_BACKENDS.values():
+        if backend.available(folder, blobs_folder):
+            return backend()
+
+
+class ViewBuilder:
+    def __init__(self, blobs_folder, view_folder, backend):
+        self.blobs_folder = Path(blobs_folder)
+        self.view_folder = Path(view_folder)
+        self.backend = backend
+
+        # backends after this one with the same entry names, tried for
+        # entries this one fails to create (e.g. a hardlink across volumes)
+        backends = list(VIEW_BACKENDS.values())
+        self.fallbacks = [
+            backend_class()
+            for backend_class in backends[
+                backends.index(type(backend)) + 1:]
+            if backend_class.suffix == backend.suffix]
+
+    def view_path(self, file_name, blob_id):
+        return (
+            self.view_folder /
+            f'{view_name(file_name, blob_id)}{self.backend.suffix}')
+
+    def add(self, file_name, blob_id):
+        # as in `rebuild`, only blobs stored as plain files get an entry
+        blob = self.blobs_folder / blob_id
+        if not blob.exists():
+            return
+        view_path = self.view_path(file_name, blob_id)
+        if not view_path.exists() and not view_path.is_symlink():
+            self.create(blob, view_path)
+
+    def create(self, blob, view_path):
+        '''
+        Creates a view entry with the first backend that manages to; the
+        view is only a convenience, so an entry that no backend can create
+        is left out rather than failing the caller
+
+        @return: whether the entry got created
+        '''
+        for backend in [self.backend] + self.fallbacks:
+            try:
+                backend.create(blob, view_path)
+            except (OSError, NotImplementedError) as e:
+                error = e
+            else:
+                return True
+        print(f'cannot create view entry {view_path.name} ({error})')
+        return False
+
+    def is_current(self, blob, view_path):
+        return any(
+            backend.is_current(blob, view_path)
+            for backend in [self.backend] + self.fallbacks)
+
+    def rebuild(self, file_names, workers=8, dry_run=False):
+        '''
+        Brings the view folder in line with the given mapping of original
+        file name to blob ids, touching only entries that are missing, stale
+        or no longer wanted
+
+        @param file_names: mapping of original file name to list of blob ids
+        @param workers: number of threads creating/removing entries
+        @param dry_run: only compute and return what would change
+        @return: dict with the created, failed, removed and unchanged counts
+        '''
+        wanted = {}
+        for file_name, blob_ids in file_names.items():
+            for blob_id in blob_ids:
+                blob = self.blobs_folder / blob_id
+                if blob.exists():
+                    wanted[self.view_path(file_name, blob_id).name] = blob
+
+        existing = {
+            entry.name: Path(entry.path)
+            for entry in os.scandir(str(self.view_folder))}
+
+        to_remove = [
+            path for name, path in existing.items()
+            if name not in wanted or
+            not self.is_current(wanted[name], path)]
+        removed_names = {path.name for path in to_remove}
+        to_create = [
+            (blob, self.view_folder / name)
+            for name, blob in wanted.items()
+            if name not in existing or name in removed_names]
+
+        failed = 0
+        if not dry_run:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(lambda path: path.unlink(), to_remove))
+                failed = sum(
+                    not created for created in executor.map(
+                        lambda item: self.create(*item), to_create))
+
+        return {
+            'backend': self.backend.name,
+            'created': len(to_create) - failed,
+            'failed': failed,
+            'removed': len(to_remove),
+            'unchanged': len(wanted) - len(to_create)
+        }